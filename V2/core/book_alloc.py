@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+
+from .book_io import atomic_write_json
+from .book_modify import book_pach_alloc
+
+# 槽位分配状态 (db/alloc.json)：每个数据目录最后一个分片的编号、其中的记录数，以及写入后该分片的 mtime/size。
+#   {"data": {"file": 12, "count": 345, "mtime": ..., "size": ...}, "data-b": {...}}
+# 分配槽位时只需读这个小文件并 stat 两次 (最后一个分片和它的下一个编号)，与分片总数无关；
+# 不用再 listdir 整个目录、逐个匹配文件名、再完整解析最后一个分片来数记录。
+# 分片被其他途径改写 (时间戳对不上) 或出现了更新的分片时状态作废，调用方退回目录扫描并重新登记。
+_lock = threading.Lock()
+
+
+def _load_state():
+    try:
+        with open(book_pach_alloc(), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def tail_slot(section, base_dir, prefix):
+    """
+    读取分配状态。
+
+    :param section: "data" 或 "data-b"
+    :param prefix: 分片文件名前缀 ("book-" 或 "book-b-")
+    :return: (最后一个分片编号, 其中的记录数)；状态缺失或已过期时返回 None
+    """
+    entry = _load_state().get(section)
+    if not isinstance(entry, dict):
+        return None
+    try:
+        file_index = entry["file"]
+        st = os.stat(os.path.join(base_dir, f"{prefix}{file_index}.json"))
+        if st.st_mtime_ns != entry["mtime"] or st.st_size != entry["size"]:
+            return None
+        count = entry["count"]
+    except (OSError, KeyError, TypeError):
+        return None
+    if os.path.exists(os.path.join(base_dir, f"{prefix}{file_index + 1}.json")):
+        return None
+    return file_index, count
+
+
+def record_tail(section, file_path, file_index, count):
+    """
+    分片写入后登记分配状态 (必须在分片落盘之后调用，记录的是写入后的时间戳)。
+
+    :param file_path: 刚写入的分片路径，必须是该目录中编号最大的分片
+    :param count: 分片中的记录数
+    """
+    try:
+        st = os.stat(file_path)
+        with _lock:
+            state = _load_state()
+            state[section] = {"file": file_index, "count": count, "mtime": st.st_mtime_ns, "size": st.st_size}
+            atomic_write_json(book_pach_alloc(), state)
+    except OSError as e:
+        # 分配状态只是加速手段，写不进去时下次分配退回目录扫描，不影响已经写入的数据
+        print(f"⚠️ 警告: 分配状态写入失败: {e}")
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .book_baidu import get_all_copies_by_mother_id_optimized, get_book_record_by_id, get_book_records_by_ids
+from .book_index import read_index_files
+from .book_modify import book_pach_index
+
+# 读取路径的 asyncio 版本。
+#
+# 底层仍是同步的文件读取 (偏移表、共享缓存、分片锁、预写日志叠加都沿用 book_baidu 的实现)，
+# 这里把它们放进一个有上限的线程池执行，并按分片拆开并发：一页涉及 10 个分片时，
+# 10 次读取同时进行，而不是一个接一个地等磁盘。JSON 解码仍受 GIL 限制，重叠的主要是磁盘等待。
+#
+# 线程池上限防止一次大查询开出几百个线程；多个协程共享同一个线程池，总并发不超过 IO_WORKERS。
+#
+# 界面的工作线程 (QThreadPool) 是同步代码，通过 run_coroutine 把协程交给一个常驻的事件循环执行。
+# 不在每次查询时 asyncio.run：那样每次都要新建、关闭一个事件循环；
+# 也不能给每个工作线程存一个：QThreadPool 每次执行任务都换一个新的 Python 线程状态，threading.local 存不住。
+IO_WORKERS = 8
+
+_executor = None
+_loop = None
+_executor_lock = threading.Lock()
+
+
+def get_io_executor():
+    """返回共享的读取线程池，第一次使用时创建。"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="book-io")
+        return _executor
+
+
+def _get_loop():
+    """返回常驻的事件循环，第一次使用时创建，并在一个后台线程中一直运行。"""
+    global _loop
+    with _executor_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="book-io-loop", daemon=True).start()
+        return _loop
+
+
+def run_coroutine(coro):
+    """
+    在常驻的事件循环中执行协程，阻塞等待并返回结果 (协程抛出的异常原样抛出)。
+    供工作线程等同步代码调用，不能在协程内部调用。
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+def shutdown_io_executor():
+    """关闭读取线程池和事件循环 (程序退出前调用)；之后再使用会重新创建。"""
+    global _executor, _loop
+    with _executor_lock:
+        executor, _executor = _executor, None
+        loop, _loop = _loop, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if loop is not None:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+async def run_io(func, *args):
+    """在读取线程池中执行同步函数 func(*args)。"""
+    return await asyncio.get_running_loop().run_in_executor(get_io_executor(), func, *args)
+
+
+async def get_book_record_by_id_async(book_id):
+    """get_book_record_by_id 的异步版本。"""
+    return await run_io(get_book_record_by_id, book_id)
+
+
+async def get_book_records_by_ids_async(book_ids):
+    """
+    批量读取多条母本记录：按分片分组，各分片并发读取。
+
+    :param book_ids: 母本 ID 列表
+    :return: 与 book_ids 顺序一致的记录列表，找不到或 ID 格式错误的位置为 None
+    """
+    # 分片号 -> [(结果下标, 母本 ID), ...]；格式错误的 ID 归为一组，由同步函数打印警告
+    groups = {}
+    for pos, book_id in enumerate(book_ids):
+        parts = book_id.split('-')
+        groups.setdefault(parts[1] if len(parts) == 3 else None, []).append((pos, book_id))
+
+    members = list(groups.values())
+    results = await asyncio.gather(*(
+        run_io(get_book_records_by_ids, [book_id for _, book_id in group]) for group in members))
+
+    records = [None] * len(book_ids)
+    for group, group_records in zip(members, results):
+        for (pos, _), record in zip(group, group_records):
+            records[pos] = record
+    return records
+
+
+async def get_all_copies_by_mother_id_async(mother_id):
+    """get_all_copies_by_mother_id_optimized 的异步版本。"""
+    return await run_io(get_all_copies_by_mother_id_optimized, mother_id)
+
+
+async def get_book_detail_async(mother_id):
+    """
+    同时读取一本书的母本记录和全部副本 (详情窗口使用)。
+
+    :return: (母本记录, 副本列表)；某一项读取失败时该位置是它抛出的异常，另一项不受影响
+    """
+    mother_info, copies = await asyncio.gather(
+        get_book_record_by_id_async(mother_id), get_all_copies_by_mother_id_async(mother_id),
+        return_exceptions=True)
+    return mother_info, copies
+
+
+async def read_index_files_async(index_pach=None, keys=None):
+    """
+    read_index_files 的异步版本。
+
+    索引文件要和索引差量日志在同一把共享锁内读取，日志也只叠加一次，
+    所以整个读取交给一个线程完成，不再按文件拆开。
+
+    :return: {索引名: 索引字典}；任一缺失或损坏时返回 None
+    """
+    return await run_io(read_index_files, index_pach or book_pach_index(), keys)
@@ -0,0 +1,100 @@
+from bisect import bisect_left, insort
+
+# 拼音是可选功能 (可选依赖 pypinyin，见 README)：没有安装时只支持按作者名前缀查询
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+
+_pinyin_warned = False
+
+# 前缀区间的上界：任何以 prefix 开头的字符串都小于 prefix + _MAX_CHAR
+_MAX_CHAR = "\U0010ffff"
+
+
+def _prefix_range(keys, prefix):
+    """
+    有序列表中以 prefix 开头的元素所在的下标区间 [lo, hi)，两次二分查找。
+
+    :param prefix: 字符串，或 (字符串,) 形式的元组 (列表元素为以该字符串开头的元组时使用)
+    """
+    if isinstance(prefix, tuple):
+        return bisect_left(keys, prefix), bisect_left(keys, (prefix[0] + _MAX_CHAR,))
+    return bisect_left(keys, prefix), bisect_left(keys, prefix + _MAX_CHAR)
+
+
+def warn_if_pinyin_missing():
+    """没有安装 pypinyin 时打印一次提示 (启动加载内存索引时调用)，之后再调用不重复提示。"""
+    global _pinyin_warned
+    if lazy_pinyin is None and not _pinyin_warned:
+        _pinyin_warned = True
+        print("⚠️ 提示: 未安装可选依赖 pypinyin，作者只能按名字前缀搜索，不支持拼音 (pip install pypinyin)。")
+
+
+def pinyin_keys(author):
+    """
+    作者名的拼音检索键：全拼 (zhangwei) 和首字母 (zw)，均为小写。
+    没有安装 pypinyin 时返回空列表。
+    """
+    if lazy_pinyin is None:
+        return []
+    full = "".join(lazy_pinyin(author)).lower().replace(" ", "")
+    initials = "".join(lazy_pinyin(author, style=Style.FIRST_LETTER)).lower().replace(" ", "")
+    return [full, initials] if full != initials else [full]
+
+
+class AuthorPrefixIndex:
+    """
+    作者名的有序键索引，支持按名字前缀、拼音全拼前缀、拼音首字母前缀查询，每次查询是 O(log n) 的二分查找。
+
+    拼音键的计算相对较慢，第一次用拼音查询时才生成，之后随作者的增删同步维护。
+    本身不加锁，由持有它的 IndexService 负责同步。
+    """
+
+    def __init__(self, authors=()):
+        self._authors = sorted(set(authors))
+        # [(拼音键, 作者名), ...] 按拼音键排序；None 表示尚未生成
+        self._pinyin = None
+
+    def add(self, author):
+        pos = bisect_left(self._authors, author)
+        if pos < len(self._authors) and self._authors[pos] == author:
+            return
+        self._authors.insert(pos, author)
+        if self._pinyin is not None:
+            for key in pinyin_keys(author):
+                insort(self._pinyin, (key, author))
+
+    def remove(self, author):
+        pos = bisect_left(self._authors, author)
+        if pos == len(self._authors) or self._authors[pos] != author:
+            return
+        del self._authors[pos]
+        if self._pinyin is not None:
+            for key in pinyin_keys(author):
+                pos = bisect_left(self._pinyin, (key, author))
+                if pos < len(self._pinyin) and self._pinyin[pos] == (key, author):
+                    del self._pinyin[pos]
+
+    def _pinyin_entries(self):
+        if self._pinyin is None:
+            self._pinyin = sorted((key, author) for author in self._authors for key in pinyin_keys(author))
+        return self._pinyin
+
+    def match(self, prefix):
+        """
+        返回名字以 prefix 开头，或拼音全拼/首字母以 prefix 开头的作者名集合。
+
+        :param prefix: 输入的搜索词；只含字母时才按拼音查询
+        """
+        if not prefix:
+            return set()
+        lo, hi = _prefix_range(self._authors, prefix)
+        authors = set(self._authors[lo:hi])
+
+        key = prefix.lower().replace(" ", "")
+        if lazy_pinyin is not None and key.isascii() and key.isalpha():
+            entries = self._pinyin_entries()
+            lo, hi = _prefix_range(entries, (key,))
+            authors.update(author for _, author in entries[lo:hi])
+        return authors
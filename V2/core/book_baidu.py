@@ -1,45 +1,29 @@
+import copy
 import json
 import os
 import re
+import threading
+from bisect import bisect_left, bisect_right
+
 from natsort import natsorted
+from .book_alloc import record_tail, tail_slot
+from .book_cache import invalidate_shard, read_shard
+from .book_copyloc import read_located_copies
+from .book_io import atomic_write_json, repair_shard
+from .book_lock import file_lock
 from .book_modify import book_pach_db_data, book_pach_db_data_b, book_pach_index
+from .book_shard import read_records
+from .book_wal import overlay_record
 
 
-def read_json_files_in_directory(directory):
-    json_data = []
-
-    # 1. 获取目录中的所有文件名列表
-    all_files = os.listdir(directory)
-
-    # 检查目录是否为空
-    if not all_files:
-        print(f"目录 {directory} 为空，没有文件。")
-        return json_data  # 返回空列表
-
-    # 2. 【关键修改】筛选并对 JSON 文件名进行排序
-    json_filenames = [f for f in all_files if f.endswith(".json")]
-
-    json_filenames = natsorted(json_filenames)
-
-    # 3. 遍历排序后的文件名列表
-    for filename in json_filenames:
-        file_path = os.path.join(directory, filename)
-
-        # 尝试打开并加载JSON文件
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-                # 按照排序后的顺序将内容追加到列表中
-                json_data.append(data)
-        except json.JSONDecodeError:
-            print(f"文件 {filename} 格式错误")
-        except PermissionError:
-            print(f"没有权限读取文件 {filename}")
-        except FileNotFoundError:
-            # 虽然 os.listdir 提供了文件名，但最好还是处理一下
-            print(f"文件 {filename} 未找到")
-
-    return json_data
+def list_json_files(directory):
+    """
+    返回目录下按自然顺序排序的 JSON 文件名列表 (book-2.json 排在 book-10.json 之前)。
+    目录不存在时返回空列表。
+    """
+    if not os.path.isdir(directory):
+        return []
+    return natsorted(f for f in os.listdir(directory) if f.endswith(".json"))
 
 
 def read_json_file(file_path):
@@ -59,56 +43,67 @@ FIXED_CATEGORY_CODE = '1'
 DB_PREFIX = "book-"
 
 
-def find_next_available_book_slot():
-    base_dir = book_pach_db_data()
+def _latest_shard(section, base_dir, prefix):
     """
-    基于文件连续性原则，查找最大的文件序号，并确定下一个可用的图书槽位。
+    找到目录中编号最大的分片及其记录数。
 
-    :param base_dir: 存放 book-[N].json 文件的基础目录。
-    :return: (file_path, next_full_id)
+    先查持久化的分配状态 (只读一个小文件、stat 两次，与分片数量无关)；
+    状态缺失或过期时才扫描目录、解析最大的分片，并重新登记分配状态。
+
+    :return: (最大分片编号, 其中的记录数)
     """
-    if not os.path.exists(base_dir):
-        # 目录不存在，创建第一个文件 book-1.json
-        os.makedirs(base_dir)
-        file_path = os.path.join(base_dir, f"{DB_PREFIX}1.json")
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump({}, f)
-        return file_path, f"{FIXED_CATEGORY_CODE}-1-{1:03d}"
+    tail = tail_slot(section, base_dir, prefix)
+    if tail is not None:
+        return tail
 
     # ----------------------------------------------------
     # 1. 查找最大的文件序号 (N)
     # ----------------------------------------------------
+    os.makedirs(base_dir, exist_ok=True)
     latest_index = 0
-    pattern = re.compile(f"^{DB_PREFIX}(\d+)\.json$")
+    pattern = re.compile(rf"^{prefix}(\d+)\.json$")
 
     for filename in os.listdir(base_dir):
         match = pattern.match(filename)
         if match:
             latest_index = max(latest_index, int(match.group(1)))
 
-    # 如果目录为空，则从 book-1.json 开始
+    # 如果目录为空，则从 1 号文件开始
     if latest_index == 0:
         latest_index = 1
 
-    file_path = os.path.join(base_dir, f"{DB_PREFIX}{latest_index}.json")
+    file_path = os.path.join(base_dir, f"{prefix}{latest_index}.json")
+    if not os.path.exists(file_path):
+        atomic_write_json(file_path, {}, checksum=True)
 
     # ----------------------------------------------------
-    # 2. 检查最大的文件 book-N.json
+    # 2. 检查最大的文件
     # ----------------------------------------------------
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = read_shard(file_path)
     except json.JSONDecodeError:
-        # 文件损坏：基于新的约束，我们仍然需要跳过它，但应该检查下一个文件
-        print(f"🚨 警告: 文件 {file_path} 内容损坏。已跳过此文件。")
-        # 由于文件连续，损坏的文件视为“已满”，我们检查下一个文件 N+1
-        latest_index += 1
-        return create_new_book_file(base_dir, latest_index)
+        # 文件损坏：抢救其中完好的记录后原子写回 (原文件另存为 .corrupt)，不能把它当作“已满”跳过，
+        # 否则它的空位永远不会再被使用，其中的记录也无从查找
+        print(f"🚨 警告: 文件 {file_path} 内容损坏，正在修复...")
+        data = repair_shard(file_path)
+        invalidate_shard(file_path)
+
+    record_tail(section, file_path, latest_index, len(data))
+    return latest_index, len(data)
 
-    current_count = len(data)
+
+def find_next_available_book_slot():
+    """
+    基于文件连续性原则，查找最大的文件序号，并确定下一个可用的图书槽位。
+
+    :return: (file_path, next_full_id)
+    """
+    base_dir = book_pach_db_data()
+    latest_index, current_count = _latest_shard("data", base_dir, DB_PREFIX)
 
     if current_count < MAX_RECORDS:
         # 文件未满，直接使用
+        file_path = os.path.join(base_dir, f"{DB_PREFIX}{latest_index}.json")
         next_book_num = current_count + 1
         next_id = f"{FIXED_CATEGORY_CODE}-{latest_index}-{next_book_num:03d}"
         return file_path, next_id
@@ -121,8 +116,8 @@ def find_next_available_book_slot():
 # 辅助函数：创建新文件并返回信息
 def create_new_book_file(base_dir, file_index):
     new_file_path = os.path.join(base_dir, f"{DB_PREFIX}{file_index}.json")
-    with open(new_file_path, 'w', encoding='utf-8') as f:
-        json.dump({}, f)
+    atomic_write_json(new_file_path, {}, checksum=True)
+    record_tail("data", new_file_path, file_index, 0)
     print(f"创建新文件: {new_file_path}")
     next_id = f"{FIXED_CATEGORY_CODE}-{file_index}-{1:03d}"
     return new_file_path, next_id
@@ -132,50 +127,17 @@ DB_PREFIX_B = "book-b-"
 
 
 def find_next_available_copy_slot():
-    base_dir = book_pach_db_data_b()
     """
     基于文件连续性原则，查找最大的副本文件序号，并返回该文件剩余的存储容量。
-    """
-    if not os.path.exists(base_dir):
-        # 目录不存在，创建第一个文件 book-b-1.json
-        os.makedirs(base_dir)
-        file_path = os.path.join(base_dir, f"{DB_PREFIX_B}1.json")
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump({}, f)
-        return file_path, MAX_RECORDS
-
-    # ----------------------------------------------------
-    # 1. 查找最大的文件序号 (N)
-    # ----------------------------------------------------
-    latest_index = 0
-    pattern = re.compile(f"^{DB_PREFIX_B}(\d+)\.json$")
-
-    for filename in os.listdir(base_dir):
-        match = pattern.match(filename)
-        if match:
-            latest_index = max(latest_index, int(match.group(1)))
-
-    if latest_index == 0:
-        latest_index = 1
-
-    file_path = os.path.join(base_dir, f"{DB_PREFIX_B}{latest_index}.json")
-
-    # ----------------------------------------------------
-    # 2. 检查最大的文件 book-b-N.json
-    # ----------------------------------------------------
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except json.JSONDecodeError:
-        # 文件损坏：跳过，并返回下一个新文件 (N+1) 的最大容量
-        print(f"🚨 警告: 副本文件 {file_path} 内容损坏。已跳过此文件。")
-        latest_index += 1
-        return create_new_copy_file(base_dir, latest_index)
 
-    current_count = len(data)
+    :return: (file_path, remaining_slots)
+    """
+    base_dir = book_pach_db_data_b()
+    latest_index, current_count = _latest_shard("data-b", base_dir, DB_PREFIX_B)
 
     if current_count < MAX_RECORDS:
         # 文件未满，计算剩余容量并返回
+        file_path = os.path.join(base_dir, f"{DB_PREFIX_B}{latest_index}.json")
         remaining_slots = MAX_RECORDS - current_count
         return file_path, remaining_slots
     else:
@@ -187,8 +149,8 @@ def find_next_available_copy_slot():
 # 辅助函数：创建新副本文件并返回信息
 def create_new_copy_file(base_dir, file_index):
     new_file_path = os.path.join(base_dir, f"{DB_PREFIX_B}{file_index}.json")
-    with open(new_file_path, 'w', encoding='utf-8') as f:
-        json.dump({}, f)
+    atomic_write_json(new_file_path, {}, checksum=True)
+    record_tail("data-b", new_file_path, file_index, 0)
     print(f"创建新副本文件: {new_file_path}")
     return new_file_path, MAX_RECORDS
 
@@ -226,13 +188,20 @@ def get_book_record_by_id(book_id):
         print(f"错误: 找不到 ID {book_id} 对应的文件: {file_path}")
         return None
 
-    # 4. 读取文件并查找指定 ID
+    # 4. 读取文件并查找指定 ID：偏移表可用时只解码这一条记录；
+    #    否则经共享缓存整体读取分片，连续查询同一分片时只解析一次。读取期间持有分片的共享锁
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with file_lock(file_path):
+            # 返回前叠加预写日志中尚未合并的字段修改
+            records = read_records(file_path, [book_id])
+            if records is not None:
+                return overlay_record(book_id, records[book_id])
 
-            # 查找并返回该 ID 对应的记录
-            return data.get(book_id)
+            data = read_shard(file_path)
+
+        # 缓存内容是共享的，返回副本，调用方可以随意修改
+        record = data.get(book_id)
+        return overlay_record(book_id, copy.deepcopy(record)) if record is not None else None
 
     except json.JSONDecodeError:
         print(f"警告: 文件 {file_path} 内容损坏，无法读取。")
@@ -242,76 +211,174 @@ def get_book_record_by_id(book_id):
         return None
 
 
+def get_book_records_by_ids(book_ids):
+    """
+    批量读取多条母本记录：按 ID 中编码的分片号分组，每个分片只读取一次。
+
+    :param book_ids: 母本 ID 列表 (e.g., ['1-3-010', '1-3-011', '1-4-001'])
+    :return: 与 book_ids 顺序一致的记录列表，找不到或 ID 格式错误的位置为 None
+    """
+    # 分片号 -> [(结果下标, 母本 ID), ...]
+    groups = {}
+    for pos, book_id in enumerate(book_ids):
+        parts = book_id.split('-')
+        if len(parts) != 3:
+            print(f"警告: 母本 ID 格式错误: {book_id}")
+            continue
+        groups.setdefault(parts[1], []).append((pos, book_id))
+
+    records = [None] * len(book_ids)
+    base_dir = book_pach_db_data()
+    for file_index, members in groups.items():
+        file_path = os.path.join(base_dir, f"book-{file_index}.json")
+        try:
+            # 偏移表可用时逐条解码需要的记录，否则整体读取分片 (持有分片的共享锁)
+            with file_lock(file_path):
+                located = read_records(file_path, [book_id for _, book_id in members])
+                data = read_shard(file_path) if located is None else None
+            if located is not None:
+                for pos, book_id in members:
+                    records[pos] = overlay_record(book_id, located[book_id])
+                continue
+        except json.JSONDecodeError:
+            print(f"警告: 文件 {file_path} 内容损坏，无法读取。")
+            continue
+        except Exception as e:
+            print(f"读取文件 {file_path} 时发生错误: {e}")
+            continue
+
+        for pos, book_id in members:
+            record = data.get(book_id)
+            if record is not None:
+                # 缓存内容是共享的，返回副本
+                records[pos] = overlay_record(book_id, copy.deepcopy(record))
+    return records
+
+
+class _BoundaryCache:
+    """
+    边界索引的解析结果缓存。
+
+    边界 ID 预先解析成整数元组并按文件顺序排成数组，查询时用二分查找，
+    不再每次读取 JSON 并逐项解析比较。以边界索引文件的 mtime/size 判断缓存是否过期，
+    写入新书后边界索引被改写，下一次查询会自动重新加载。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stamp = None
+        self.filenames = []
+        self.starts = []
+        self.ends = []
+        # 区间按文件顺序单调不减时才能二分；索引被手工改乱时退回线性扫描
+        self.monotonic = True
+
+    def refresh(self, boundary_index_path):
+        """必要时重新加载，返回 False 表示边界索引缺失或为空。"""
+        try:
+            st = os.stat(boundary_index_path)
+        except OSError:
+            return False
+        stamp = (boundary_index_path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stamp == self._stamp:
+                return bool(self.filenames)
+
+            boundary_index = read_json_file(boundary_index_path) or {}
+            filenames = natsorted(boundary_index)
+            starts = [tuple(parse_id(boundary_index[f][0])) for f in filenames]
+            ends = [tuple(parse_id(boundary_index[f][1])) for f in filenames]
+
+            self.filenames, self.starts, self.ends = filenames, starts, ends
+            self.monotonic = all(starts[i] <= starts[i + 1] and ends[i] <= ends[i + 1] for i in range(len(starts) - 1))
+            self._stamp = stamp
+            return bool(filenames)
+
+    def lookup(self, mother_parts):
+        """返回区间 [首母本, 尾母本] 包含 mother_parts 的文件名列表。"""
+        with self._lock:
+            filenames, starts, ends = self.filenames, self.starts, self.ends
+            if self.monotonic:
+                # 首母本 <= 目标 的文件在前 hi 个；尾母本 >= 目标 的文件从 lo 开始
+                lo = bisect_left(ends, mother_parts)
+                hi = bisect_right(starts, mother_parts)
+                return filenames[lo:hi]
+            return [f for f, start, end in zip(filenames, starts, ends) if start <= mother_parts <= end]
+
+
+_boundary_cache = _BoundaryCache()
+
+
 def find_relevant_copy_files(mother_id):
     """
     使用边界索引，查找所有可能包含目标母本副本的文件名列表。
+    边界索引在进程内缓存为有序整数元组数组，每次查询是两次二分查找。
 
     :param mother_id: 目标母本 ID (e.g., '1-3-010')
     :return: 包含相关副本的文件名列表 (e.g., ['book-b-2.json', 'book-b-3.json'])
     """
-    index_pach = book_pach_index()
-    boundary_index_path = os.path.join(index_pach, "book-sw-index.json")
-
-    boundary_index = read_json_file(boundary_index_path)
+    boundary_index_path = os.path.join(book_pach_index(), "book-sw-index.json")
 
-    if not boundary_index:
+    if not _boundary_cache.refresh(boundary_index_path):
         print("警告: 边界索引文件为空或读取失败。")
         return []
 
-    relevant_files = []
-
-    # 预解析 mother_id 为整数列表，用于高效、准确的数值比较
-    mother_parts = parse_id(mother_id)
+    return _boundary_cache.lookup(tuple(parse_id(mother_id)))
 
-    for filename in boundary_index:
-        start_mid_str, end_mid_str = boundary_index[filename]
 
-        # 将边界 ID 转换为整数列表
-        start_parts = parse_id(start_mid_str)
-        end_parts = parse_id(end_mid_str)
-
-        # --------------------- 1. 提前终止检查 ----------------------
-        # 完整的列表比较：如果 mother_id 整体小于 start_mid，则立即终止。
-        if mother_parts < start_parts:
-            break
-
-        # --------------------- 2. 核心范围判断 ----------------------
-        # 完整的列表比较：检查 mother_id 是否小于等于 end_mid。
-        if mother_parts <= end_parts:
-            relevant_files.append(filename)
-
-    return relevant_files
+def _copy_details(copies):
+    # 把 copy_id 键/值对添加到副本信息字典中，UI 端的表格通过 'copy_id' 键取值；
+    # 叠加预写日志中尚未合并的修改，并使用 .copy() 以免修改原始数据库记录
+    details = []
+    for copy_id, copy_info in copies.items():
+        copy_detail = overlay_record(copy_id, copy_info).copy()
+        copy_detail['copy_id'] = copy_id
+        details.append(copy_detail)
+    return details
 
 
 def get_all_copies_by_mother_id_optimized(mother_id):
     """
     根据母本 ID 高效找到其所有副本内容列表（仅返回副本信息）。
-    利用边界索引定位文件，并利用 ID 结构直接匹配。
+    优先在副本位置索引上二分查找副本所在的字节区间，只读取那一段；位置索引不可用 (缺失或已过期) 时，
+    退回利用边界索引定位文件、逐文件查找。
 
     :param mother_id: 完整的母本 ID (e.g., '1-3-010')
     :return: 包含所有副本信息字典的列表, 格式为 [{...}, {...}]。
     """
+    located = read_located_copies(mother_id)
+    if located is not None:
+        all_copy_details = []
+        for _, copies in located:
+            all_copy_details.extend(_copy_details(copies))
+        return all_copy_details
 
-    # --- 阶段 1: 定位相关副本文件 ---
-    relevant_files = find_relevant_copy_files(mother_id)
-
-    if not relevant_files:
-        return []
+    all_copy_details = []
+    for _, copies in _scan_copy_files(mother_id):
+        all_copy_details.extend(_copy_details(copies))
+    return all_copy_details
 
-    # --- 阶段 2: 逐文件读取并提取副本 ---
 
-    all_copy_details = []
+def _scan_copy_files(mother_id):
+    """
+    利用边界索引定位文件，并利用 ID 结构直接匹配，逐文件产出 (副本文件路径, {副本ID: 副本记录})。
+    """
     base_copy_dir = book_pach_db_data_b()
 
-    for filename in relevant_files:
+    for filename in find_relevant_copy_files(mother_id):
         file_path = os.path.join(base_copy_dir, filename)
 
-        # 读取文件内容：{副本ID: 副本信息字典}
-        copy_records_dict = read_json_file(file_path)
+        # 读取文件内容：{副本ID: 副本信息字典} (经共享缓存，内容只读)
+        try:
+            with file_lock(file_path):
+                copy_records_dict = read_shard(file_path)
+        except json.JSONDecodeError:
+            copy_records_dict = {}
 
         if not copy_records_dict:
             continue
 
+        copies = {}
         for copy_id, copy_info in copy_records_dict.items():
 
             # 从副本 ID 提取母本 ID
@@ -319,20 +386,30 @@ def get_all_copies_by_mother_id_optimized(mother_id):
 
             # 检查是否是目标母本的副本
             if current_mother_id == mother_id:
-                # ⭐️ 关键修改：将 copy_id 键/值对添加到副本信息字典中
-                # 这样做可以确保 UI 端的表格能够通过 'copy_id' 键获取到值。
-                # 使用 .copy() 以免修改原始数据库记录
-                copy_detail = copy_info.copy()
-                copy_detail['copy_id'] = copy_id
+                copies[copy_id] = copy_info
 
-                all_copy_details.append(copy_detail)
-
-            elif current_mother_id > mother_id:
-                # 优化：按母本 ID 排序，超出范围即可停止当前文件的查找。
+            elif copies:
+                # 优化：同一母本的副本是连续存放的，匹配段结束即可停止当前文件的查找。
                 break
+        if copies:
+            yield file_path, copies
 
-    # --- 阶段 3: 返回结果 ---
-    return all_copy_details
+
+def find_copy_file(copy_id):
+    """
+    找到副本记录所在的副本文件。同一母本的副本可能分布在两个文件中，需要逐个确认。
+
+    :param copy_id: 完整的副本 ID (e.g., '1-3-010-1')
+    :return: 副本文件完整路径，找不到时返回 None
+    """
+    mother_id = copy_id.rsplit('-', 1)[0]
+    located = read_located_copies(mother_id)
+    if located is None:
+        located = _scan_copy_files(mother_id)
+    for file_path, copies in located:
+        if copy_id in copies:
+            return file_path
+    return None
 
 
 def parse_id(id_str):
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# 解码后的 Python 对象比 JSON 文本大得多，按文件大小的这个倍数估算一个分片占用的内存
+DECODED_SIZE_FACTOR = 6
+# 默认内存预算 (字节)，约可容纳几十个 999 条记录的分片
+DEFAULT_CACHE_BUDGET = 256 * 1024 * 1024
+
+
+class ShardCache:
+    """
+    按内存预算淘汰的分片 LRU 缓存：{文件路径: 解码后的分片内容}。
+
+    每次读取先 stat 文件，mtime/size 与缓存时不一致就重新解析；
+    本进程内的写函数 (book_jiajia) 写完后还会主动调用 invalidate，不依赖文件系统的时间戳精度。
+    缓存的内容由所有读取方共享，调用方不得修改，需要修改时先复制。
+    """
+
+    def __init__(self, budget=DEFAULT_CACHE_BUDGET):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # 路径 -> (mtime_ns, size, 估算内存, 内容)
+        self._used = 0
+        self.budget = budget
+        # 每次 invalidate 加一：解析期间发生过写入时，解析结果可能是旧内容，不放入缓存
+        self._generation = 0
+
+    def get(self, file_path):
+        """
+        读取分片。文件不存在时返回 {}；内容损坏时抛出 json.JSONDecodeError (不缓存)。
+        """
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            self.invalidate(file_path)
+            return {}
+
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                self._entries.move_to_end(file_path)
+                return entry[3]
+            generation = self._generation
+
+        # 在锁外解析，慢的磁盘读取不会阻塞其他分片的命中
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self._put(file_path, (st.st_mtime_ns, st.st_size, st.st_size * DECODED_SIZE_FACTOR, data), generation)
+        return data
+
+    def _put(self, file_path, entry, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            old = self._entries.pop(file_path, None)
+            if old is not None:
+                self._used -= old[2]
+            if entry[2] > self.budget:
+                return
+            self._entries[file_path] = entry
+            self._used += entry[2]
+            self._evict()
+
+    def _evict(self):
+        # 调用方持有锁；从最久未使用的一端淘汰，直到回到预算以内
+        while self._used > self.budget:
+            _, evicted = self._entries.popitem(last=False)
+            self._used -= evicted[2]
+
+    def invalidate(self, file_path):
+        with self._lock:
+            self._generation += 1
+            old = self._entries.pop(file_path, None)
+            if old is not None:
+                self._used -= old[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._used = 0
+
+
+_shard_cache = ShardCache()
+
+
+def read_shard(file_path):
+    """通过共享缓存读取一个数据分片 (母本或副本文件)，返回的内容只读。"""
+    return _shard_cache.get(file_path)
+
+
+def invalidate_shard(file_path):
+    """数据分片被改写后调用，丢弃缓存中的旧内容。"""
+    _shard_cache.invalidate(file_path)
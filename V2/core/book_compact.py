@@ -0,0 +1,221 @@
+import json
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+
+from .book_io import atomic_write
+
+# 紧凑索引文件 (.bidx) 布局：
+#   MAGIC (8 字节) | 头部长度 (uint32, 小端) | 头部 JSON | 填充到 8 字节对齐 | int64 数组区
+# 头部 JSON: {"kind": "mother"/"copy", "byteorder": ..., "source": {"mtime": ..., "size": ...},
+#            "keys": {键: [数组区内的起始下标, 数量], ...}}
+# 每个键的 ID 列表被编码成整数后按升序连续存放，读取某个键只需 seek 到对应位置读 count*8 字节。
+MAGIC = b"BKIDX\x00\x01\x00"
+COMPACT_SUFFIX = ".bidx"
+
+# ID 编码：母本 'C-N-XXX' -> (C * 10^7 + N) * 1000 + XXX；副本 'C-N-XXX-K' -> 母本编码 * 10^4 + K
+# 编码值的大小顺序与 ID 的自然顺序一致
+_SHARD_LIMIT = 10 ** 7
+_BOOK_LIMIT = 1000
+_COPY_LIMIT = 10 ** 4
+
+
+def encode_mother_id(book_id):
+    """把母本 ID 编码为整数，无法无损编码时返回 None。"""
+    try:
+        code, shard, num = (int(part) for part in book_id.split('-'))
+    except ValueError:
+        return None
+    if not (0 <= shard < _SHARD_LIMIT and 0 <= num < _BOOK_LIMIT) or code < 0:
+        return None
+    value = (code * _SHARD_LIMIT + shard) * _BOOK_LIMIT + num
+    return value if decode_mother_id(value) == book_id else None
+
+
+def decode_mother_id(value):
+    rest, num = divmod(value, _BOOK_LIMIT)
+    code, shard = divmod(rest, _SHARD_LIMIT)
+    return f"{code}-{shard}-{num:03d}"
+
+
+def encode_copy_id(copy_id):
+    """把副本 ID 编码为整数，无法无损编码时返回 None。"""
+    mother_id, _, copy_num = copy_id.rpartition('-')
+    mother_value = encode_mother_id(mother_id)
+    if mother_value is None or not copy_num.isdigit() or int(copy_num) >= _COPY_LIMIT:
+        return None
+    value = mother_value * _COPY_LIMIT + int(copy_num)
+    return value if decode_copy_id(value) == copy_id else None
+
+
+def decode_copy_id(value):
+    mother_value, copy_num = divmod(value, _COPY_LIMIT)
+    return f"{decode_mother_id(mother_value)}-{copy_num}"
+
+
+def copy_mother_value(value):
+    """副本编码所属母本的编码。"""
+    return value // _COPY_LIMIT
+
+
+_CODECS = {
+    "mother": (encode_mother_id, decode_mother_id),
+    "copy": (encode_copy_id, decode_copy_id),
+}
+
+
+def compact_path(json_path):
+    """JSON 索引文件对应的紧凑索引路径 (book-name-index.json -> book-name-index.bidx)。"""
+    return os.path.splitext(json_path)[0] + COMPACT_SUFFIX
+
+
+def _source_stamp(json_path):
+    st = os.stat(json_path)
+    return {"mtime": st.st_mtime_ns, "size": st.st_size}
+
+
+def encode_index(index, kind):
+    """
+    把 {键: [ID, ...]} 编码为 {键: 按升序排列的编码 ID 列表}。
+
+    :param kind: "mother" 或 "copy"
+    :return: 存在无法编码的 ID 时返回 None
+    """
+    encode = _CODECS[kind][0]
+    encoded = {}
+    for key, ids in index.items():
+        values = [encode(item_id) for item_id in ids]
+        if None in values:
+            return None
+        values.sort()
+        encoded[key] = values
+    return encoded
+
+
+def write_compact_index(json_path, index, kind):
+    """
+    把索引字典写成紧凑格式，文件放在 JSON 索引旁边并记录 JSON 文件的时间戳。
+
+    :param json_path: 已写好的 JSON 索引路径 (作为数据来源)
+    :param index: {键: [ID, ...]}
+    :param kind: "mother" 或 "copy"
+    :return: 成功返回 True；存在无法编码的 ID 时不写入并删除旧的紧凑文件，返回 False
+    """
+    out_path = compact_path(json_path)
+    encoded = encode_index(index, kind)
+    if encoded is None:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        return False
+    write_compact_values(out_path, encoded, kind, source=_source_stamp(json_path))
+    return True
+
+
+def write_compact_values(out_path, index, kind, source=None):
+    """
+    把已经编码好的索引写成紧凑格式。
+
+    :param index: {键: 按升序排列的编码 ID 序列 (list 或 array('q'))}
+    :param source: 数据来源的时间戳，没有对应 JSON 文件的索引 (如 n-gram 索引) 传 None
+    """
+    keys = {}
+    payload = array('q')
+    for key, values in index.items():
+        keys[key] = [len(payload), len(values)]
+        payload.extend(values)
+
+    header = json.dumps({
+        "kind": kind,
+        "byteorder": sys.byteorder,
+        "source": source,
+        "keys": keys,
+    }, ensure_ascii=False).encode('utf-8')
+    padding = (-(len(MAGIC) + 4 + len(header))) % 8
+
+    atomic_write(out_path, MAGIC + struct.pack('<I', len(header)) + header + b"\x00" * padding + payload.tobytes())
+
+
+class CompactIndex(Mapping):
+    """
+    紧凑索引的只读视图。
+
+    构造时只读取头部 (键目录)，按键读取时才 seek 到对应位置解码那一段 ID。
+    不常驻打开文件也不做 mmap：Windows 下打开着的文件无法被写入端替换。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"不是紧凑索引文件: {path}")
+            (header_len,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        self.kind = header["kind"]
+        self.source = header.get("source")
+        self._swap = header.get("byteorder") != sys.byteorder
+        self._decode = _CODECS[self.kind][1]
+        self._directory = header["keys"]
+        data_start = len(MAGIC) + 4 + header_len
+        self._data_start = data_start + (-data_start) % 8
+
+    def __getitem__(self, key):
+        return [self._decode(value) for value in self.get_ints(key)]
+
+    def __iter__(self):
+        return iter(self._directory)
+
+    def __len__(self):
+        return len(self._directory)
+
+    def __contains__(self, key):
+        return key in self._directory
+
+    def count(self, key):
+        """某个键下的 ID 数量，直接来自键目录，不读取数据区。"""
+        entry = self._directory.get(key)
+        return entry[1] if entry else 0
+
+    def counts(self):
+        return {key: entry[1] for key, entry in self._directory.items()}
+
+    def get_ints(self, key):
+        """返回某个键下按升序排列的编码 ID 数组 (array('q'))，键不存在时抛出 KeyError。"""
+        start, count = self._directory[key]
+        values = array('q')
+        if count:
+            with open(self.path, 'rb') as f:
+                f.seek(self._data_start + start * values.itemsize)
+                values.fromfile(f, count)
+            if self._swap:
+                values.byteswap()
+        return values
+
+    def read_all(self):
+        """一次读入整个数据区，返回 {键: array('q')}；用于需要改写整个索引的场合。"""
+        total = sum(count for _, count in self._directory.values())
+        values = array('q')
+        if total:
+            with open(self.path, 'rb') as f:
+                f.seek(self._data_start)
+                values.fromfile(f, total)
+            if self._swap:
+                values.byteswap()
+        return {key: values[start:start + count] for key, (start, count) in self._directory.items()}
+
+
+def open_compact_index(json_path):
+    """
+    打开 JSON 索引对应的紧凑索引。紧凑文件缺失、损坏，或与当前 JSON 文件不一致 (过期) 时返回 None。
+    """
+    path = compact_path(json_path)
+    if not os.path.exists(path) or not os.path.exists(json_path):
+        return None
+    try:
+        index = CompactIndex(path)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+    if index.source != _source_stamp(json_path):
+        return None
+    return index
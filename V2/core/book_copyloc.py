@@ -0,0 +1,190 @@
+import json
+import os
+import re
+import struct
+
+from .book_compact import encode_mother_id
+from .book_io import atomic_write
+from .book_lock import file_lock
+from .book_modify import book_pach_db_data_b, book_pach_index
+from .book_shard import record_spans
+
+# 母本 -> 副本位置索引：每个母本的副本在哪个副本文件、从第几个字节开始、占多少字节、共几条。
+# 定长二进制记录，按 (母本编码, 副本文件编号) 升序排列。查找一个母本在文件上做二分查找
+# (约 log2(记录数) 次 seek，每次读一条记录)，再按记录里的字节区间只读那一段副本，不用解析整个副本分片。
+#
+# 每条记录: 母本编码, 副本文件编号, 起始字节, 字节数, 副本数, 副本文件 mtime_ns, 副本文件大小
+# 副本文件的时间戳和记录一起保存：文件被改写后时间戳对不上，该记录自动作废，调用方退回全文件读取。
+#
+# 全量写入是原子的；单个副本文件的记录替换则是原地修改 (只涉及表尾，原子重写整张表的代价与母本总数成正比)。
+# 原地修改持有位置表的排他锁，查找持有共享锁，不会读到改了一半的表；它们都是最内层的锁，持有时不再取其他锁。
+# 崩溃时写坏的记录也不会返回错误结果：读取时会核对副本 ID 前缀和条数，对不上就退回全文件读取。
+COPY_LOC_FILE = "book-copy-loc.bin"
+_RECORD = struct.Struct('<qIIIIqq')
+_COPY_FILE_NAME = re.compile(r'^book-b-(\d+)\.json$')
+
+
+def copy_loc_path(index_pach=None):
+    if index_pach is None:
+        index_pach = book_pach_index()
+    return os.path.join(index_pach, COPY_LOC_FILE)
+
+
+def copy_file_number(filename):
+    """book-b-12.json -> 12，不符合命名规则时返回 None。"""
+    match = _COPY_FILE_NAME.match(filename)
+    return int(match.group(1)) if match else None
+
+
+def copy_locations(filename, raw, records, stamp):
+    """
+    计算一个副本分片中每个母本的副本所在的字节区间。
+
+    :param filename: 副本文件名
+    :param raw: 文件原始字节
+    :param records: 解析后的 {副本ID: 副本记录}
+    :param stamp: {"mtime": ..., "size": ...} 文件时间戳
+    :return: 位置记录列表；文件名不符合规则或无法定位时返回 []
+    """
+    number = copy_file_number(filename)
+    if number is None or not records:
+        return []
+
+    spans = record_spans(raw, list(records))
+    if spans is None:
+        return []
+
+    rows = []
+    copy_ids = list(records)
+    group_start = 0
+    for i in range(1, len(copy_ids) + 1):
+        mother_id = copy_ids[group_start].rsplit('-', 1)[0]
+        if i < len(copy_ids) and copy_ids[i].rsplit('-', 1)[0] == mother_id:
+            continue
+        value = encode_mother_id(mother_id)
+        if value is not None:
+            start = spans[group_start][0]
+            end = spans[i - 1][1]
+            rows.append((value, number, start, end - start, i - group_start, stamp["mtime"], stamp["size"]))
+        group_start = i
+    return rows
+
+
+def write_copy_locations(rows, index_pach=None):
+    """全量写入位置索引，rows 必须已按 (母本编码, 副本文件编号) 排序。"""
+    atomic_write(copy_loc_path(index_pach), b"".join(_RECORD.pack(*row) for row in rows))
+
+
+def _row_count(f):
+    f.seek(0, os.SEEK_END)
+    return f.tell() // _RECORD.size
+
+
+def _read_row(f, i):
+    f.seek(i * _RECORD.size)
+    return _RECORD.unpack(f.read(_RECORD.size))
+
+
+def _lower_bound(f, count, target, field):
+    """第一条 field 列 >= target 的记录下标 (直接在文件上二分)。"""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _read_row(f, mid)[field] < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def replace_copy_locations(filename, rows, index_pach=None):
+    """
+    替换某个副本文件的全部位置记录 (该文件被重写后调用)；rows 为空表示文件已删除。
+
+    同一副本文件的记录在表中是连续的一段，且文件编号沿表单调不减，可以直接二分定位。
+    记录数不变时原地覆盖；否则重写这一段及其之后的部分 (通常是最后一个副本文件，只涉及表尾)。
+    """
+    number = copy_file_number(filename)
+    path = copy_loc_path(index_pach)
+    if number is None or not os.path.exists(path):
+        return
+    payload = b"".join(_RECORD.pack(*row) for row in rows)
+    with file_lock(path, exclusive=True), open(path, 'r+b') as f:
+        count = _row_count(f)
+        lo = _lower_bound(f, count, number, 1)
+        hi = _lower_bound(f, count, number + 1, 1)
+        if hi - lo == len(rows):
+            f.seek(lo * _RECORD.size)
+            f.write(payload)
+        else:
+            f.seek(hi * _RECORD.size)
+            tail = f.read()
+            f.seek(lo * _RECORD.size)
+            f.write(payload + tail)
+            f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def locate_copies(mother_id, index_pach=None):
+    """
+    查找母本的副本位置。
+
+    :return: [(副本文件路径, 起始字节, 字节数, 副本数), ...]；
+             位置索引缺失、没有该母本，或任一副本文件在记录之后被改写时返回 None
+    """
+    value = encode_mother_id(mother_id)
+    path = copy_loc_path(index_pach)
+    if value is None or not os.path.exists(path):
+        return None
+
+    rows = []
+    with file_lock(path), open(path, 'rb') as f:
+        count = _row_count(f)
+        i = _lower_bound(f, count, value, 0)
+        while i < count:
+            row = _read_row(f, i)
+            if row[0] != value:
+                break
+            rows.append(row)
+            i += 1
+    if not rows:
+        return None
+
+    base_dir = book_pach_db_data_b()
+    locations = []
+    for _, number, start, length, copy_count, mtime, size in rows:
+        file_path = os.path.join(base_dir, f"book-b-{number}.json")
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        if st.st_mtime_ns != mtime or st.st_size != size:
+            return None
+        locations.append((file_path, start, length, copy_count))
+    return locations
+
+
+def read_located_copies(mother_id, index_pach=None):
+    """
+    按位置索引只读取母本副本所在的那一段字节。
+
+    :return: [(副本文件路径, {副本ID: 副本记录}), ...]；无法使用位置索引时返回 None
+    """
+    locations = locate_copies(mother_id, index_pach)
+    if locations is None:
+        return None
+
+    result = []
+    prefix = mother_id + '-'
+    for file_path, start, length, copy_count in locations:
+        try:
+            with file_lock(file_path), open(file_path, 'rb') as f:
+                f.seek(start)
+                copies = json.loads(b"{" + f.read(length) + b"}")
+        except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+            return None
+        if len(copies) != copy_count or not all(copy_id.startswith(prefix) for copy_id in copies):
+            return None
+        result.append((file_path, copies))
+    return result
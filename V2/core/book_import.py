@@ -0,0 +1,269 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+
+from .book_alloc import record_tail
+from .book_baidu import DB_PREFIX, DB_PREFIX_B, FIXED_CATEGORY_CODE, MAX_RECORDS, find_next_available_book_slot, \
+    find_next_available_copy_slot
+from .book_cache import invalidate_shard, read_shard
+from .book_copyloc import copy_file_number
+from .book_index import input_oput_index
+from .book_io import atomic_write_json
+from .book_lock import file_lock, file_locks
+from .book_modify import book_pach_alloc
+from .book_shard import write_shard
+
+# 批量导入：流式读取 CSV/JSONL 目录，顺序分配 ID，分片攒满 999 条才整体写一次 (与 压力测试.py 的写法相同)，
+# 全部写完后只更新一次索引。逐本调用 add_db 每本书都要读写好几个完整分片，十万条要几个小时。
+
+# 输入字段 -> 母本字段，CSV 表头可以用英文键名，也可以用界面上的中文列名
+FIELD_ALIASES = {
+    "name": "name", "书名": "name",
+    "author": "author", "作者": "author",
+    "publisher": "publisher", "出版社": "publisher",
+    "isbn": "isbn", "ISBN": "isbn",
+    "pages": "pages", "页数": "pages",
+    "words": "words", "字数": "words",
+    "category": "category", "分类": "category", "类别": "category",
+    "quantity": "quantity", "入库数量": "quantity", "数量": "quantity",
+}
+BOOK_FIELDS = ("name", "author", "publisher", "isbn", "pages", "words", "category")
+
+
+def iter_catalogue(file_path, fmt=None):
+    """
+    流式读取目录文件，逐行产出 {字段: 值}，字段名已统一为英文键名；JSONL 中无法解析的行产出 None。
+
+    :param fmt: "csv" 或 "jsonl"，默认按扩展名判断
+    """
+    if fmt is None:
+        fmt = "jsonl" if file_path.lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+    # utf-8-sig：兼容 Excel 导出的带 BOM 的 CSV
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        if fmt == "csv":
+            rows = csv.DictReader(f)
+        else:
+            rows = (_parse_json_line(line) for line in f if line.strip())
+        for row in rows:
+            if row is None:
+                yield None
+                continue
+            yield {FIELD_ALIASES[key]: value for key, value in row.items() if key in FIELD_ALIASES}
+
+
+def _parse_json_line(line):
+    """解析 JSONL 的一行，不是 JSON 对象时打印警告并返回 None。"""
+    try:
+        row = json.loads(line)
+    except json.JSONDecodeError:
+        row = None
+    if not isinstance(row, dict):
+        print(f"⚠️ 警告: 无法解析的一行，已跳过: {line[:80]!r}")
+        return None
+    return row
+
+
+def _book_record(row, time_stamp):
+    """把一行输入转换为母本记录 (不含 copies) 和入库数量；无法解析、书名为空或数量无效时返回 (None, 0)。"""
+    if row is None:
+        return None, 0
+    name = str(row.get("name") or "").strip()
+    if not name:
+        return None, 0
+    try:
+        quantity = int(row.get("quantity") or 1)
+    except (TypeError, ValueError):
+        return None, 0
+    if quantity <= 0:
+        return None, 0
+
+    record = {key: row.get(key, "") for key in BOOK_FIELDS}
+    record["name"] = name
+    # 类别为空的书不会进入类别索引，按类别 (包括 "所有分类") 筛选时就找不到它
+    record["category"] = str(record["category"] or "").strip() or "未知类别"
+    record["date_added"] = time_stamp
+    return record, quantity
+
+
+class _ShardWriter:
+    """
+    顺序写分片：当前分片在内存中攒满 MAX_RECORDS 条后整体写一次，然后换到下一个编号的新文件。
+    起点是已有的最后一个分片 (未满时先读入已有内容，接着往后写)。每个分片只写一次。
+
+    hold_full=True 时写满的分片先留在内存中，到 flush_held/flush 时才写出
+    (母本分片要等它的副本全部落盘之后再写)。
+    """
+
+    def __init__(self, section, base_dir, prefix, file_index, records, write_func, hold_full=False):
+        self.section = section
+        self.base_dir = base_dir
+        self.prefix = prefix
+        self.file_index = file_index
+        self.records = records
+        self.write_func = write_func
+        self.hold_full = hold_full
+        self.held = []  # [(分片编号, 记录), ...] 已写满、尚未写出的分片
+        self.written = []
+
+    def _path(self, file_index):
+        return os.path.join(self.base_dir, f"{self.prefix}{file_index}.json")
+
+    @property
+    def file_path(self):
+        return self._path(self.file_index)
+
+    def full(self):
+        return len(self.records) >= MAX_RECORDS
+
+    def _write(self, file_index, records):
+        file_path = self._path(file_index)
+        self.write_func(file_path, records)
+        invalidate_shard(file_path)
+        record_tail(self.section, file_path, file_index, len(records))
+        if file_path not in self.written:
+            self.written.append(file_path)
+
+    def flush_held(self):
+        """写出已写满、还留在内存中的分片。"""
+        for file_index, records in self.held:
+            self._write(file_index, records)
+        self.held = []
+
+    def flush(self):
+        """写出全部分片，包括还没写满的当前分片 (导入结束时调用)。"""
+        self.flush_held()
+        if self.records:
+            self._write(self.file_index, self.records)
+
+    def next_shard(self):
+        if self.hold_full:
+            self.held.append((self.file_index, self.records))
+        else:
+            self.flush()
+        self.file_index += 1
+        self.records = {}
+
+
+def _write_copy_shard(file_path, records):
+    atomic_write_json(file_path, records, checksum=True, indent=2)
+
+
+def import_catalogue(file_path, fmt=None, update_index=True, progress_every=10000):
+    """
+    批量导入图书目录。
+
+    新书接在现有数据之后：先填满当前最后一个母本/副本分片，其余依次写入新分片，每个分片只写一次。
+    导入期间不做逐本的索引同步，全部写完后调用一次 input_oput_index (只重扫写过的分片)。
+    索引文件被重写后，正在运行的程序 (包括其他进程) 的内存索引在下一次查询时自动重新加载 (见 book_service)。
+
+    :param file_path: CSV 或 JSONL 文件路径
+    :param fmt: "csv" 或 "jsonl"，默认按扩展名判断
+    :param update_index: 导入完成后是否更新索引
+    :param progress_every: 每导入多少本书打印一次进度，0 表示不打印
+    :return: {"books": 导入的图书数, "copies": 副本数, "skipped": 跳过的行数, "files": 写过的分片路径列表}
+    """
+    # 导入期间持有分配锁，其他实例的入库等待导入结束；索引在锁外更新
+    with file_lock(book_pach_alloc(), exclusive=True):
+        result = _import_rows(file_path, fmt, progress_every)
+
+    if update_index and result["books"]:
+        input_oput_index()
+    return result
+
+
+def _import_rows(file_path, fmt, progress_every):
+    """顺序分配 ID 并写分片 (调用方持有分配锁)，返回值同 import_catalogue。"""
+    time_stamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # 只查找一次槽位，之后的 ID 全部顺序推算
+    book_file_path, next_book_id = find_next_available_book_slot()
+    book_file_index = int(next_book_id.split('-')[1])
+    mothers = _ShardWriter("data", os.path.dirname(book_file_path), DB_PREFIX, book_file_index,
+                           dict(read_shard(book_file_path)), write_shard, hold_full=True)
+
+    copy_file_path, _ = find_next_available_copy_slot()
+    copies = _ShardWriter("data-b", os.path.dirname(copy_file_path), DB_PREFIX_B,
+                          copy_file_number(os.path.basename(copy_file_path)),
+                          dict(read_shard(copy_file_path)), _write_copy_shard)
+
+    # 导入开始时已有的两个尾部分片会被追加写入，全程加排他锁；之后的新分片只有本次导入会写
+    with file_locks([book_file_path, copy_file_path], exclusive=True):
+        books, total_copies, skipped = _fill_shards(file_path, fmt, time_stamp, mothers, copies, progress_every)
+
+    print(f"✅ 导入完成：{books} 本图书，{total_copies} 个副本，跳过 {skipped} 行；"
+          f"写入 {len(mothers.written)} 个母本分片、{len(copies.written)} 个副本分片。")
+    return {"books": books, "copies": total_copies, "skipped": skipped,
+            "files": copies.written + mothers.written}
+
+
+def _fill_shards(file_path, fmt, time_stamp, mothers, copies, progress_every):
+    """
+    逐行分配 ID 并放入分片。
+
+    副本分片写满就写出；写满的母本分片先留在内存中，等装着它最后几本书副本的那个副本分片写出后再写，
+    这样每个分片都只写一次，母本也不会先于自己的副本落盘 (与 add_db 的顺序一致)。
+    中途出错 (例如目录文件读到一半解码失败) 时，已经处理完的图书照常写出，再把异常抛给调用方。
+    """
+    books = total_copies = skipped = 0
+    try:
+        for row in iter_catalogue(file_path, fmt):
+            book_record, quantity = _book_record(row, time_stamp)
+            if book_record is None:
+                skipped += 1
+                continue
+
+            if mothers.full():
+                mothers.next_shard()
+            book_id = f"{FIXED_CATEGORY_CODE}-{mothers.file_index}-{len(mothers.records) + 1:03d}"
+            _add_copies(book_id, quantity, mothers, copies)
+            book_record["copies"] = [f"{book_id}-{copy_num}" for copy_num in range(1, quantity + 1)]
+            mothers.records[book_id] = book_record
+            books += 1
+            total_copies += quantity
+            if progress_every and books % progress_every == 0:
+                print(f"已导入 {books} 本图书 ({total_copies} 个副本)...")
+    finally:
+        # 先写副本再写母本
+        copies.flush()
+        mothers.flush()
+    return books, total_copies, skipped
+
+
+def _add_copies(book_id, quantity, mothers, copies):
+    """为一本新书生成 quantity 个副本记录，放入副本分片。"""
+    for copy_num in range(1, quantity + 1):
+        if copies.full():
+            copies.next_shard()
+            # 之前写满的母本分片，它们的副本都在刚写出的分片或更早的分片里
+            mothers.flush_held()
+        copies.records[f"{book_id}-{copy_num}"] = {
+            "book_id": book_id,
+            "status": "正常",
+            "borrower_name": None,
+            "borrow_date": None,
+            "due_date": None,
+            "notes": None
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="批量导入图书目录 (CSV/JSONL)。在数据目录 (包含 db/ 和 index/ 的目录) 下运行程序目录中的 导入图书.py。")
+    parser.add_argument("file", help="目录文件路径 (.csv 或 .jsonl)")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="文件格式，默认按扩展名判断")
+    parser.add_argument("--no-index", action="store_true", help="导入后不更新索引 (下次启动时再增量更新)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.file):
+        print(f"错误: 找不到文件 {args.file}")
+        return 1
+    import_catalogue(args.file, fmt=args.format, update_index=not args.no_index)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,151 +1,1067 @@
+import hashlib
 import json
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from concurrent.futures.process import BrokenProcessPool
 
-from .book_baidu import read_json_files_in_directory
+from natsort import natsorted
+
+from .book_baidu import list_json_files, parse_id
+from .book_cache import invalidate_shard
+from .book_compact import encode_index, encode_mother_id, open_compact_index, write_compact_index
+from .book_copyloc import COPY_LOC_FILE, copy_locations, replace_copy_locations, write_copy_locations
+from .book_io import atomic_write, atomic_write_json, checksum_matches, repair_shard, verify_file
+from .book_lock import file_lock
+from .book_ngram import NGRAM_DELTA_FILE, NGRAM_FILE, NGRAM_FOLD_THRESHOLD, NgramDelta, add_book_grams, \
+    book_grams, fold_ngram_delta, invert_grams, merge_grams, write_ngram_index
 from .book_modify import book_pach_index
+from .book_shard import index_shard_offsets
+from .book_wal import compact_wal
 from .book_modify import book_pach_db_data, book_pach_db_data_b
 
+# 索引文件：键为内部名称，值为索引目录下的文件名
+INDEX_FILES = {
+    "name": "book-name-index.json",
+    "class": "book-class-index.json",
+    "status": "book-status-index.json",
+    "zuozhe": "book-zuozhe-index.json",
+    "sw": "book-sw-index.json",
+    # 母本级状态索引：{状态: {母本 ID: 该状态的副本数}}，按状态筛选和统计时不必遍历全部副本
+    "status_mother": "book-status-mother-index.json",
+}
+
+# 清单记录时间戳的文件：JSON 索引之外还有 n-gram 主文件和差量文件 (见 book_ngram)、副本位置索引 (见 book_copyloc)
+TRACKED_FILES = tuple(INDEX_FILES.values()) + (NGRAM_FILE, NGRAM_DELTA_FILE, COPY_LOC_FILE)
+
+# 书名/类别/作者/状态索引另存一份紧凑格式 (.bidx)，内存索引 (book_service) 加载时整段读入，不解析 JSON；
+# 值为 ID 的种类。紧凑文件记录 JSON 文件的时间戳，JSON 被改写而紧凑文件没跟上时视为过期
+COMPACT_INDEX_KINDS = {"name": "mother", "class": "mother", "zuozhe": "mother", "status": "copy"}
+
+# 分片清单：记录每个分片上次建索引时的 mtime/size/hash 以及首尾 ID，用于增量更新
+MANIFEST_FILE = "book-index-manifest.json"
+# 2: n-gram 索引加入了单字 gram，旧版本的索引目录需要全量重建
+MANIFEST_VERSION = 2
+
+# 索引差量日志：写入时对 JSON 索引的增删 (书名/作者/类别/状态)，每次修改追加一行
+#   {"r": [[索引名, 键, ID], ...], "a": [[索引名, 键, ID], ...]}
+# 借还一次书只追加一行并 fsync，不再读写整个状态索引和清单。read_index_files 读取时把日志叠加上去，
+# 常驻的内存索引 (book_service) 每次查询前读取新追加的行，其他进程的修改也由此同步；
+# 启动维护索引时并入索引文件，再清掉已并入的部分。日志不受清单保护，清单失效全量重建时直接丢弃。
+INDEX_DELTA_FILE = "book-index-delta.jsonl"
+# 日志超过这个大小时在写入时就并入索引文件，免得长时间不重启的柜台每次加载索引都要叠加很长的日志
+INDEX_DELTA_FOLD_BYTES = 4 * 1024 * 1024
+
+# 并行建索引：分片总数少于该值时进程启动开销得不偿失，直接顺序扫描
+PARALLEL_MIN_FILES = 64
+# 每个子任务最多解析的分片数
+PARALLEL_MAX_CHUNK = 32
+
+
+def index_file_paths(index_pach=None):
+    """返回 {索引名: 索引文件完整路径}。"""
+    if index_pach is None:
+        index_pach = book_pach_index()
+    return {key: os.path.join(index_pach, filename) for key, filename in INDEX_FILES.items()}
+
+
+def new_manifest():
+    return {"version": MANIFEST_VERSION, "data": {}, "data-b": {}, "indexes": {}}
+
+
+def _empty_indexes():
+    # "ngram" 是 n-gram 局部索引 {gram: [母本编码, ...]}，不写成 JSON，单独交给 book_ngram；
+    # "copy_loc" 是副本位置记录列表，单独交给 book_copyloc
+    indexes = {key: {} for key in INDEX_FILES}
+    indexes["ngram"] = {}
+    indexes["copy_loc"] = []
+    return indexes
+
+
+# ----------------------------------------------------
+# 分片读取与扫描
+# ----------------------------------------------------
+
+def _read_shard(file_path, repair=True):
+    """
+    读取一个分片文件，同时计算清单条目。
+
+    校验和不一致或 JSON 损坏时，与启动检查 (book_io.recover_store) 一样逐条抢救记录后写回，再读取修复后的内容：
+    启动检查只看尾部分片，其余分片的损坏在这里才会发现，不修复的话它的记录会从索引中消失。
+
+    :param repair: 是否修复损坏的分片
+    :return: (records, entry, raw)。文件损坏且未能修复时 records 为 {}，但仍返回条目，
+             这样修复后 hash 变化会被下一次增量检查发现。raw 为文件原始字节。
+    """
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+        st = os.fstat(f.fileno())
+
+    records = _parse_shard(file_path, raw) if checksum_matches(file_path, raw) else None
+    if records is None and repair and _repair_corrupt_shard(file_path):
+        return _read_shard(file_path, repair=False)
+
+    entry = {"mtime": st.st_mtime_ns, "size": st.st_size, "hash": hashlib.sha1(raw).hexdigest()}
+    return (records if records is not None else {}), entry, raw
+
+
+def _repair_corrupt_shard(file_path):
+    """加排他锁后重新检查分片，仍然损坏则修复。返回是否修复过。"""
+    try:
+        with file_lock(file_path, exclusive=True):
+            ok, reason = verify_file(file_path)
+            if ok:
+                # 读取时正好赶上其他进程写入，锁内重新检查已经完好
+                return True
+            print(f"🚨 警告: 分片 {os.path.basename(file_path)} 检查失败 ({reason})，正在修复...")
+            repair_shard(file_path)
+    except OSError as e:
+        print(f"❌ 分片 {os.path.basename(file_path)} 修复失败: {e}")
+        return False
+    invalidate_shard(file_path)
+    return True
+
+
+def _parse_shard(file_path, raw):
+    """解析分片内容，损坏时打印提示并返回 None。"""
+    try:
+        return json.loads(raw.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        print(f"文件 {os.path.basename(file_path)} 格式错误")
+        return None
+
+
+def _check_shard(file_path, entry):
+    """
+    判断分片自上次建索引以来是否有变化。
+
+    先比较 mtime/size，不一致时再比较内容 hash（只是被 touch 或复制过的文件不会触发重扫）。
+    :return: (records, new_entry, raw)。未变化时 records 为 None。
+    """
+    st = os.stat(file_path)
+    if entry and entry.get("mtime") == st.st_mtime_ns and entry.get("size") == st.st_size:
+        return None, entry, None
+
+    records, new_entry, raw = _read_shard(file_path)
+    if entry and entry.get("hash") == new_entry["hash"]:
+        # 内容没变但时间戳变了，副本位置记录里的时间戳也要跟着刷新
+        return None, dict(entry, mtime=new_entry["mtime"], size=new_entry["size"]), raw
+    return records, new_entry, raw
+
+
+def _add_to_index(index, key, value):
+    if key:
+        if key not in index:
+            index[key] = []
+        index[key].append(value)
+
+
+def _count_status_mother(status_mother, status, copy_id, delta):
+    """按副本 ID 调整母本级状态索引中的计数，计数归零时删除条目。"""
+    mother_id = copy_id.rsplit('-', 1)[0]
+    counts = status_mother.setdefault(status, {})
+    count = counts.get(mother_id, 0) + delta
+    if count > 0:
+        counts[mother_id] = count
+    else:
+        counts.pop(mother_id, None)
+        if not counts:
+            del status_mother[status]
+
+
+def _merge_counts(status_mother, partial):
+    """合并两份母本级状态索引 (同一母本的副本可能跨两个分片，计数相加)。"""
+    for status, counts in partial.items():
+        target = status_mother.setdefault(status, {})
+        for mother_id, count in counts.items():
+            target[mother_id] = target.get(mother_id, 0) + count
+
+
+def _mother_index_keys(book_info):
+    """母本记录在书名（第一个字）、作者、类别索引中的键。"""
+    return {
+        "name": (book_info.get("name") or "")[:1],
+        "zuozhe": book_info.get("author", "未知作者"),
+        "class": book_info.get("category", "未知类别"),
+    }
+
+
+def _copy_index_keys(copy_info):
+    """副本记录在状态索引中的键。"""
+    return {"status": copy_info.get("status", "未知状态")}
+
+
+def _scan_mother_shard(records, indexes):
+    """把一个母本分片登记到书名、作者、类别索引和 n-gram 索引，返回 (首 ID, 尾 ID)。"""
+    first_id = None
+    last_id = None
+    for book_file, book_info in records.items():
+        for key, value in _mother_index_keys(book_info).items():
+            _add_to_index(indexes[key], value, book_file)
+        add_book_grams(indexes["ngram"], book_file, book_info)
+
+        if first_id is None:
+            first_id = book_file
+        last_id = book_file
+    return first_id, last_id
+
+
+def _scan_copy_shard(filename, records, indexes):
+    """把一个副本分片登记到状态索引和边界索引，返回 (首副本 ID, 尾副本 ID)。"""
+    first_copy_id = None
+    last_copy_id = None
+    for copy_id, copy_info_dict in records.items():
+        # 状态索引记录的是副本 ID，母本级状态索引记录每个母本的副本数
+        for key, value in _copy_index_keys(copy_info_dict).items():
+            _add_to_index(indexes[key], value, copy_id)
+            if key == "status" and value:
+                _count_status_mother(indexes["status_mother"], value, copy_id, 1)
 
-def generate_index(data, data_b,progress_callback=None):
-    # 初始化索引字典
-    book_name_index = {}
-    book_class_index = {}
-    book_status_index = {}
-    book_zuozhe_index = {}
-    # ⭐️ 修正 1：将 book_sw_index 重命名为 book_copy_boundary_index 并初始化
-    book_copy_boundary_index = {}
+        if first_copy_id is None:
+            first_copy_id = copy_id
+        last_copy_id = copy_id
 
-    # 获取母本内容
-    mother_books_data = read_json_files_in_directory(data)
+    if first_copy_id and last_copy_id:
+        # 边界索引：键是文件名，值是首尾副本对应的母本 ID (副本 ID 的前三段)
+        start_mother_id = '-'.join(first_copy_id.split('-')[:-1])
+        end_mother_id = '-'.join(last_copy_id.split('-')[:-1])
+        indexes["sw"][filename] = [start_mother_id, end_mother_id]
+    return first_copy_id, last_copy_id
 
-    # 获取副本内容
-    copies_data = read_json_files_in_directory(data_b)
-    total_files = len(mother_books_data) + len(copies_data)
-    # ⭐️ 修正 1：引入统一的文件计数器
+
+def _scan_shard_chunk(section, directory, filenames):
+    """
+    扫描一段连续的分片，返回 (局部索引, [(文件名, 清单条目), ...])。
+    并行建索引时在子进程中执行，所以必须是模块级函数。
+    """
+    partial = _empty_indexes()
+    entries = []
+    for filename in filenames:
+        file_path = os.path.join(directory, filename)
+        records, entry, raw = _read_shard(file_path)
+        if section == "data":
+            entry["first"], entry["last"] = _scan_mother_shard(records, partial)
+            index_shard_offsets(file_path, raw, records, (entry["mtime"], entry["size"]))
+        else:
+            entry["first"], entry["last"] = _scan_copy_shard(filename, records, partial)
+            partial["copy_loc"].extend(copy_locations(filename, raw, records, entry))
+        entries.append((filename, entry))
+    return partial, entries
+
+
+def _split_chunks(section, directory, filenames, chunk_size):
+    return [(section, directory, filenames[i:i + chunk_size]) for i in range(0, len(filenames), chunk_size)]
+
+
+def default_index_workers():
+    """全量建索引默认使用的进程数 (CPU 核心数)。"""
+    return os.cpu_count() or 1
+
+
+def build_indexes(data, data_b, progress_callback=None, manifest=None, workers=1):
+    """
+    全量扫描母本目录和副本目录，生成 INDEX_FILES 中的全部索引。
+
+    :param manifest: 可选的清单字典 (new_manifest())，传入时会登记每个分片的条目，供下次增量更新使用。
+    :param workers: 进程数。大于 1 且分片数足够多时，把分片切成若干段交给进程池解析，
+                    再按分片顺序合并局部索引，因此结果与顺序扫描完全一致。
+    :return: {索引名: 索引字典}，另含 "ngram" (值为 array('q') 的 n-gram 索引) 和 "copy_loc" (副本位置记录)
+    """
+    mother_files = list_json_files(data)
+    copy_files = list_json_files(data_b)
+    total_files = len(mother_files) + len(copy_files)
+
+    if workers > 1 and total_files >= PARALLEL_MIN_FILES:
+        # 每个进程分到约 8 段，既能均衡负载，又能让进度条平滑推进
+        chunk_size = max(1, min(PARALLEL_MAX_CHUNK, total_files // (workers * 8)))
+    else:
+        workers = 1
+        chunk_size = 1
+    chunks = _split_chunks("data", data, mother_files, chunk_size) + \
+        _split_chunks("data-b", data_b, copy_files, chunk_size)
+
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = _map_in_order(executor, chunks, window=workers * 2)
+                return _merge_chunks(chunks, results, total_files, progress_callback, manifest)
+        except (BrokenProcessPool, OSError) as e:
+            print(f"⚠️ 并行建索引失败，改为顺序扫描: {e}")
+            if manifest is not None:
+                manifest["data"].clear()
+                manifest["data-b"].clear()
+
+    results = (_scan_shard_chunk(*chunk) for chunk in chunks)
+    return _merge_chunks(chunks, results, total_files, progress_callback, manifest)
+
+
+def _map_in_order(executor, chunks, window):
+    """
+    按顺序产出各段的解析结果，同时最多只有 window 段在途。
+
+    executor.map 会一次性提交全部任务，合并跟不上解析时结果会在内存里堆积；
+    这里用滑动窗口提交，峰值内存只相当于索引本身加上几段局部结果。
+    """
+    pending = deque()
+    chunk_iter = iter(chunks)
+    for chunk in islice(chunk_iter, window):
+        pending.append(executor.submit(_scan_shard_chunk, *chunk))
+
+    while pending:
+        result = pending.popleft().result()
+        for chunk in islice(chunk_iter, 1):
+            pending.append(executor.submit(_scan_shard_chunk, *chunk))
+        yield result
+
+
+def _merge_chunks(chunks, results, total_files, progress_callback, manifest):
+    """
+    按分片顺序合并各段的局部索引，每合并一段报告一次进度。
+
+    results 是惰性的：每段的局部索引合并后即被丢弃，任何时刻都不会持有全部分片的解码内容。
+    """
+    indexes = _empty_indexes()
     processed_files_count = 0
 
-    # ----------------------------------------------------
-    # 1. 遍历母本数据，生成书名、作者、类别索引
-    # ----------------------------------------------------
-    for i in mother_books_data:
-        for book_file, book_info in i.items():
-            book_title_first_char = book_info["name"][0]  # 获取书名的第一个字
-            author = book_info.get("author", "未知作者")
-            category = book_info.get("category", "未知类别")
-
-            # 书名索引（第一个字）
-            if book_title_first_char:
-                if book_title_first_char not in book_name_index:
-                    book_name_index[book_title_first_char] = []
-                book_name_index[book_title_first_char].append(book_file)
-
-            # 作者索引
-            if author:
-                if author not in book_zuozhe_index:
-                    book_zuozhe_index[author] = []
-                book_zuozhe_index[author].append(book_file)
-
-            # 类别索引
-            if category:
-                if category not in book_class_index:
-                    book_class_index[category] = []
-                book_class_index[category].append(book_file)
-
-        # ⭐️ 修正 4：文件处理完毕，更新总计数器并报告进度
-        processed_files_count += 1
+    for (section, _, filenames), (partial, entries) in zip(chunks, results):
+        for key in ("name", "zuozhe", "class", "status"):
+            _merge_partial(indexes[key], partial[key])
+        indexes["sw"].update(partial["sw"])
+        _merge_counts(indexes["status_mother"], partial["status_mother"])
+        merge_grams(indexes["ngram"], partial["ngram"])
+        indexes["copy_loc"].extend(partial["copy_loc"])
+        if manifest is not None:
+            manifest[section].update(entries)
+
+        processed_files_count += len(filenames)
         if progress_callback:
             progress_callback(processed_files_count, total_files)
 
-    # ----------------------------------------------------
-    # 2. 遍历副本数据，生成状态索引和边界索引
-    # ----------------------------------------------------
-    file_num = 1  # ⭐️ 文件计数器，从 1 开始对应 book-b-1.json
+    return indexes
 
-    # 遍历所有书籍副本 (copies_data 列表的每个元素都是一个文件的内容字典)
-    for copy_records_dict in copies_data:
-        # copy_records_dict: 即该文件内的所有副本记录 {副本ID: 副本信息字典}
 
-        # 1. 构造当前处理的副本文件名 (用于边界索引的键)
-        current_filename = f"book-b-{file_num}.json"
+# ----------------------------------------------------
+# 增量更新
+# ----------------------------------------------------
+# 索引列表中的 ID 始终按自然顺序排列 (与分片顺序一致)，
+# 因此一个分片贡献的 ID 在每个列表里都是一段连续区间 [首 ID, 尾 ID]，可以用二分查找整段删除。
 
-        # 初始化用于边界索引的变量
-        first_copy_id = None
-        last_copy_id = None
+def _lower_bound(ids, target):
+    lo, hi = 0, len(ids)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if parse_id(ids[mid]) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
 
-        # 2. 遍历该文件中的所有副本记录
-        for copy_id, copy_info_dict in copy_records_dict.items():
 
-            status = copy_info_dict.get("status", "未知状态")
+def _upper_bound(ids, target):
+    lo, hi = 0, len(ids)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if parse_id(ids[mid]) <= target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
 
-            # 状态索引
-            if status:
-                if status not in book_status_index:
-                    book_status_index[status] = []
-                # 状态索引记录的是副本 ID
-                book_status_index[status].append(copy_id)
 
-            # 边界索引逻辑
-            if first_copy_id is None:
-                first_copy_id = copy_id
+def _drop_ranges(index, ranges, on_drop=None):
+    """
+    从索引的每个列表中删除落在 ranges [(首 ID, 尾 ID), ...] 内的 ID，并移除空键。
 
-            last_copy_id = copy_id  # 总是更新为当前循环的 ID
+    :param on_drop: 可选回调 on_drop(键, 被删除的 ID 列表)
+    """
+    if not ranges:
+        return
+    parsed = [(parse_id(first), parse_id(last)) for first, last in ranges]
+    for key in list(index):
+        ids = index[key]
+        for lo, hi in parsed:
+            start = _lower_bound(ids, lo)
+            end = _upper_bound(ids, hi)
+            if start < end:
+                if on_drop:
+                    on_drop(key, ids[start:end])
+                del ids[start:end]
+        if not ids:
+            del index[key]
 
-        # 3. 生成边界索引
-        if first_copy_id and last_copy_id:
-            # 提取母本 ID (副本 ID 的前三段)
-            start_mother_id = '-'.join(first_copy_id.split('-')[:-1])
-            end_mother_id = '-'.join(last_copy_id.split('-')[:-1])
 
-            # 写入边界索引：键是推断出的文件名
-            book_copy_boundary_index[current_filename] = [start_mother_id, end_mother_id]
+def _merge_partial(index, partial):
+    """把新扫描出的局部索引并入总索引，必要时重新排序以保持自然顺序。"""
+    for key, ids in partial.items():
+        if key not in index:
+            index[key] = list(ids)
+            continue
+        existing = index[key]
+        needs_sort = bool(existing) and parse_id(existing[-1]) > parse_id(ids[0])
+        existing.extend(ids)
+        if needs_sort:
+            existing.sort(key=parse_id)
+
+
+def update_index(data, data_b, indexes, manifest, progress_callback=None, ngram_delta=None, copy_loc_updates=None):
+    """
+    根据清单只重新扫描发生变化的分片，并就地修补索引。
+
+    :param indexes: {索引名: 索引字典}，会被就地修改
+    :param manifest: 上一次的清单，会被就地更新
+    :param ngram_delta: 可选的 NgramDelta，变化过的母本分片会整段登记到差量中
+    :param copy_loc_updates: 可选的字典，填入 {副本文件名: 新的位置记录} (已删除的文件对应空列表)
+    :return: 索引内容是否发生了变化
+    """
+    mother_files = list_json_files(data)
+    copy_files = list_json_files(data_b)
+    total_files = len(mother_files) + len(copy_files)
+    processed_files_count = 0
+
+    sections = (("data", data, mother_files), ("data-b", data_b, copy_files))
+
+    changed = False
+    partial = _empty_indexes()
+    for section, directory, filenames in sections:
+        old_entries = manifest.get(section, {})
+        new_entries = {}
+        stale_ranges = []
+
+        for filename in filenames:
+            old_entry = old_entries.get(filename)
+            file_path = os.path.join(directory, filename)
+            records, entry, raw = _check_shard(file_path, old_entry)
+            # 内容未变、只是时间戳变化的分片 records 为 None，偏移表/位置记录仍需按新时间戳重写
+            parsed = records if records is not None or raw is None else _parse_shard(file_path, raw)
+            if parsed is None and raw is not None:
+                # 上次登记时就已损坏 (hash 记的是损坏的内容)：从清单中去掉，它贡献的 ID 按已删除的分片移除，
+                # 修复后作为新分片重新扫描
+                print(f"⚠️ 警告: 分片 {filename} 无法解析，已跳过并从清单中移除。")
+                entry = None
+            elif raw is not None:
+                if section == "data":
+                    index_shard_offsets(file_path, raw, parsed, (entry["mtime"], entry["size"]))
+                elif copy_loc_updates is not None:
+                    copy_loc_updates[filename] = copy_locations(filename, raw, parsed, entry)
+            if records is not None:
+                if old_entry and old_entry.get("first"):
+                    stale_ranges.append((old_entry["first"], old_entry["last"]))
+                if section == "data":
+                    entry["first"], entry["last"] = _scan_mother_shard(records, partial)
+                else:
+                    entry["first"], entry["last"] = _scan_copy_shard(filename, records, partial)
+                    indexes["sw"].pop(filename, None)
+                changed = True
+            if entry is not None:
+                new_entries[filename] = entry
+
+            processed_files_count += 1
+            if progress_callback:
+                progress_callback(processed_files_count, total_files)
+
+        # 已被删除的分片：它们贡献的 ID 也要移除
+        for filename, old_entry in old_entries.items():
+            if filename not in new_entries:
+                if old_entry.get("first"):
+                    stale_ranges.append((old_entry["first"], old_entry["last"]))
+                if section == "data-b":
+                    indexes["sw"].pop(filename, None)
+                    if copy_loc_updates is not None:
+                        copy_loc_updates[filename] = []
+                changed = True
+
+        if section == "data":
+            for key in ("name", "zuozhe", "class"):
+                _drop_ranges(indexes[key], stale_ranges)
+            if ngram_delta is not None and changed:
+                ranges = [(encode_mother_id(first), encode_mother_id(last)) for first, last in stale_ranges]
+                ngram_delta.replace_ranges([r for r in ranges if None not in r], invert_grams(partial["ngram"]))
+        else:
+            def uncount(status, copy_ids):
+                for copy_id in copy_ids:
+                    _count_status_mother(indexes["status_mother"], status, copy_id, -1)
+
+            _drop_ranges(indexes["status"], stale_ranges, on_drop=uncount)
+        manifest[section] = new_entries
+
+    if not changed:
+        return False
+
+    for key in ("name", "zuozhe", "class", "status"):
+        _merge_partial(indexes[key], partial[key])
+    _merge_counts(indexes["status_mother"], partial["status_mother"])
+
+    # 边界索引的键保持文件自然顺序，与副本分片的顺序一致
+    boundary = dict(indexes["sw"])
+    boundary.update(partial["sw"])
+    indexes["sw"] = {filename: boundary[filename] for filename in natsorted(boundary)}
+    return True
+
+
+# ----------------------------------------------------
+# 读写索引与清单
+# ----------------------------------------------------
+
+def _file_stamp(file_path):
+    st = os.stat(file_path)
+    return {"mtime": st.st_mtime_ns, "size": st.st_size}
+
+
+def load_manifest(index_pach):
+    """
+    读取清单。清单缺失、版本不符，或任一索引文件在清单写入之后被改动/删除时返回 None，
+    调用方应退回全量重建。
+    """
+    manifest_path = os.path.join(index_pach, MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return None
+
+    stamps = manifest.get("indexes", {})
+    for filename in TRACKED_FILES:
+        file_path = os.path.join(index_pach, filename)
+        if not os.path.exists(file_path) or stamps.get(filename) != _file_stamp(file_path):
+            return None
+    return manifest
 
-        # 4. 递增文件计数器
-        file_num += 1
-        # ⭐️ 修正 4：文件处理完毕，更新总计数器并报告进度
-        processed_files_count += 1
-        if progress_callback:
-            progress_callback(processed_files_count, total_files)
 
-    # ⭐️ 修正 2：返回时使用修正后的变量名
-    return book_name_index, book_class_index, book_status_index, book_zuozhe_index, book_copy_boundary_index
+def write_manifest(index_pach, manifest):
+    manifest["indexes"] = {filename: _file_stamp(os.path.join(index_pach, filename))
+                           for filename in TRACKED_FILES}
+    atomic_write_json(os.path.join(index_pach, MANIFEST_FILE), manifest)
 
 
-# 将索引数据写入文件
-def write_index_to_file(name_, class_, status_, zuozhe_, _sw, name_pach, class_pach, status_pach, zuozhe_pach, sw_pach):
-    # 保存书名索引
-    with open(name_pach, 'w', encoding='utf-8') as f:
-        json.dump(name_, f, ensure_ascii=False, indent=4)
+def index_delta_path(index_pach=None):
+    return os.path.join(index_pach or book_pach_index(), INDEX_DELTA_FILE)
 
-    # 保存状态索引
-    with open(status_pach, 'w', encoding='utf-8') as f:
-        json.dump(status_, f, ensure_ascii=False, indent=4)
 
-    # 保存作者索引
-    with open(zuozhe_pach, 'w', encoding='utf-8') as f:
-        json.dump(zuozhe_, f, ensure_ascii=False, indent=4)
+def _append_index_delta(removals, additions):
+    """
+    向索引差量日志追加一行并 fsync (只持有日志自己的锁，不等索引锁)。
 
-    # 保存类别索引
-    with open(class_pach, 'w', encoding='utf-8') as f:
-        json.dump(class_, f, ensure_ascii=False, indent=4)
+    :return: 追加后日志的大小
+    """
+    line = (json.dumps({"r": removals, "a": additions}, ensure_ascii=False) + "\n").encode('utf-8')
+    path = index_delta_path()
+    with file_lock(path, exclusive=True):
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                raw = f.read()
+            valid = raw.rfind(b"\n") + 1
+            if valid < len(raw):
+                # 最后一行没有写完 (追加时崩溃)，截掉，否则这一行会和它粘在一起
+                with open(path, 'r+b') as f:
+                    f.truncate(valid)
+                    os.fsync(f.fileno())
+        with open(path, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
 
-    # 保存首尾索引
-    with open(sw_pach, 'w', encoding='utf-8') as f:
-        json.dump(_sw, f, ensure_ascii=False, indent=4)
+
+def read_index_delta(index_pach):
+    """
+    读取索引差量日志。
+
+    :return: ([(removals, additions), ...], 已读取的字节数)；没写完的最后一行不计入
+    """
+    path = index_delta_path(index_pach)
+    with file_lock(path):
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return [], 0
+    return _parse_index_delta(raw)
+
+
+def tail_index_delta(index_pach, position):
+    """
+    读取索引差量日志在 position 之后新追加的条目，供常驻的内存索引跟上其他进程 (和本进程) 的修改。
+    日志没有变化时只做一次 stat。
+
+    :param position: (日志文件标识, 已读取的字节数)，来自 read_service_indexes 或上一次调用
+    :return: (entries, 新的 position)。日志已被重写 (并入索引文件后清掉了前面的部分) 时 entries 为 None，
+             调用方应整体重新加载
+    """
+    identity, offset = position
+    path = index_delta_path(index_pach)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return ([] if identity is None else None), position
+    if identity not in (None, (st.st_dev, st.st_ino)) or st.st_size < offset:
+        return None, position
+    if st.st_size == offset:
+        return [], position
+
+    with file_lock(path):
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if identity not in (None, (st.st_dev, st.st_ino)):
+                return None, position
+            f.seek(offset)
+            raw = f.read()
+    entries, consumed = _parse_index_delta(raw)
+    return entries, ((st.st_dev, st.st_ino), offset + consumed)
+
+
+def _file_identity(path):
+    """文件标识 (设备号, inode)，文件被原子替换后会变化；文件不存在时返回 None。"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+def _parse_index_delta(raw):
+    """解析日志内容，返回 (条目列表, 到最后一个完整行为止的字节数)。"""
+    consumed = raw.rfind(b"\n") + 1
+    entries = []
+    for line in raw[:consumed].splitlines():
+        try:
+            entry = json.loads(line)
+            entries.append((entry["r"], entry["a"]))
+        except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+            print(f"⚠️ 警告: 索引差量日志中有无法解析的一行，已忽略: {line[:80]!r}")
+    return entries, consumed
+
+
+def _drop_index_delta(index_pach, consumed):
+    """清掉日志前 consumed 字节 (已并入索引文件)，之后追加的部分保留。"""
+    if not consumed:
+        return
+    path = index_delta_path(index_pach)
+    with file_lock(path, exclusive=True):
+        with open(path, 'rb') as f:
+            f.seek(consumed)
+            tail = f.read()
+        atomic_write(path, tail)
+
+
+def read_index_files(index_pach, keys=None):
+    """
+    严格读取索引文件并叠加索引差量日志中的修改，任一缺失或损坏时返回 None。
+
+    :param keys: 只读取这些索引 (默认全部)
+    """
+    # 持有索引锁的共享锁：其他实例正在把日志并入索引文件时等它完成，不会读到一半新一半旧
+    with file_lock(_index_lock_target(index_pach)):
+        indexes = _read_index_json(index_pach, keys)
+        if indexes is not None:
+            entries, _ = read_index_delta(index_pach)
+            for removals, additions in entries:
+                apply_delta_to_indexes(indexes, removals, additions)
+    return indexes
+
+
+def _read_index_json(index_pach, keys=None):
+    """只读取索引文件本身 (不叠加差量日志)，任一缺失或损坏时返回 None。"""
+    indexes = {}
+    for key, file_path in index_file_paths(index_pach).items():
+        if keys is not None and key not in keys:
+            continue
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                indexes[key] = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+    return indexes
+
+
+def write_index_file(file_path, index):
+    atomic_write_json(file_path, index, indent=4)
+
+
+def write_indexes(indexes, paths):
+    for key, index in indexes.items():
+        write_index_file(paths[key], index)
+    write_compact_indexes(indexes, paths)
+
+
+def write_compact_indexes(indexes, paths):
+    """为 indexes 中属于 COMPACT_INDEX_KINDS 的索引生成紧凑格式副本 (JSON 文件必须已经写好)。"""
+    for key, index in indexes.items():
+        kind = COMPACT_INDEX_KINDS.get(key)
+        if kind is not None and not write_compact_index(paths[key], index, kind):
+            print(f"⚠️ 警告: 索引 {key} 含有无法编码的 ID，只保留 JSON 格式。")
+
+
+def read_service_indexes(index_pach):
+    """
+    供内存索引 (book_service) 加载：在索引锁的共享锁内读取书名/作者/类别/状态索引和索引差量日志。
+
+    优先整段读入紧凑格式 (编码后的 ID 数组)，紧凑文件缺失、过期或损坏时退回解析 JSON 再编码。
+    差量日志不在这里叠加：状态索引只有副本级的 ID 数组，由调用方投影到母本级时一并处理。
+
+    :return: (indexes, entries, position, stamp)。indexes 为 {索引名: {键: 按升序排列的编码 ID 序列}}，
+             任一索引不可用时为 None；entries 为差量日志条目，见 read_index_delta；
+             position 为日志读到的位置，之后交给 tail_index_delta；stamp 见 service_index_stamp
+    """
+    paths = index_file_paths(index_pach)
+    with file_lock(_index_lock_target(index_pach)):
+        # 持有索引锁期间日志只会被追加，不会被并入后重写，文件标识不变
+        entries, consumed = read_index_delta(index_pach)
+        position = (_file_identity(index_delta_path(index_pach)), consumed)
+        stamp = service_index_stamp(index_pach)
+        indexes = {}
+        for key, kind in COMPACT_INDEX_KINDS.items():
+            compact = open_compact_index(paths[key])
+            if compact is not None:
+                indexes[key] = compact.read_all()
+                continue
+            parsed = _read_index_json(index_pach, (key,))
+            encoded = encode_index(parsed[key], kind) if parsed is not None else None
+            if encoded is None:
+                indexes = None
+                break
+            indexes[key] = encoded
+    return indexes, entries, position, stamp
+
+
+def service_index_stamp(index_pach):
+    """
+    COMPACT_INDEX_KINDS 中各索引 JSON 文件的时间戳 (紧凑文件总是紧跟着 JSON 改写)，文件缺失时为 None。
+    与加载时不同说明启动维护或日志并入重写过索引文件，内存索引需要整体重新加载。
+    """
+    paths = index_file_paths(index_pach)
+    stamps = []
+    for key in COMPACT_INDEX_KINDS:
+        try:
+            stamps.append(_file_stamp(paths[key]))
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+
+def _index_lock_target(index_pach=None):
+    """索引目录的锁 (加在清单文件上)：所有改写索引文件的操作互斥，多个实例不会交错写索引。"""
+    return os.path.join(index_pach or book_pach_index(), MANIFEST_FILE)
 
 
 def input_oput_index(progress_callback=None):
+    """
+    启动时维护索引：清单有效时只重扫变化过的分片，否则全量重建。
+    """
+    with file_lock(_index_lock_target(), exclusive=True):
+        _maintain_indexes(progress_callback)
+
+
+def _maintain_indexes(progress_callback=None):
+    # 先把预写日志中的字段修改合并回分片，之后的扫描看到的就是最新内容
+    compact_wal()
+
     data_pach = book_pach_db_data()
     data_b_pach = book_pach_db_data_b()
     index_pach = book_pach_index()
-    index_pach_class = os.path.join(index_pach, "book-class-index.json")
-    index_pach_name = os.path.join(index_pach, "book-name-index.json")
-    index_pach_status = os.path.join(index_pach, "book-status-index.json")
-    index_pach_zuozhe = os.path.join(index_pach, "book-zuozhe-index.json")
-    index_pach_sw = os.path.join(index_pach, "book-sw-index.json")
-
-    book_name_index, book_class_index, book_status_index, book_zuozhe_index, book_sw_index = generate_index(
-        data_pach, data_b_pach, progress_callback=progress_callback)
-
-    write_index_to_file(book_name_index, book_class_index, book_status_index, book_zuozhe_index, book_sw_index,
-                        index_pach_name, index_pach_class, index_pach_status,
-                        index_pach_zuozhe, index_pach_sw)
+    paths = index_file_paths(index_pach)
+    manifest_path = os.path.join(index_pach, MANIFEST_FILE)
+
+    manifest = load_manifest(index_pach)
+    # 索引差量日志的快照：增量时并入索引文件，全量重建时直接作废；写完清单后清掉这一部分
+    delta_entries, delta_consumed = read_index_delta(index_pach)
+    indexes = _read_index_json(index_pach) if manifest else None
+    ngram_delta = NgramDelta.load(index_pach) if manifest else None
+
+    if manifest and indexes is not None and ngram_delta is not None:
+        # 先叠加日志再重扫变化过的分片，重扫的结果以分片内容为准
+        for removals, additions in delta_entries:
+            apply_delta_to_indexes(indexes, removals, additions)
+        copy_loc_updates = {}
+        changed = update_index(data_pach, data_b_pach, indexes, manifest, progress_callback=progress_callback,
+                               ngram_delta=ngram_delta, copy_loc_updates=copy_loc_updates)
+        changed = changed or bool(delta_entries)
+        ngram = None
+        for filename in natsorted(copy_loc_updates):
+            replace_copy_locations(filename, copy_loc_updates[filename], index_pach)
+    else:
+        manifest = new_manifest()
+        indexes = build_indexes(data_pach, data_b_pach, progress_callback=progress_callback, manifest=manifest,
+                                workers=default_index_workers())
+        ngram = indexes.pop("ngram")
+        write_copy_locations(indexes.pop("copy_loc"), index_pach)
+        changed = True
+
+    if changed:
+        # 先删除清单再写索引：写到一半崩溃时，下次启动会因清单缺失而全量重建
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        write_indexes(indexes, paths)
+    elif any(open_compact_index(paths[key]) is None for key in COMPACT_INDEX_KINDS):
+        # 紧凑格式缺失或过期 (例如旧版本留下的索引目录)，按现有索引补写
+        write_compact_indexes(indexes, paths)
+
+    # n-gram 索引：全量重建时直接写主文件；增量时写差量，差量过大则并入主文件
+    if ngram is not None:
+        write_ngram_index(index_pach, ngram)
+    elif ngram_delta.size() > NGRAM_FOLD_THRESHOLD:
+        fold_ngram_delta(index_pach, ngram_delta)
+    elif changed:
+        ngram_delta.save(index_pach)
+
+    write_manifest(index_pach, manifest)
+    _drop_index_delta(index_pach, delta_consumed)
+
+
+def fold_index_delta(index_pach=None):
+    """
+    把索引差量日志并入索引文件，并清掉已并入的部分 (持有索引锁)。
+    清单已失效时不做处理，下次启动全量重建时日志会被作废。
+    """
+    index_pach = index_pach or book_pach_index()
+    with file_lock(_index_lock_target(index_pach), exclusive=True):
+        manifest = load_manifest(index_pach)
+        if manifest is None:
+            return
+        entries, consumed = read_index_delta(index_pach)
+        keys = {key for removals, additions in entries for key, _, _ in removals + additions}
+        if "status" in keys:
+            keys.add("status_mother")
+        if keys:
+            indexes = _read_index_json(index_pach, keys)
+            if indexes is None:
+                invalidate_manifest()
+                return
+            for removals, additions in entries:
+                apply_delta_to_indexes(indexes, removals, additions)
+            # 写到一半崩溃时索引文件与清单中的时间戳对不上，下次启动全量重建
+            write_indexes(indexes, index_file_paths(index_pach))
+            write_manifest(index_pach, manifest)
+        _drop_index_delta(index_pach, consumed)
+
+
+# ----------------------------------------------------
+# 写入时同步索引 (供 book_jiajia 的写函数调用)
+# ----------------------------------------------------
+# 每次修改数据把索引条目的增删追加到索引差量日志，并刷新清单里被写过的分片条目，
+# 这样新书立即可搜，下次启动的增量检查也不会再重扫这些分片。
+
+def _insert_sorted(ids, item_id):
+    """按自然顺序插入 ID，已存在则忽略。返回是否插入。"""
+    target = parse_id(item_id)
+    pos = _lower_bound(ids, target)
+    if pos < len(ids) and ids[pos] == item_id:
+        return False
+    ids.insert(pos, item_id)
+    return True
+
+
+def _remove_sorted(ids, item_id):
+    """移除 ID，返回是否存在。"""
+    pos = _lower_bound(ids, parse_id(item_id))
+    if pos < len(ids) and ids[pos] == item_id:
+        del ids[pos]
+    elif item_id in ids:
+        ids.remove(item_id)
+    else:
+        return False
+    return True
+
+
+def _diff_keys(old_keys, new_keys, item_id, removals, additions):
+    for key, new_value in new_keys.items():
+        old_value = old_keys.get(key)
+        if old_value != new_value:
+            if old_value:
+                removals.append((key, old_value, item_id))
+            if new_value:
+                additions.append((key, new_value, item_id))
+
+
+def _refresh_manifest_entry(manifest, section, file_path, added_ids=(), before=None):
+    """
+    重新登记一个刚写过的分片：用新增 ID 扩展首尾范围，写入前的时间戳与清单一致时更新 mtime/size/hash。
+
+    不一致说明分片在这次写入之前已被外部改动 (或删除后重建)，那些改动不在索引里：
+    保留清单中的旧时间戳，下次启动维护索引时重扫这个分片。
+    :param before: 写入前分片的 (mtime_ns, size)；写入前不存在或不知道时为 None
+    """
+    filename = os.path.basename(file_path)
+    old_entry = manifest[section].get(filename)
+    entry = dict(old_entry or {"first": None, "last": None})
+    if before == ((old_entry.get("mtime"), old_entry.get("size")) if old_entry else None):
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+            st = os.fstat(f.fileno())
+        entry.update(mtime=st.st_mtime_ns, size=st.st_size, hash=hashlib.sha1(raw).hexdigest())
+    for item_id in added_ids:
+        if entry["first"] is None or parse_id(item_id) < parse_id(entry["first"]):
+            entry["first"] = item_id
+        if entry["last"] is None or parse_id(item_id) > parse_id(entry["last"]):
+            entry["last"] = item_id
+    manifest[section][filename] = entry
+
+
+def _refresh_copy_locations(file_path, index_pach):
+    """重新计算一个刚写过的副本分片的位置记录。"""
+    filename = os.path.basename(file_path)
+    records, entry, raw = _read_shard(file_path)
+    replace_copy_locations(filename, copy_locations(filename, raw, records, entry), index_pach)
+
+
+def invalidate_manifest():
+    """删除清单，强制下次启动全量重建（索引同步失败时使用）。"""
+    manifest_path = os.path.join(book_pach_index(), MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+def apply_delta_to_indexes(indexes, removals=(), additions=(), boundary=None):
+    """
+    把差量应用到内存中的索引字典 (就地修改)，参数含义见 _apply_index_delta。
+    indexes 中没有的索引跳过。同时有副本级状态索引时，母本级计数只随副本实际的增删变化，
+    同一段差量重复应用 (并入日志后、清掉日志前崩溃) 结果不变。
+    """
+    for key, value, item_id in removals:
+        removed = True
+        if key in indexes:
+            ids = indexes[key].get(value)
+            removed = bool(ids) and _remove_sorted(ids, item_id)
+            if ids == []:
+                del indexes[key][value]
+        if key == "status" and removed and "status_mother" in indexes:
+            _count_status_mother(indexes["status_mother"], value, item_id, -1)
+    for key, value, item_id in additions:
+        added = True
+        if key in indexes:
+            added = _insert_sorted(indexes[key].setdefault(value, []), item_id)
+        if key == "status" and added and "status_mother" in indexes:
+            _count_status_mother(indexes["status_mother"], value, item_id, 1)
+
+    if boundary:
+        sw = indexes["sw"]
+        for filename, mother_id in boundary.items():
+            start_mid, end_mid = sw.get(filename) or (mother_id, mother_id)
+            if parse_id(mother_id) < parse_id(start_mid):
+                start_mid = mother_id
+            if parse_id(mother_id) > parse_id(end_mid):
+                end_mid = mother_id
+            sw[filename] = [start_mid, end_mid]
+        indexes["sw"] = {filename: sw[filename] for filename in natsorted(sw)}
+
+
+def _apply_index_delta(removals=(), additions=(), boundary=None, touched_shards=(), ngram_upserts=None):
+    """
+    把一次修改的差量同步到索引。
+
+    书名/作者/类别/状态索引的增删只追加到索引差量日志；边界索引、n-gram 差量、副本位置记录和清单
+    只在新书入库或分片被重写时才需要改动，这时才持有索引锁。借还书只追加一行日志。
+
+    :param removals: [(索引名, 键, ID), ...] 需要从索引中移除的条目
+    :param additions: [(索引名, 键, ID), ...] 需要加入索引的条目
+    :param boundary: {副本文件名: 母本 ID} 该副本文件新写入了这个母本的副本，边界需要扩展到包含它
+    :param touched_shards: [(\"data\" 或 \"data-b\", 分片路径, [新增 ID, ...], 写入前的时间戳), ...]
+    :param ngram_upserts: {母本编码: gram 集合} 书名或作者有变化的母本，记入 n-gram 差量文件
+    """
+    if not (removals or additions or boundary or touched_shards or ngram_upserts):
+        return
+
+    if removals or additions:
+        if _append_index_delta(removals, additions) > INDEX_DELTA_FOLD_BYTES:
+            fold_index_delta()
+    if boundary or touched_shards or ngram_upserts:
+        with file_lock(_index_lock_target(), exclusive=True):
+            _write_index_delta(boundary, touched_shards, ngram_upserts)
+
+
+def _write_index_delta(boundary, touched_shards, ngram_upserts):
+    index_pach = book_pach_index()
+    paths = index_file_paths(index_pach)
+    # 必须在改动索引文件之前读取清单，否则索引文件的时间戳对不上会被判为失效
+    manifest = load_manifest(index_pach)
+
+    if boundary:
+        with open(paths["sw"], 'r', encoding='utf-8') as f:
+            indexes = {"sw": json.load(f)}
+        apply_delta_to_indexes(indexes, boundary=boundary)
+        write_indexes(indexes, paths)
+
+    if ngram_upserts:
+        ngram_delta = NgramDelta.load(index_pach)
+        if ngram_delta is not None:
+            for value, grams in ngram_upserts.items():
+                ngram_delta.upsert(value, grams)
+            ngram_delta.save(index_pach)
+        else:
+            # n-gram 文件已不可用，让下次启动全量重建
+            manifest = None
+            invalidate_manifest()
+
+    for section, file_path, _, _ in touched_shards:
+        if section == "data-b":
+            _refresh_copy_locations(file_path, index_pach)
+
+    if manifest is not None:
+        for section, file_path, added_ids, before in touched_shards:
+            _refresh_manifest_entry(manifest, section, file_path, added_ids, before)
+        write_manifest(index_pach, manifest)
+
+
+def _ngram_upserts(book_id, book_record):
+    value = encode_mother_id(book_id)
+    return {value: book_grams(book_record)} if value is not None else None
+
+
+def index_add_book(book_id, book_record, mother_file_path, copy_batches, stamps=None):
+    """
+    新书入库后同步索引。
+
+    :param book_id: 新母本 ID
+    :param book_record: 母本记录
+    :param mother_file_path: 母本写入的分片路径
+    :param copy_batches: [(副本分片路径, {副本ID: 副本记录}), ...]
+    :param stamps: {分片路径: 写入前的 (mtime_ns, size)}，见 _refresh_manifest_entry
+    """
+    stamps = stamps or {}
+    additions = [(key, value, book_id) for key, value in _mother_index_keys(book_record).items() if value]
+    boundary = {}
+    touched = [("data", mother_file_path, [book_id], stamps.get(mother_file_path))]
+    for copy_file_path, copies in copy_batches:
+        for copy_id, copy_info in copies.items():
+            additions.extend((key, value, copy_id) for key, value in _copy_index_keys(copy_info).items() if value)
+        boundary[os.path.basename(copy_file_path)] = book_id
+        touched.append(("data-b", copy_file_path, list(copies), stamps.get(copy_file_path)))
+
+    _apply_index_delta(additions=additions, boundary=boundary, touched_shards=touched,
+                       ngram_upserts=_ngram_upserts(book_id, book_record))
+
+
+def index_update_mother(book_id, old_record, new_record, mother_file_path):
+    """
+    母本字段修改后同步书名/作者/类别索引和 n-gram 索引。
+    mother_file_path 为 None 表示分片本身没有改写 (修改记在预写日志中)。
+    """
+    removals, additions = [], []
+    _diff_keys(_mother_index_keys(old_record), _mother_index_keys(new_record), book_id, removals, additions)
+    ngram_upserts = None
+    if book_grams(old_record) != book_grams(new_record):
+        ngram_upserts = _ngram_upserts(book_id, new_record)
+    touched = [("data", mother_file_path, [], None)] if mother_file_path else []
+    _apply_index_delta(removals, additions, touched_shards=touched, ngram_upserts=ngram_upserts)
+
+
+def index_update_copy(copy_id, old_record, new_record, copy_file_path):
+    """副本字段修改后同步状态索引。"""
+    removals, additions = [], []
+    _diff_keys(_copy_index_keys(old_record), _copy_index_keys(new_record), copy_id, removals, additions)
+    touched = [("data-b", copy_file_path, [], None)] if copy_file_path else []
+    _apply_index_delta(removals, additions, touched_shards=touched)
+
+
+def index_refresh_shards(touched_shards):
+    """
+    分片被整体重写但索引条目不变时 (例如预写日志合并) 调用：刷新清单中的时间戳和副本位置记录。
+
+    :param touched_shards: [("data" 或 "data-b", 分片路径, 重写前的时间戳), ...]
+    """
+    if touched_shards:
+        _apply_index_delta(touched_shards=[(section, file_path, [], before)
+                                           for section, file_path, before in touched_shards])
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from natsort import natsorted
+
+from .book_modify import book_pach_db_data, book_pach_db_data_b, book_pach_index
+
+# 原子写入：先写同目录下的临时文件并 fsync，再用 os.replace 替换目标文件 (同一文件系统内是原子操作)，
+# 最后 fsync 目录让改名本身落盘。任何时刻崩溃，目标文件要么是旧内容，要么是新内容，不会出现写了一半的文件。
+#
+# 可选校验和：在目标文件旁写一个 .sha256 文件，记录可以接受的内容摘要。
+# 校验和文件在替换数据文件之前写入，同时包含新旧两个摘要，所以替换前后崩溃都能通过校验；
+# 数据文件被外部工具写坏 (或磁盘位翻转) 时摘要对不上，启动检查会发现并修复。
+TEMP_SUFFIX = ".tmp"
+CHECKSUM_SUFFIX = ".sha256"
+CORRUPT_SUFFIX = ".corrupt"
+# 比这更旧的临时文件视为崩溃残留；更新的可能是其他进程正在进行的写入，不删除
+STALE_TEMP_SECONDS = 60
+
+# 分片中每条记录的键，用于从损坏的分片中逐条抢救记录
+_RECORD_KEY = re.compile(r'"(\d+-\d+-\d+(?:-\d+)?)"\s*:\s*')
+
+
+def _fsync_dir(directory):
+    # Windows 不能打开目录做 fsync，os.replace 本身已足够
+    if os.name == 'nt':
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_replace(path, data):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix=TEMP_SUFFIX, dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
+
+
+def file_stamp(path):
+    """文件当前的 (mtime_ns, size)，不存在时返回 None。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def checksum_path(path):
+    return path + CHECKSUM_SUFFIX
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_checksums(path):
+    """读取文件可接受的摘要列表；没有校验和文件 (或无法读取) 时返回 None。"""
+    try:
+        with open(checksum_path(path), 'r', encoding='utf-8') as f:
+            digests = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return digests if isinstance(digests, list) else None
+
+
+def atomic_write(path, data, checksum=False):
+    """
+    原子地写入整个文件。
+
+    :param data: 文件内容 (bytes)
+    :param checksum: 是否同时维护 .sha256 校验和文件
+    """
+    if checksum:
+        previous = read_checksums(path)
+        digests = [_digest(data)]
+        if previous:
+            digests.append(previous[0])
+        _write_replace(checksum_path(path), json.dumps(digests).encode('utf-8'))
+    _write_replace(path, data)
+    if not checksum and os.path.exists(checksum_path(path)):
+        # 不再维护校验和的文件，删除过期的校验和，免得被误判为损坏
+        os.remove(checksum_path(path))
+
+
+def atomic_write_json(path, obj, checksum=False, **dump_kwargs):
+    """原子地写入 JSON 文件，dump_kwargs 传给 json.dumps (ensure_ascii 固定为 False)。"""
+    atomic_write(path, json.dumps(obj, ensure_ascii=False, **dump_kwargs).encode('utf-8'), checksum)
+
+
+def checksum_matches(path, raw):
+    """已读入的文件内容 raw 是否与校验和文件一致；没有校验和文件时视为一致。"""
+    digests = read_checksums(path)
+    return digests is None or _digest(raw) in digests
+
+
+def verify_file(path):
+    """
+    检查一个 JSON 分片是否完好。
+
+    :return: (是否完好, 原因)
+    """
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+    except OSError as e:
+        return False, f"无法读取: {e}"
+    if not checksum_matches(path, raw):
+        return False, "校验和不一致"
+    try:
+        json.loads(raw.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return False, "JSON 格式错误"
+    return True, ""
+
+
+def salvage_records(raw):
+    """
+    从损坏的分片中逐条抢救记录：找到每个 '"ID": ' 后尝试解码一个完整的值，解不出来的跳过。
+
+    :return: {ID: 记录}，保持文件中的顺序
+    """
+    decoder = json.JSONDecoder()
+    text = raw.decode('utf-8', errors='replace')
+    records = {}
+    for match in _RECORD_KEY.finditer(text):
+        try:
+            value, _ = decoder.raw_decode(text, match.end())
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            records[match.group(1)] = value
+    return records
+
+
+def repair_shard(path):
+    """
+    修复一个损坏的分片：原文件改名为 .corrupt 保留备查，抢救出的记录原子写回。
+
+    :return: 抢救出的 {ID: 记录}
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    records = salvage_records(raw)
+    os.replace(path, path + CORRUPT_SUFFIX)
+    atomic_write_json(path, records, checksum=True, indent=2)
+    print(f"⚠️ 已修复损坏的分片 {os.path.basename(path)}：抢救出 {len(records)} 条记录，"
+          f"原文件保存为 {os.path.basename(path)}{CORRUPT_SUFFIX}")
+    return records
+
+
+def _remove_stale_temps(directory):
+    """删除崩溃残留的临时文件，返回它们对应的目标文件名集合。"""
+    targets = set()
+    if not os.path.isdir(directory):
+        return targets
+    now = time.time()
+    for filename in os.listdir(directory):
+        if not filename.endswith(TEMP_SUFFIX):
+            continue
+        file_path = os.path.join(directory, filename)
+        try:
+            if now - os.path.getmtime(file_path) < STALE_TEMP_SECONDS:
+                continue
+            os.remove(file_path)
+        except OSError:
+            continue
+        # book-3.json.abc123.tmp -> book-3.json
+        targets.add(filename.rsplit('.', 2)[0])
+    return targets
+
+
+def recover_store(full=False):
+    """
+    启动时的数据检查与修复。
+
+    1. 删除崩溃残留的临时文件；
+    2. 检查分片：full=True 时检查全部分片，否则只检查每个目录中编号最大的分片 (新增记录总是写入它)
+       和留下过临时文件的分片；
+    3. 校验和不一致或 JSON 损坏的分片逐条抢救记录后原子写回。
+
+    索引文件由清单中的时间戳保护，损坏时会被增量检查发现并重建，这里不处理。
+    其余分片的损坏在建索引读到它们时发现，按同样的方式修复 (见 book_index._read_shard)。
+    :return: 被修复的分片路径列表
+    """
+    index_pach = book_pach_index()
+    _remove_stale_temps(index_pach)
+    _remove_stale_temps(os.path.join(index_pach, "offsets"))
+    _remove_stale_temps(os.path.dirname(book_pach_db_data()))
+
+    repaired = []
+    for directory in (book_pach_db_data(), book_pach_db_data_b()):
+        crashed = _remove_stale_temps(directory)
+        filenames = natsorted(f for f in os.listdir(directory) if f.endswith(".json")) \
+            if os.path.isdir(directory) else []
+        if not full:
+            filenames = [name for name in filenames if name in crashed] + filenames[-1:]
+        for filename in dict.fromkeys(filenames):
+            file_path = os.path.join(directory, filename)
+            ok, reason = verify_file(file_path)
+            if ok:
+                continue
+            print(f"🚨 警告: 分片 {filename} 检查失败 ({reason})，正在修复...")
+            repair_shard(file_path)
+            repaired.append(file_path)
+    return repaired
@@ -1,8 +1,46 @@
 import datetime
 import json
 import os
-from .book_baidu import find_next_available_book_slot, find_next_available_copy_slot, find_relevant_copy_files
-from .book_modify import book_pach_db_data, book_pach_db_data_b, book_pach_index
+from .book_alloc import record_tail
+from .book_baidu import DB_PREFIX_B, MAX_RECORDS, find_copy_file, find_next_available_book_slot, \
+    find_next_available_copy_slot, get_book_record_by_id
+from .book_cache import invalidate_shard, read_shard
+from .book_copyloc import copy_file_number
+from .book_index import index_add_book, index_refresh_shards, index_update_copy, index_update_mother, \
+    invalidate_manifest
+from .book_io import atomic_write_json, file_stamp
+from .book_lock import file_lock, file_locks
+from .book_modify import book_pach_alloc, book_pach_db_data, book_pach_db_data_b, book_pach_index
+from .book_shard import write_shard
+from .book_wal import WAL_COMPACT_THRESHOLD, append_edit, compact_wal, overlay_record, wal_pending
+
+
+def _sync_index(sync_func, *args):
+    """
+    把一次写操作的差量同步到索引。数据已经落盘，索引同步失败不影响写入结果，
+    但要删除清单，让下次启动全量重建索引。
+    """
+    try:
+        sync_func(*args)
+    except Exception as e:
+        print(f"⚠️ 警告: 索引同步失败，下次启动将重建索引: {e}")
+        try:
+            invalidate_manifest()
+        except OSError:
+            pass
+
+
+def _compact_wal_if_needed():
+    """预写日志积累到阈值后合并回分片，并刷新这些分片在索引清单中的时间戳。"""
+    if wal_pending() < WAL_COMPACT_THRESHOLD:
+        return
+    try:
+        touched = compact_wal()
+    except Exception as e:
+        # 日志仍然完整，读取时照常叠加，下次启动会再次合并
+        print(f"⚠️ 警告: 预写日志合并失败: {e}")
+        return
+    _sync_index(index_refresh_shards, touched)
 
 
 def book_pach():
@@ -45,9 +83,8 @@ def book__():
         # 检查文件是否存在
         if not os.path.exists(file_path):
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    # 写入空字典 {}
-                    json.dump({}, f, ensure_ascii=False, indent=4)
+                # 写入空字典 {}
+                atomic_write_json(file_path, {}, indent=4)
                 print(f"成功创建空 JSON 文件: {file_path}")
             except Exception as e:
                 print(f"创建文件失败 {file_path}: {e}")
@@ -77,18 +114,7 @@ def add_db(book_title, author, publisher, isbn, pages, words, category, quantity
         print("错误：入库数量必须是有效数字。")
         return False
 
-    # ----------------------------------------------------
-    # 步骤一：处理母本数据 (book-N.json)
-    # ----------------------------------------------------
-
-    # 获取下一个可用的母本文件路径和新的母本 ID (e.g., '1-1-001')
-    try:
-        book_file_path, new_book_id = find_next_available_book_slot()
-    except Exception as e:
-        print(f"获取母本槽位失败: {e}")
-        return False
-
-    # 构造母本记录
+    # 构造母本记录，副本 ID 列表在规划槽位后填入
     book_record = {
         "name": book_title,
         "author": author,
@@ -98,56 +124,114 @@ def add_db(book_title, author, publisher, isbn, pages, words, category, quantity
         "words": words,
         "category": category,
         "date_added": time_stamp,  # 使用生成的 time_stamp
-        # 副本ID列表，初始为空，后面会由副本写入函数更新
+        # 副本ID列表
         "copies": []
     }
 
-    # 写入母本数据
-    try:
-        with open(book_file_path, 'r+', encoding='utf-8') as f:
-            data = json.load(f)
-            data[new_book_id] = book_record
-
-            # 写回文件，覆盖原有内容
-            f.seek(0)
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            f.truncate()
-        print(f"✅ 母本记录 {new_book_id} 成功写入文件: {book_file_path}")
-    except Exception as e:
-        print(f"❌ 母本数据写入失败: {e}")
-        # 理论上应该回滚操作，但这里简化处理，直接返回失败
+    # 分配锁让多个实例的入库互斥 (从规划槽位到写完分片)，其他实例的查询和字段修改不受影响
+    with file_lock(book_pach_alloc(), exclusive=True):
+        written = _write_new_book(book_record, quantity)
+    if written is None:
         return False
+    book_file_path, new_book_id, copy_batches, stamps = written
 
     # ----------------------------------------------------
-    # 步骤二：处理副本数据 (book-b-N.json)
+    # 步骤四：同步索引，新书立即可搜
     # ----------------------------------------------------
+    _sync_index(index_add_book, new_book_id, book_record, book_file_path, copy_batches, stamps)
 
-    # 追踪所有生成的副本ID
-    all_copy_ids = []
-    # 从 1 开始生成副本编号 (e.g., 1, 2, 3...)
-    next_copy_num = 1
+    return True
 
-    # 循环直到所有副本都被分配和写入
-    while quantity > 0:
-        # 1. 查找下一个可用副本文件槽位和剩余容量
+
+def _write_new_book(book_record, quantity):
+    """
+    规划槽位并写入母本和全部副本 (调用方持有分配锁)。
+
+    :return: (母本分片路径, 新母本 ID, [(副本分片路径, {副本ID: 副本记录}), ...], {分片路径: 写入前的时间戳})；
+             失败返回 None
+    """
+    # ----------------------------------------------------
+    # 步骤一：规划槽位：确定新 ID 和之后要加锁写入的分片 (不改动已有记录)
+    # ----------------------------------------------------
+
+    # 获取下一个可用的母本文件路径和新的母本 ID (e.g., '1-1-001')
+    try:
+        book_file_path, new_book_id = find_next_available_book_slot()
+        copy_batches = _plan_copy_batches(new_book_id, quantity)
+    except Exception as e:
+        print(f"获取槽位失败: {e}")
+        return None
+
+    # 副本 ID 列表已经确定，母本分片只需写一次
+    book_record["copies"] = [copy_id for _, copies in copy_batches for copy_id in copies]
+
+    # 要写的分片全部加排他锁，与预写日志合并等改写分片的操作互斥；锁内重新读取分片内容
+    with file_locks([book_file_path] + [path for path, _ in copy_batches], exclusive=True):
+        # 写入前的时间戳：同步索引时与清单比较，判断分片在这次写入之前有没有被外部改动过
+        stamps = {path: file_stamp(path) for path in [book_file_path] + [path for path, _ in copy_batches]}
+
+        # ----------------------------------------------------
+        # 步骤二：写入副本数据 (book-b-N.json)，每个副本文件只写一次
+        # ----------------------------------------------------
+        # 先写副本再写母本：母本是最后落盘的，中途失败不会留下指向不存在副本的母本
+        for copy_file_path, copies_to_write in copy_batches:
+            try:
+                # 已有文件经共享缓存读取 (规划槽位时刚解析过)，新文件从空字典开始
+                data = dict(read_shard(copy_file_path))
+                data.update(copies_to_write)
+
+                # 原子写回文件 (临时文件 + fsync + 替换)，中途崩溃不会留下写了一半的分片
+                atomic_write_json(copy_file_path, data, checksum=True, indent=2)
+                invalidate_shard(copy_file_path)
+                print(f"✅ 成功向文件 {copy_file_path} 添加 {len(copies_to_write)} 个副本记录。")
+            except Exception as e:
+                print(f"❌ 副本数据写入失败: {e}")
+                return None
+
+        # 最后一批写入的总是编号最大的副本文件，登记分配状态
+        record_tail("data-b", copy_file_path, copy_file_number(os.path.basename(copy_file_path)), len(data))
+
+        # ----------------------------------------------------
+        # 步骤三：写入母本数据 (book-N.json)
+        # ----------------------------------------------------
         try:
-            copy_file_path, remaining_slots = find_next_available_copy_slot()
+            data = dict(read_shard(book_file_path))
+            data[new_book_id] = book_record
+            # 每条记录一行，同时写入偏移表
+            write_shard(book_file_path, data)
+            invalidate_shard(book_file_path)
+            record_tail("data", book_file_path, int(new_book_id.split('-')[1]), len(data))
+            print(f"✅ 母本记录 {new_book_id} 成功写入文件: {book_file_path}")
         except Exception as e:
-            print(f"获取副本槽位失败: {e}")
-            return False
+            print(f"❌ 母本数据写入失败: {e}")
+            return None
 
-        # 2. 确定本次写入当前文件的副本数量
-        copies_to_add_now = min(quantity, remaining_slots)
+    return book_file_path, new_book_id, copy_batches, stamps
 
-        # 3. 构造本次要写入的副本记录
-        copies_to_write = {}
-        for _ in range(copies_to_add_now):
-            # 副本 ID 格式: 母本 ID - 副本编号 (e.g., '1-1-001-1')
-            copy_id = f"{new_book_id}-{next_copy_num}"
-            all_copy_ids.append(copy_id)
 
-            # 默认副本状态为“正常”
-            copy_record = {
+def _plan_copy_batches(new_book_id, quantity):
+    """
+    一次性规划新书全部副本的位置：先填满当前最后一个副本文件，其余依次放入后面的新文件。
+    只查找一次副本槽位，返回的批次就是随后要加锁写入的分片。
+
+    调用方持有分配锁，其他实例不会在规划之后、写入之前往这些分片添加记录，剩余槽位数因此可靠。
+    不改动已有记录；最后一个副本文件已满时，查找槽位会新建一个空分片并登记到分配状态。
+
+    :return: [(副本分片路径, {副本ID: 副本记录}), ...]
+    """
+    copy_file_path, remaining_slots = find_next_available_copy_slot()
+    base_dir = os.path.dirname(copy_file_path)
+    file_index = copy_file_number(os.path.basename(copy_file_path))
+
+    batches = []
+    # 从 1 开始生成副本编号 (e.g., 1, 2, 3...)
+    next_copy_num = 1
+    while quantity > 0:
+        copies_to_add_now = min(quantity, remaining_slots)
+        copies = {}
+        for _ in range(copies_to_add_now):
+            # 副本 ID 格式: 母本 ID - 副本编号 (e.g., '1-1-001-1')，默认副本状态为“正常”
+            copies[f"{new_book_id}-{next_copy_num}"] = {
                 "book_id": new_book_id,
                 "status": "正常",
                 "borrower_name": None,
@@ -155,50 +239,15 @@ def add_db(book_title, author, publisher, isbn, pages, words, category, quantity
                 "due_date": None,
                 "notes": None
             }
-            copies_to_write[copy_id] = copy_record
             next_copy_num += 1
-
-        # 4. 写入副本数据
-        try:
-            with open(copy_file_path, 'r+', encoding='utf-8') as f:
-                # 注意：这里不能简单使用 json.load(f) 如果文件不存在或为空
-                # find_next_available_copy_slot 确保文件是存在的且已初始化为 {}
-                data = json.load(f)
-                data.update(copies_to_write)
-
-                # 写回文件
-                f.seek(0)
-                json.dump(data, f, ensure_ascii=False, indent=2)
-                f.truncate()
-
-            print(f"✅ 成功向文件 {copy_file_path} 添加 {copies_to_add_now} 个副本记录。")
-
-        except Exception as e:
-            print(f"❌ 副本数据写入失败: {e}")
-            return False
-
-        # 5. 更新剩余待处理数量
+        batches.append((copy_file_path, copies))
         quantity -= copies_to_add_now
 
-    # ----------------------------------------------------
-    # 步骤三：更新母本记录中的副本列表 (可选，但推荐)
-    # ----------------------------------------------------
-    # 这一步是确保母本记录中的 "copies" 列表是最新的，便于快速查询该书的所有副本 ID。
-    try:
-        with open(book_file_path, 'r+', encoding='utf-8') as f:
-            data = json.load(f)
-            # 更新母本记录中的副本 ID 列表
-            data[new_book_id]["copies"] = all_copy_ids
-
-            f.seek(0)
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            f.truncate()
-        print(f"✅ 母本记录 {new_book_id} 的副本列表已更新。")
-    except Exception as e:
-        # 如果更新失败，至少母本和副本数据已经保存，只是母本的 copies 字段不完整
-        print(f"⚠️ 警告: 母本副本列表更新失败: {e}")
-
-    return True
+        # 当前文件已写满，后面的副本放入下一个新文件
+        file_index += 1
+        copy_file_path = os.path.join(base_dir, f"{DB_PREFIX_B}{file_index}.json")
+        remaining_slots = MAX_RECORDS
+    return batches
 
 
 def update_mother_field(book_id, key, val):
@@ -228,32 +277,27 @@ def update_mother_field(book_id, key, val):
             print(f"ERROR: 找不到 ID {book_id} 对应的文件: {file_path}")
             return False
 
-        # 2. 💾 读取整个文件内容
-        # 在读写操作中，必须锁定整个文件以避免并发问题，但在单用户应用中可以简化。
-        with open(file_path, 'r+', encoding='utf-8') as f:
-            f.seek(0)  # 确保从文件开头开始读取
-            data = json.load(f)
-
-            # 3. 🔄 查找记录并更新字段
-            if book_id in data:
-                # 检查记录中是否有该键，并更新其值
-                current_record = data[book_id]
+        # 读-改-写期间对分片加排他锁，其他实例对同一分片的修改排队，修改其他分片不受影响
+        with file_lock(file_path, exclusive=True):
+            # 2. 💾 读取当前记录 (偏移表或共享缓存，已叠加预写日志中尚未合并的修改)
+            old_record = get_book_record_by_id(book_id)
+            if old_record is None:
+                print(f"ERROR: 文件 {file_path} 中找不到母本 ID {book_id} 的记录。")
+                return False
 
-                # 特殊处理：如果修改的是 'quantity' (入库数)，你可能需要重新计算副本索引
-                # 但这里我们只进行数据的简单修改
-                current_record[key] = val
+            # 3. 🔄 更新字段
+            # 特殊处理：如果修改的是 'quantity' (入库数)，你可能需要重新计算副本索引
+            # 但这里我们只进行数据的简单修改
+            current_record = dict(old_record)
+            current_record[key] = val
 
-                # 4. 写入操作：清空文件并写入新数据
-                f.seek(0)  # 移动指针到文件开头
-                f.truncate()  # 清空文件内容
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            # 4. 写入操作：只向预写日志追加一行并 fsync，不重写分片；日志积累到阈值后统一合并回分片
+            append_edit("data", file_path, book_id, key, val)
 
-                # ⚠️ 提示：如果修改了书名/作者/分类等字段，你可能还需要在这里更新对应的索引文件！
-
-                return True
-            else:
-                print(f"ERROR: 文件 {file_path} 中找不到母本 ID {book_id} 的记录。")
-                return False
+        # 5. 同步书名/作者/分类索引 (分片本身没有改写)
+        _sync_index(index_update_mother, book_id, old_record, current_record, None)
+        _compact_wal_if_needed()
+        return True
 
     except json.JSONDecodeError:
         print(f"ERROR: 文件 {file_path} 内容格式错误，无法修改。")
@@ -266,7 +310,7 @@ def update_mother_field(book_id, key, val):
 def update_copy_field(copy_id, key, val):
     """
     更新指定副本 ID (copy_id) 的单个字段 (key) 的值 (val)。
-    使用母本 ID 和边界索引来定位正确的副本数据文件。
+    利用副本位置索引 (或边界索引) 定位真正包含该副本的数据文件。
 
     :param copy_id: 完整的副本 ID (e.g., '1-3-010-01')
     :param key: 要修改的字段的英文键名
@@ -283,46 +327,36 @@ def update_copy_field(copy_id, key, val):
 
         mother_id = '-'.join(parts[:-1])  # '1-3-010'
 
-        # 2. 📁 利用边界索引定位文件
-        # 调用核心函数，找到包含该母本副本的所有文件名
-        relevant_files = find_relevant_copy_files(mother_id)
-
-        # 对于修改操作，理论上一个副本 ID 只会存在于一个文件中。
-        # 我们只取第一个相关文件。
-        if not relevant_files:
-            print(f"ERROR: 找不到母本 ID {mother_id} 对应的副本文件记录。")
+        # 2. 📁 定位副本所在的文件
+        # 同一母本的副本可能跨两个文件，必须找到真正包含该副本的那一个 (先查副本位置索引，再退回边界索引)
+        file_path = find_copy_file(copy_id)
+        if not file_path:
+            print(f"ERROR: 找不到母本 ID {mother_id} 下副本 {copy_id} 所在的副本文件。")
             return False
 
-        # 构造文件路径
-        filename = relevant_files[0]
-        base_dir = book_pach_db_data_b()  # 获取副本数据目录
-        file_path = os.path.join(base_dir, filename)
-
         if not os.path.exists(file_path):
             print(f"ERROR: 副本文件不存在: {file_path}")
             return False
 
-        # 3. 💾 读取、修改和写入
-        with open(file_path, 'r+', encoding='utf-8') as f:
-            f.seek(0)
-            data = json.load(f)  # data 格式: {副本ID: 副本信息字典, ...}
-
-            if copy_id in data:
-                current_copy_record = data[copy_id]
-
-                # 📢 提示：如果修改的是 'status'，你可能需要在成功保存后更新索引。
+        # 读-改-写期间对副本分片加排他锁 (同一本书的借还由多个柜台同时操作时不会互相覆盖)
+        with file_lock(file_path, exclusive=True):
+            # 3. 💾 读取当前记录 (经共享缓存，并叠加预写日志中尚未合并的修改)
+            data = read_shard(file_path)  # data 格式: {副本ID: 副本信息字典, ...}
+            if copy_id not in data:
+                print(f"ERROR: 文件 {file_path} 中找不到副本 ID {copy_id} 的记录。")
+                return False
 
-                current_copy_record[key] = val
+            old_copy_record = dict(overlay_record(copy_id, data[copy_id]))
+            current_copy_record = dict(old_copy_record)
+            current_copy_record[key] = val
 
-                # 写入操作：清空文件并写入新数据
-                f.seek(0)
-                f.truncate()
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            # 4. 写入操作：只向预写日志追加一行并 fsync，不重写分片
+            append_edit("data-b", file_path, copy_id, key, val)
 
-                return True
-            else:
-                print(f"ERROR: 文件 {file_path} 中找不到副本 ID {copy_id} 的记录。")
-                return False
+        # 5. 同步状态索引 (分片本身没有改写)
+        _sync_index(index_update_copy, copy_id, old_copy_record, current_copy_record, None)
+        _compact_wal_if_needed()
+        return True
 
     except json.JSONDecodeError:
         print(f"ERROR: 副本文件 {file_path} 内容格式错误，无法修改。")
@@ -0,0 +1,127 @@
+import os
+import threading
+from contextlib import contextmanager, ExitStack
+
+from natsort import natsort_keygen
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl：退化为不加锁，与以前一样只支持单个实例使用一份数据
+    fcntl = None
+
+# 分片级的跨进程读写锁 (咨询锁)。
+#
+# 每个被保护的文件旁有一个 .lock 空文件，对它加 flock：读取方加共享锁，读-改-写方加排他锁。
+# 锁按分片划分，多个柜台同时操作不同的分片互不影响；锁文件只创建不删除，删除会让两个进程各锁各的文件。
+# 同一线程内可以重复获取同一把锁 (只在最外层真正加锁)，已持有排他锁时再要共享锁直接通过，
+# 反过来从共享锁升级为排他锁不支持，会抛出 RuntimeError。
+#
+# 需要同时锁多个分片时一律通过 file_locks 按自然顺序加锁，避免两个进程交叉等待造成死锁。
+# 各模块的加锁顺序：分配锁 -> 分片锁 -> 预写日志锁。
+# 索引锁在分片锁之外：启动维护索引时持有索引锁，期间会合并预写日志、修复损坏的分片而去取分片锁。
+# 反过来不允许：持有分配锁或分片锁时不得再取索引锁，写入方都在释放这些锁之后才同步索引 (book_jiajia._sync_index)。
+# 索引差量日志锁 (见 book_index) 是最内层的锁：持有索引锁时可以再取它，持有它时不再取其他锁。
+LOCK_SUFFIX = ".lock"
+
+_held = threading.local()
+_natural_key = natsort_keygen()
+
+
+def lock_path(path):
+    return path + LOCK_SUFFIX
+
+
+def _held_locks():
+    # 当前线程持有的锁：{锁文件路径: [是否排他, 重入次数]}
+    if not hasattr(_held, "locks"):
+        _held.locks = {}
+    return _held.locks
+
+
+@contextmanager
+def file_lock(path, exclusive=False):
+    """
+    对 path 加读写锁 (锁文件为 path + '.lock')。
+
+    :param path: 被保护的文件 (分片、预写日志、分配状态等)
+    :param exclusive: True 为排他锁 (写)，False 为共享锁 (读)
+    """
+    held = _held_locks()
+    key = os.path.abspath(lock_path(path))
+    entry = held.get(key)
+    if entry is not None:
+        if exclusive and not entry[0]:
+            raise RuntimeError(f"不支持把共享锁升级为排他锁: {path}")
+        entry[1] += 1
+        try:
+            yield
+        finally:
+            entry[1] -= 1
+        return
+
+    if fcntl is None:
+        held[key] = [exclusive, 1]
+        try:
+            yield
+        finally:
+            del held[key]
+        return
+
+    os.makedirs(os.path.dirname(key), exist_ok=True)
+    fd = os.open(key, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        held[key] = [exclusive, 1]
+        try:
+            yield
+        finally:
+            del held[key]
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def try_file_lock(path):
+    """
+    尝试获取排他锁，不等待。
+
+    :return: (上下文中) 是否拿到了锁；已被其他进程持有时为 False
+    """
+    if fcntl is None:
+        with file_lock(path, exclusive=True):
+            yield True
+        return
+
+    key = os.path.abspath(lock_path(path))
+    if key in _held_locks():
+        with file_lock(path, exclusive=True):
+            yield True
+        return
+
+    os.makedirs(os.path.dirname(key), exist_ok=True)
+    fd = os.open(key, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        _held_locks()[key] = [True, 1]
+        try:
+            yield True
+        finally:
+            del _held_locks()[key]
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def file_locks(paths, exclusive=False):
+    """按自然顺序对多个文件加锁 (去重)，全部拿到后才进入。"""
+    with ExitStack() as stack:
+        for path in sorted(set(paths), key=_natural_key):
+            stack.enter_context(file_lock(path, exclusive))
+        yield
@@ -29,3 +29,15 @@ def book_pach_index():
     folder_path = os.path.join(current_directory, 'index')
     # print(folder_path)
     return folder_path
+
+
+def book_pach_wal():
+    current_directory = os.getcwd()
+    file_path = os.path.join(current_directory, 'db', 'wal.jsonl')
+    return file_path
+
+
+def book_pach_alloc():
+    current_directory = os.getcwd()
+    file_path = os.path.join(current_directory, 'db', 'alloc.json')
+    return file_path
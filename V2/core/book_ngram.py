@@ -0,0 +1,253 @@
+import json
+import os
+from array import array
+from bisect import bisect_left
+
+from .book_compact import CompactIndex, encode_mother_id, write_compact_values
+from .book_io import atomic_write_json
+
+# 书名/作者的 n-gram 倒排索引：{二元字符组或单字: [母本编码, ...]}，用于按书名或作者中的任意片段搜索。
+# 主文件是紧凑格式 (只读键目录，按键读取倒排列表)，体积大、只在启动时重写；
+# 写入时的修改记在一个小的差量文件里，查询时叠加在主文件之上，差量积累到一定规模再并入主文件。
+NGRAM_FILE = "book-ngram-index.bidx"
+NGRAM_DELTA_FILE = "book-ngram-delta.json"
+# 差量登记的母本数超过该值时，启动时把差量并入主文件
+NGRAM_FOLD_THRESHOLD = 5000
+
+
+def normalize_text(text):
+    """统一大小写并去掉空白，建索引和查询使用同一规则。"""
+    return "".join(str(text).lower().split())
+
+
+def text_grams(text):
+    """查询词的二元字符组 (bigram) 集合；只有一个字时返回该字本身。"""
+    text = normalize_text(text)
+    if len(text) == 1:
+        return {text}
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def index_grams(text):
+    """建索引用的 gram：全部二元字符组，再加上每个单字 (单字查询直接读这个字的倒排列表)。"""
+    text = normalize_text(text)
+    return {text[i:i + 2] for i in range(len(text) - 1)} | set(text)
+
+
+def book_grams(book_info):
+    """母本记录 (书名 + 作者) 的 n-gram 集合。书名和作者分开切分，不会产生跨字段的组合。"""
+    return index_grams(book_info.get("name") or "") | index_grams(book_info.get("author") or "")
+
+
+def add_book_grams(index, book_id, book_info):
+    """把一条母本记录登记到 n-gram 局部索引 {gram: [母本编码, ...]}。无法编码的 ID 不登记。"""
+    value = encode_mother_id(book_id)
+    if value is None:
+        return
+    for gram in book_grams(book_info):
+        if gram not in index:
+            index[gram] = []
+        index[gram].append(value)
+
+
+def merge_grams(index, partial):
+    """把局部 n-gram 索引并入总索引 (值为 array('q'))，必要时重新排序以保持升序。"""
+    for gram, values in partial.items():
+        target = index.get(gram)
+        if target is None:
+            index[gram] = array('q', values)
+            continue
+        needs_sort = bool(target) and target[-1] > values[0]
+        target.extend(values)
+        if needs_sort:
+            index[gram] = array('q', sorted(target))
+
+
+def invert_grams(partial):
+    """{gram: [母本编码, ...]} -> {母本编码: gram 集合}"""
+    grams_by_value = {}
+    for gram, values in partial.items():
+        for value in values:
+            grams_by_value.setdefault(value, set()).add(gram)
+    return grams_by_value
+
+
+def _file_stamp(file_path):
+    st = os.stat(file_path)
+    return {"mtime": st.st_mtime_ns, "size": st.st_size}
+
+
+def ngram_stamp(index_pach):
+    """主文件和差量文件的时间戳 (缺失时为 None)，变化说明常驻的 NgramIndex 需要重新加载。"""
+    stamps = []
+    for filename in (NGRAM_FILE, NGRAM_DELTA_FILE):
+        try:
+            stamps.append(_file_stamp(os.path.join(index_pach, filename)))
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+
+class NgramDelta:
+    """
+    主文件写入之后的增量修改。
+
+    upserts: {母本编码: gram 集合}，这些母本在主文件中的条目全部作废，以这里为准；
+    tombstones: [[起, 止], ...] 编码区间，主文件中落在区间内的母本全部作废 (整个分片被重扫时使用)；
+    base: 主文件的时间戳，与当前主文件不一致时差量无效。
+    """
+
+    def __init__(self, base, upserts=None, tombstones=None):
+        self.base = base
+        self.upserts = upserts or {}
+        self.tombstones = tombstones or []
+
+    @classmethod
+    def load(cls, index_pach):
+        """读取差量文件。主文件或差量文件缺失、损坏，或两者不匹配时返回 None。"""
+        base_path = os.path.join(index_pach, NGRAM_FILE)
+        try:
+            with open(os.path.join(index_pach, NGRAM_DELTA_FILE), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data["base"] != _file_stamp(base_path):
+                return None
+            upserts = {int(value): set(grams) for value, grams in data["upserts"].items()}
+            return cls(data["base"], upserts, data["tombstones"])
+        except (OSError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+            return None
+
+    def save(self, index_pach):
+        data = {
+            "base": self.base,
+            "upserts": {str(value): sorted(grams) for value, grams in self.upserts.items()},
+            "tombstones": self.tombstones,
+        }
+        atomic_write_json(os.path.join(index_pach, NGRAM_DELTA_FILE), data)
+
+    def size(self):
+        return len(self.upserts) + len(self.tombstones)
+
+    def upsert(self, value, grams):
+        self.upserts[value] = set(grams)
+
+    def replace_ranges(self, ranges, grams_by_value):
+        """
+        整段替换：ranges 内的母本全部作废，再登记重新扫描得到的 grams_by_value。
+
+        :param ranges: [(起始编码, 结束编码), ...]
+        """
+        for lo, hi in ranges:
+            self.tombstones.append([lo, hi])
+            for value in [value for value in self.upserts if lo <= value <= hi]:
+                del self.upserts[value]
+        for value, grams in grams_by_value.items():
+            self.upsert(value, grams)
+
+    def hidden(self, value):
+        """主文件中该母本的条目是否已被差量覆盖。"""
+        return value in self.upserts or any(lo <= value <= hi for lo, hi in self.tombstones)
+
+
+def _contains(values, value):
+    pos = bisect_left(values, value)
+    return pos < len(values) and values[pos] == value
+
+
+class NgramIndex:
+    """n-gram 索引的查询视图：主文件 (CompactIndex) 加差量。"""
+
+    def __init__(self, base, delta):
+        self.base = base
+        self.delta = delta
+
+    @classmethod
+    def load(cls, index_pach):
+        """加载 n-gram 索引，文件缺失或不一致时返回 None。"""
+        delta = NgramDelta.load(index_pach)
+        if delta is None:
+            return None
+        try:
+            base = CompactIndex(os.path.join(index_pach, NGRAM_FILE))
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(base, delta)
+
+    def search(self, term):
+        """
+        查找书名或作者中包含 term 的母本。
+
+        只有一个字时直接读这个字的倒排列表；两个字以上时把 term 切成二元组求交集 (见 _intersect_rarest_first)。
+        注意二元组求交只保证每个二元组都出现过，极少数情况下 (二元组分散出现) 会多出结果。
+        结果只按编码 (即 ID 的自然顺序) 排列，不计算相关度，也不按相关度排序。
+
+        :return: 按升序排列的母本编码列表
+        """
+        term = normalize_text(term)
+        if not term:
+            return []
+
+        grams = text_grams(term)
+        if len(term) == 1:
+            result = self.base.get_ints(term) if term in self.base else []
+        else:
+            result = self._intersect_rarest_first(grams)
+        matched = {value for value, value_grams in self.delta.upserts.items() if grams <= value_grams}
+
+        if self.delta.size():
+            result = {value for value in result if not self.delta.hidden(value)}
+            result.update(matched)
+        else:
+            result = set(result)
+        return sorted(result)
+
+    def _intersect_rarest_first(self, grams):
+        """
+        主文件中同时含有全部 grams 的母本编码。
+
+        按倒排列表长度从短到长求交集：候选集合一开始就是最短的那个列表，
+        之后每个列表只需逐个检查候选，遇到空集立即结束。这里的顺序只影响求交的开销，与结果排序无关。
+        """
+        candidates = None
+        for gram in sorted(grams, key=self.base.count):
+            if gram not in self.base:
+                return []
+            postings = self.base.get_ints(gram)
+            if candidates is None:
+                candidates = postings
+            elif len(candidates) * 16 < len(postings):
+                candidates = [value for value in candidates if _contains(postings, value)]
+            else:
+                # 两个列表长度相近时二分不如直接查集合
+                present = set(postings)
+                candidates = [value for value in candidates if value in present]
+            if not candidates:
+                return []
+        return candidates or []
+
+
+def write_ngram_index(index_pach, index):
+    """写入 n-gram 主文件，并写一个空差量与之对应。"""
+    base_path = os.path.join(index_pach, NGRAM_FILE)
+    write_compact_values(base_path, index, "mother")
+    NgramDelta(_file_stamp(base_path)).save(index_pach)
+
+
+def fold_ngram_delta(index_pach, delta):
+    """把差量并入主文件：去掉被覆盖的条目，加入差量登记的 gram，重写主文件。"""
+    index = CompactIndex(os.path.join(index_pach, NGRAM_FILE)).read_all()
+    for gram in list(index):
+        values = array('q', (value for value in index[gram] if not delta.hidden(value)))
+        if values:
+            index[gram] = values
+        else:
+            del index[gram]
+
+    additions = {}
+    for value, grams in delta.upserts.items():
+        for gram in grams:
+            additions.setdefault(gram, []).append(value)
+    for gram, values in additions.items():
+        values.sort()
+        merge_grams(index, {gram: values})
+
+    write_ngram_index(index_pach, index)
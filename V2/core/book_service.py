@@ -0,0 +1,360 @@
+import threading
+
+from .book_author import AuthorPrefixIndex, warn_if_pinyin_missing
+from .book_compact import copy_mother_value, decode_mother_id, encode_copy_id, encode_mother_id
+from .book_index import read_service_indexes, service_index_stamp, tail_index_delta
+from .book_modify import book_pach_index
+from .book_ngram import NgramIndex, ngram_stamp
+
+ALL_CATEGORIES = "所有分类"
+ALL_STATUSES = "所有状态"
+
+# 母本级索引 (值为母本 ID)；状态索引的值是副本 ID，单独处理
+MOTHER_INDEX_KEYS = ("name", "zuozhe", "class")
+# 内存索引需要加载的索引 (紧凑格式，见 book_index.COMPACT_INDEX_KINDS)
+SERVICE_INDEX_KEYS = MOTHER_INDEX_KEYS + ("status",)
+
+# 每个字节值中为 1 的位，用于把位图快速展开成下标
+_BYTE_BITS = tuple(tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256))
+
+
+def _bitmap_from_positions(positions, size):
+    """由一组下标构造位图 (Python 大整数)，O(size)。"""
+    buf = bytearray((size + 7) // 8)
+    for pos in positions:
+        buf[pos >> 3] |= 1 << (pos & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def _bitmap_positions(bitmap):
+    """把位图展开成升序下标列表。"""
+    positions = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for i, byte in enumerate(data):
+        if byte:
+            base = i << 3
+            positions.extend(base + bit for bit in _BYTE_BITS[byte])
+    return positions
+
+
+def _popcount(bitmap):
+    return bin(bitmap).count("1")
+
+
+class IndexService:
+    """
+    常驻内存的索引。
+
+    初始化完成后加载一次，之后所有查询 (搜索、筛选、统计、填充下拉框) 都直接读内存，不再重复解析索引文件。
+    写入都记在索引差量日志里 (见 book_index)，每次查询前读取日志新追加的行，本进程和其他进程的修改都由此同步。
+
+    加载时读取书名/作者/类别/状态索引的紧凑格式 (编码后的 ID 数组，见 book_compact)，不解析 JSON。
+    母本编码按大小顺序 (即 ID 的自然顺序) 映射为连续整数 (稠密编号)，书名/作者/类别的每个键对应一个位图，
+    状态在加载时就投影到母本级 (某母本有几本该状态的副本)，
+    因此 "类别 ∩ 状态 ∩ 搜索词" 只是几次位图按位与，不再构造字符串集合或拆分副本 ID。
+    搜索词的片段匹配走 n-gram 索引 (book_ngram)，它不整体加载，只按需读取用到的倒排列表。
+    查询可能来自界面线程以外的线程，所有访问都经过同一把锁。
+    """
+
+    def __init__(self, indexes, entries=(), ngram=None):
+        """
+        :param indexes: {索引名: {键: 按升序排列的编码 ID 序列}}，见 book_index.read_service_indexes
+        :param entries: 还没并入索引文件的差量日志条目 [(removals, additions), ...]
+        """
+        self._lock = threading.RLock()
+        self._ngram = ngram
+        # 同步状态，由 load 设置：索引目录、差量日志读到的位置、加载时索引文件和 n-gram 文件的时间戳
+        self._index_pach = None
+        self._position = None
+        self._stamp = None
+        self._ngram_stamp = None
+
+        # 稠密编号 <-> 母本编码 / 母本 ID
+        values = set()
+        for key in MOTHER_INDEX_KEYS:
+            for ids in indexes[key].values():
+                values.update(ids)
+        self._values = sorted(values)
+        self._mother_ids = [decode_mother_id(value) for value in self._values]
+        self._dense = {value: i for i, value in enumerate(self._values)}
+        # 新增母本的 ID 总是大于已有 ID，追加编号后仍保持自然顺序；否则查询结果需要重新排序
+        self._ordered = True
+
+        size = len(self._values)
+        dense = self._dense
+        self._bitmaps = {
+            key: {value: _bitmap_from_positions((dense[item] for item in ids), size)
+                  for value, ids in indexes[key].items()}
+            for key in MOTHER_INDEX_KEYS
+        }
+        # 作者名有序键 (含可选的拼音键)，用于作者前缀查询
+        self._authors = AuthorPrefixIndex(self._bitmaps["zuozhe"])
+
+        # 状态 -> {母本编号: 该状态的副本数}，以及对应的母本位图和副本总数
+        self._status_mother_counts = {}
+        self._status_copy_counts = {}
+        self._status_bitmaps = {}
+        self._load_status(indexes["status"], entries)
+        for removals, additions in entries:
+            self._apply_mother_keys(removals, additions)
+
+    def _load_status(self, status_index, entries):
+        """
+        把副本级状态索引投影到母本级计数。
+
+        差量日志里出现过的副本先按日志重放出最终状态再计数，其余副本直接累加到所属母本。
+        日志中已经并入索引文件的部分 (并入后、清掉日志前崩溃) 重放后结果不变，不会重复计数。
+        """
+        touched = {}
+        for removals, additions in entries:
+            for key, _, item_id in removals + additions:
+                value = encode_copy_id(item_id) if key == "status" else None
+                if value is not None:
+                    touched[value] = set()
+
+        for status, values in status_index.items():
+            counts = {}
+            for value in values:
+                statuses = touched.get(value)
+                if statuses is not None:
+                    statuses.add(status)
+                    continue
+                dense = self._dense_id(copy_mother_value(value))
+                counts[dense] = counts.get(dense, 0) + 1
+            if counts:
+                self._status_mother_counts[status] = counts
+                self._status_copy_counts[status] = sum(counts.values())
+
+        # 个别副本的母本可能不在母本索引里，上面会为它追加编号，位图长度以最终编号数为准
+        size = len(self._values)
+        self._status_bitmaps = {status: _bitmap_from_positions(counts, size)
+                                for status, counts in self._status_mother_counts.items()}
+
+        for removals, additions in entries:
+            for key, status, item_id in removals:
+                statuses = touched.get(encode_copy_id(item_id)) if key == "status" else None
+                if statuses is not None:
+                    statuses.discard(status)
+            for key, status, item_id in additions:
+                statuses = touched.get(encode_copy_id(item_id)) if key == "status" else None
+                if statuses is not None:
+                    statuses.add(status)
+        for value, statuses in touched.items():
+            for status in statuses:
+                self._adjust_status(status, value, 1)
+
+    @classmethod
+    def load(cls, index_pach=None):
+        """从索引目录加载；索引文件缺失或损坏时得到空索引。"""
+        if index_pach is None:
+            index_pach = book_pach_index()
+        indexes, entries, position, stamp = read_service_indexes(index_pach)
+        if indexes is None:
+            print("警告: 索引文件缺失或损坏，内存索引为空。")
+            indexes = {key: {} for key in SERVICE_INDEX_KEYS}
+        # 时间戳取在加载之前：加载期间文件又被改写，下一次查询会再加载一次，不会漏掉
+        current_ngram_stamp = ngram_stamp(index_pach)
+        ngram = NgramIndex.load(index_pach)
+        if ngram is None:
+            print("警告: n-gram 索引不可用，搜索只匹配书名第一个字和作者全名。")
+        service = cls(indexes, entries, ngram)
+        service._index_pach = index_pach
+        service._position = position
+        service._stamp = stamp
+        service._ngram_stamp = current_ngram_stamp
+        return service
+
+    def _dense_id(self, value):
+        """母本编码的稠密编号，新母本追加在末尾。"""
+        dense = self._dense.get(value)
+        if dense is None:
+            dense = len(self._values)
+            if self._values and value < self._values[-1]:
+                self._ordered = False
+            self._values.append(value)
+            self._mother_ids.append(decode_mother_id(value))
+            self._dense[value] = dense
+        return dense
+
+    # ----------------------------------------------------
+    # 写入同步
+    # ----------------------------------------------------
+
+    def refresh(self):
+        """
+        跟上加载之后的修改，每次查询前调用。
+
+        书名/作者/类别/状态索引文件被改写过 (启动维护、差量日志并入) 时返回 False，由调用方整体重新加载；
+        否则叠加差量日志新追加的行，n-gram 文件有变化时重新加载 n-gram 索引。没有新修改时只做几次 stat。
+
+        :return: 内存索引是否已经是最新
+        """
+        if self._index_pach is None:
+            return True
+        with self._lock:
+            if service_index_stamp(self._index_pach) != self._stamp:
+                return False
+            entries, position = tail_index_delta(self._index_pach, self._position)
+            if entries is None:
+                return False
+            for removals, additions in entries:
+                self._apply_mother_keys(removals, additions)
+                self._apply_status(removals, additions)
+            self._position = position
+
+            stamp = ngram_stamp(self._index_pach)
+            if stamp != self._ngram_stamp:
+                self._ngram = NgramIndex.load(self._index_pach)
+                self._ngram_stamp = stamp
+        return True
+
+    def _apply_status(self, removals, additions):
+        """状态索引的增删，按所属母本调整计数。每条日志只能应用一次。"""
+        for key, status, item_id in removals:
+            value = encode_copy_id(item_id) if key == "status" else None
+            if value is not None:
+                self._adjust_status(status, value, -1)
+        for key, status, item_id in additions:
+            value = encode_copy_id(item_id) if key == "status" else None
+            if value is not None:
+                self._adjust_status(status, value, 1)
+
+    def _apply_mother_keys(self, removals, additions):
+        """书名/作者/类别索引的增删，只是置位和清位，重复应用结果不变。"""
+        for key, value, item_id in removals:
+            mother_value = encode_mother_id(item_id) if key in self._bitmaps else None
+            if mother_value is None:
+                continue
+            bitmaps = self._bitmaps[key]
+            remaining = bitmaps.get(value, 0) & ~(1 << self._dense_id(mother_value))
+            if remaining:
+                bitmaps[value] = remaining
+            elif value in bitmaps:
+                del bitmaps[value]
+                if key == "zuozhe":
+                    self._authors.remove(value)
+        for key, value, item_id in additions:
+            mother_value = encode_mother_id(item_id) if key in self._bitmaps else None
+            if mother_value is None:
+                continue
+            bitmaps = self._bitmaps[key]
+            if key == "zuozhe" and value not in bitmaps:
+                self._authors.add(value)
+            bitmaps[value] = bitmaps.get(value, 0) | (1 << self._dense_id(mother_value))
+
+    def _adjust_status(self, status, copy_value, delta):
+        dense = self._dense_id(copy_mother_value(copy_value))
+        counts = self._status_mother_counts.setdefault(status, {})
+        count = counts.get(dense, 0) + delta
+        bit = 1 << dense
+        if count > 0:
+            counts[dense] = count
+            self._status_bitmaps[status] = self._status_bitmaps.get(status, 0) | bit
+        else:
+            counts.pop(dense, None)
+            self._status_bitmaps[status] = self._status_bitmaps.get(status, 0) & ~bit
+
+        copy_count = self._status_copy_counts.get(status, 0) + delta
+        if copy_count > 0:
+            self._status_copy_counts[status] = copy_count
+        else:
+            self._status_copy_counts.pop(status, None)
+            self._status_mother_counts.pop(status, None)
+            self._status_bitmaps.pop(status, None)
+
+    # ----------------------------------------------------
+    # 查询
+    # ----------------------------------------------------
+
+    def _to_ids(self, bitmap):
+        positions = _bitmap_positions(bitmap)
+        if not self._ordered:
+            positions.sort(key=self._values.__getitem__)
+        return [self._mother_ids[pos] for pos in positions]
+
+    def _term_bitmap(self, term):
+        """
+        搜索词命中的母本位图：书名第一个字、作者名或拼音以该词开头，以及书名/作者中包含该片段的母本。
+        """
+        bitmap = self._bitmaps["name"].get(term, 0)
+        author_bitmaps = self._bitmaps["zuozhe"]
+        for author in self._authors.match(term):
+            bitmap |= author_bitmaps[author]
+        if self._ngram is not None:
+            positions = [self._dense_id(value) for value in self._ngram.search(term)]
+            bitmap |= _bitmap_from_positions(positions, len(self._values))
+        return bitmap
+
+    def search(self, term="", category=ALL_CATEGORIES, status=ALL_STATUSES):
+        """
+        搜索词 (书名或作者中的任意片段、作者拼音前缀) + 类别 + 副本状态的组合查询。
+
+        :return: 按 ID 自然顺序排列的母本 ID 列表
+        """
+        with self._lock:
+            class_bitmaps = self._bitmaps["class"]
+            if category != ALL_CATEGORIES:
+                result = class_bitmaps.get(category, 0)
+            else:
+                result = 0
+                for bitmap in class_bitmaps.values():
+                    result |= bitmap
+
+            if term:
+                result &= self._term_bitmap(term)
+
+            if status != ALL_STATUSES:
+                result &= self._status_bitmaps.get(status, 0)
+
+            return self._to_ids(result)
+
+    def categories(self):
+        with self._lock:
+            return sorted(self._bitmaps["class"].keys())
+
+    def statuses(self):
+        with self._lock:
+            return sorted(self._status_copy_counts.keys())
+
+    def stats(self):
+        """图书馆统计数据，格式与 book_root._get_library_stats 一致。"""
+        with self._lock:
+            category_counts = {category: _popcount(bitmap) for category, bitmap in self._bitmaps["class"].items()}
+            status_counts = dict(self._status_copy_counts)
+        return {
+            # 每本书只属于一个类别，各类别数量之和即总图书数
+            "total_mother_books": sum(category_counts.values()),
+            "total_copies": sum(status_counts.values()),
+            "category_counts": category_counts,
+            "status_counts": status_counts,
+        }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def load_index_service(index_pach=None):
+    """(重新) 加载进程内共享的内存索引。"""
+    global _service
+    warn_if_pinyin_missing()
+    with _service_lock:
+        _service = IndexService.load(index_pach)
+        return _service
+
+
+def get_index_service():
+    """
+    返回共享的内存索引，并先跟上其他进程和本进程的修改 (见 IndexService.refresh)。
+    尚未加载，或者索引文件已被改写时重新加载。
+    """
+    global _service
+    service = _service
+    if service is not None and service.refresh():
+        return service
+    with _service_lock:
+        if _service is not service:
+            # 等锁期间其他线程已经重新加载过
+            return _service
+        _service = IndexService.load(service._index_pach if service is not None else None)
+        return _service
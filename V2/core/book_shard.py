@@ -0,0 +1,189 @@
+import json
+import os
+import struct
+
+from .book_compact import encode_mother_id
+from .book_io import atomic_write
+from .book_modify import book_pach_index
+
+# 母本分片的记录级随机访问。
+#
+# 分片仍然是合法的 JSON 对象，但写入时每条记录占一行 ("ID": {...})，整体解析照常可用；
+# 另在索引目录的 offsets/ 下为每个母本分片保存一张偏移表 (book-N.off)：
+#   头部: MAGIC | 分片 mtime_ns | 分片大小
+#   之后 TABLE_SLOTS 个槽位 (起始字节, 字节数)，第 XXX 号槽位对应母本 'C-N-XXX'，字节数为 0 表示没有该记录。
+# 读取一条记录只需读偏移表中的一个槽位，再 seek 到分片中对应位置解码这一条记录。
+# 偏移表记录了分片的时间戳，分片被外部改写后偏移表自动作废，调用方退回整体解析。
+OFFSETS_DIR = "offsets"
+TABLE_SLOTS = 1000
+_MAGIC = b"BKOFF\x00\x01\x00"
+_HEADER = struct.Struct('<8sqq')
+_ENTRY = struct.Struct('<II')
+_WHITESPACE = b" \t\r\n"
+
+
+def _trim_end(raw, end):
+    """从 end 往前跳过空白和一个逗号，得到上一条记录值的结束位置。"""
+    while end > 0 and raw[end - 1] in _WHITESPACE:
+        end -= 1
+    if end > 0 and raw[end - 1] == ord(','):
+        end -= 1
+    while end > 0 and raw[end - 1] in _WHITESPACE:
+        end -= 1
+    return end
+
+
+def record_spans(raw, keys):
+    """
+    分片中每条记录 ('"ID": 值') 在原始字节中的区间，适用于任何缩进格式。
+
+    :param raw: 分片文件原始字节
+    :param keys: 分片中的 ID，顺序与文件中一致
+    :return: [(起始字节, 结束字节), ...]；无法定位时返回 None
+    """
+    starts = []
+    pos = 0
+    for key in keys:
+        token = json.dumps(key, ensure_ascii=False).encode('utf-8') + b':'
+        start = raw.find(token, pos)
+        if start < 0:
+            return None
+        starts.append(start)
+        pos = start + len(token)
+    if not starts:
+        return []
+    ends = [_trim_end(raw, start) for start in starts[1:]] + [_trim_end(raw, raw.rfind(b'}'))]
+    return list(zip(starts, ends))
+
+
+def _record_bytes(book_id, record):
+    return (json.dumps(book_id, ensure_ascii=False) + ": " + json.dumps(record, ensure_ascii=False)).encode('utf-8')
+
+
+def dump_shard(data):
+    """
+    按每条记录一行的格式序列化分片。
+
+    :return: (文件内容, {ID: (起始字节, 字节数)})
+    """
+    parts = [b"{\n"]
+    spans = {}
+    pos = 2
+    last = len(data) - 1
+    for i, (book_id, record) in enumerate(data.items()):
+        line = _record_bytes(book_id, record)
+        separator = b",\n" if i < last else b"\n"
+        spans[book_id] = (pos, len(line))
+        parts.append(line)
+        parts.append(separator)
+        pos += len(line) + len(separator)
+    parts.append(b"}\n")
+    return b"".join(parts), spans
+
+
+def offsets_path(shard_path, index_pach=None):
+    """db/data/book-3.json -> index/offsets/book-3.off"""
+    if index_pach is None:
+        index_pach = book_pach_index()
+    name = os.path.splitext(os.path.basename(shard_path))[0]
+    return os.path.join(index_pach, OFFSETS_DIR, name + ".off")
+
+
+def _slot(book_id):
+    """母本 ID 对应的槽位号 (ID 的第三段)；不是规范母本 ID 时返回 None。"""
+    if encode_mother_id(book_id) is None:
+        return None
+    return int(book_id.rsplit('-', 1)[1])
+
+
+def write_offset_table(shard_path, spans, stamp=None, index_pach=None):
+    """
+    写入分片的偏移表。存在无法放入槽位的 ID 时不写入 (并删除旧表)，该分片只能整体解析。
+
+    :param spans: {ID: (起始字节, 字节数)}
+    :param stamp: 分片的 (mtime_ns, 大小)，默认取当前文件状态
+    """
+    entries = [(0, 0)] * TABLE_SLOTS
+    for book_id, span in spans.items():
+        slot = _slot(book_id)
+        if slot is None or entries[slot] != (0, 0):
+            path = offsets_path(shard_path, index_pach)
+            if os.path.exists(path):
+                os.remove(path)
+            return False
+        entries[slot] = span
+    _write_table(shard_path, entries, stamp, index_pach)
+    return True
+
+
+def _write_table(shard_path, entries, stamp=None, index_pach=None):
+    if stamp is None:
+        st = os.stat(shard_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+    path = offsets_path(shard_path, index_pach)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, _HEADER.pack(_MAGIC, *stamp) + b"".join(_ENTRY.pack(*entry) for entry in entries))
+
+
+def index_shard_offsets(shard_path, raw, records, stamp, index_pach=None):
+    """由已经读入的分片内容生成偏移表 (建索引时调用，不限于每行一条记录的格式)。"""
+    spans = record_spans(raw, list(records))
+    if spans is None:
+        return False
+    return write_offset_table(shard_path, {book_id: (start, end - start)
+                                           for book_id, (start, end) in zip(records, spans)}, stamp, index_pach)
+
+
+def _load_table(shard_path, index_pach=None):
+    """读取偏移表，缺失、损坏或与分片当前状态不一致时返回 None。"""
+    try:
+        with open(offsets_path(shard_path, index_pach), 'rb') as f:
+            header = f.read(_HEADER.size)
+            body = f.read(_ENTRY.size * TABLE_SLOTS)
+        st = os.stat(shard_path)
+    except OSError:
+        return None
+    if len(header) != _HEADER.size or len(body) != _ENTRY.size * TABLE_SLOTS:
+        return None
+    magic, mtime, size = _HEADER.unpack(header)
+    if magic != _MAGIC or mtime != st.st_mtime_ns or size != st.st_size:
+        return None
+    return list(_ENTRY.iter_unpack(body))
+
+
+def read_records(shard_path, book_ids, index_pach=None):
+    """
+    按偏移表逐条读取记录，只解码需要的记录。
+
+    :return: {ID: 记录 (不存在为 None)}；偏移表不可用时返回 None，调用方应整体解析分片
+    """
+    entries = _load_table(shard_path, index_pach)
+    if entries is None:
+        return None
+
+    result = {}
+    with open(shard_path, 'rb') as f:
+        for book_id in book_ids:
+            slot = _slot(book_id)
+            if slot is None:
+                return None
+            start, length = entries[slot]
+            if not length:
+                result[book_id] = None
+                continue
+            f.seek(start)
+            try:
+                record = json.loads(b"{" + f.read(length) + b"}")
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                return None
+            if list(record) != [book_id]:
+                return None
+            result[book_id] = record[book_id]
+    return result
+
+
+def write_shard(shard_path, data, index_pach=None):
+    """按每条记录一行的格式写入整个分片，并写入对应的偏移表。"""
+    content, spans = dump_shard(data)
+    atomic_write(shard_path, content, checksum=True)
+    write_offset_table(shard_path, spans, index_pach=index_pach)
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+
+from .book_cache import invalidate_shard
+from .book_io import atomic_write, atomic_write_json, file_stamp
+from .book_lock import file_lock, try_file_lock
+from .book_modify import book_pach_db_data, book_pach_db_data_b, book_pach_wal
+from .book_shard import write_shard
+
+# 字段修改的预写日志 (db/wal.jsonl)。
+#
+# 修改母本/副本的单个字段时，不再重写整个分片，而是向日志追加一行并 fsync：
+#   {"section": "data" 或 "data-b", "file": 分片文件名, "id": 记录 ID, "key": 字段, "val": 新值}
+# 读取记录时把日志中尚未合并的修改叠加到分片内容上；日志条数超过阈值或程序启动时，
+# 把修改合并回分片 (每个分片只重写一次) 并清空日志。
+# 合并是幂等的：合并中途崩溃，日志仍然完整，下次重新合并即可。
+#
+# 多进程共用一份日志时 (见 book_lock)：读取加共享锁，追加加排他锁；
+# 同一时刻只有一个进程做合并 (合并锁拿不到就跳过)，合并时逐个分片加排他锁，不在持有日志锁时等分片锁。
+WAL_COMPACT_THRESHOLD = 2000
+
+
+class WriteAheadLog:
+    """
+    预写日志及其内存视图：{记录 ID: {字段: 新值}}。
+
+    每次读取先 stat 日志文件，大小或 mtime 变化 (其他进程追加了修改) 时重新加载。
+    """
+
+    def __init__(self, path_func=book_pach_wal):
+        self._path_func = path_func
+        self._lock = threading.RLock()
+        self._path = None
+        self._stamp = None
+        self._edits = {}  # 记录 ID -> {字段: 新值}
+        self._files = {}  # 记录 ID -> (section, 分片文件名)
+        self._count = 0
+
+    def _refresh(self, repair=False):
+        # 调用方持有 self._lock 和日志文件锁；repair=True 时 (持有排他锁) 截掉没写完的最后一行
+        path = self._path_func()
+        try:
+            st = os.stat(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if path == self._path and stamp == self._stamp:
+            return path
+
+        self._edits, self._files, self._count = {}, {}, 0
+        if stamp is not None:
+            with open(path, 'rb') as f:
+                raw = f.read()
+            valid = raw.rfind(b"\n") + 1
+            if valid < len(raw) and repair:
+                # 最后一行没有写完 (追加时崩溃)，截掉，否则下一次追加会和它粘成一行
+                with open(path, 'r+b') as f:
+                    f.truncate(valid)
+                    os.fsync(f.fileno())
+                st = os.stat(path)
+                stamp = (st.st_mtime_ns, st.st_size)
+            for line in raw[:valid].splitlines():
+                try:
+                    entry = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    print(f"⚠️ 警告: 预写日志中有无法解析的一行，已忽略: {line[:80]!r}")
+                    continue
+                self._remember(entry)
+        self._path, self._stamp = path, stamp
+        return path
+
+    def _remember(self, entry):
+        self._edits.setdefault(entry["id"], {})[entry["key"]] = entry["val"]
+        self._files[entry["id"]] = (entry["section"], entry["file"])
+        self._count += 1
+
+    def append(self, section, file_path, record_id, key, val):
+        """
+        追加一条字段修改，fsync 之后返回，返回时修改已经持久化。
+
+        :param section: "data" (母本) 或 "data-b" (副本)
+        :param file_path: 记录所在的分片路径
+        """
+        entry = {"section": section, "file": os.path.basename(file_path), "id": record_id, "key": key, "val": val}
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8')
+        path = self._path_func()
+        with self._lock, file_lock(path, exclusive=True):
+            self._refresh(repair=True)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                st = os.fstat(f.fileno())
+            self._remember(entry)
+            self._stamp = (st.st_mtime_ns, st.st_size)
+
+    def overlay(self, record_id, record):
+        """把日志中该记录尚未合并的修改叠加到 record 上；没有修改时原样返回 record。"""
+        if record is None:
+            return None
+        with self._lock, file_lock(self._path_func()):
+            self._refresh()
+            fields = self._edits.get(record_id)
+            if not fields:
+                return record
+            merged = dict(record)
+            merged.update(fields)
+            return merged
+
+    def pending(self):
+        """日志中尚未合并的修改条数。"""
+        with self._lock, file_lock(self._path_func()):
+            self._refresh()
+            return self._count
+
+    def compact(self):
+        """
+        把日志中的修改合并回分片，每个受影响的分片只读写一次，之后清空已合并的日志。
+
+        :return: [("data" 或 "data-b", 分片路径, 重写前的 (mtime_ns, size)), ...] 被重写的分片
+        """
+        path = self._path_func()
+        with try_file_lock(path + ".compact") as acquired:
+            if not acquired:
+                # 其他进程正在合并
+                return []
+
+            # 1. 取一份日志快照，之后释放日志锁，追加不受合并影响
+            with self._lock, file_lock(path):
+                self._refresh()
+                if not self._count:
+                    return []
+                consumed = self._stamp[1]
+                # (section, 文件名) -> {记录 ID: {字段: 新值}}
+                by_shard = {}
+                for record_id, fields in self._edits.items():
+                    by_shard.setdefault(self._files[record_id], {})[record_id] = dict(fields)
+
+            # 2. 逐个分片加排他锁合并；快照之后追加的修改留在日志里，之后继续叠加，结果仍以最新的为准
+            touched = []
+            for (section, filename), edits in by_shard.items():
+                base_dir = book_pach_db_data() if section == "data" else book_pach_db_data_b()
+                file_path = os.path.join(base_dir, filename)
+                with file_lock(file_path, exclusive=True):
+                    before = file_stamp(file_path)
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    for record_id, fields in edits.items():
+                        if record_id in data:
+                            data[record_id].update(fields)
+                        else:
+                            print(f"⚠️ 警告: 分片 {filename} 中找不到记录 {record_id}，日志中的修改已丢弃。")
+                    if section == "data":
+                        write_shard(file_path, data)
+                    else:
+                        atomic_write_json(file_path, data, checksum=True, indent=2)
+                invalidate_shard(file_path)
+                touched.append((section, file_path, before))
+
+            # 3. 只清掉已经合并的部分：合并期间 (本进程或其他进程) 追加的修改保留在日志中
+            with self._lock, file_lock(path, exclusive=True):
+                with open(path, 'rb') as f:
+                    f.seek(consumed)
+                    tail = f.read()
+                atomic_write(path, tail)
+                self._stamp = None
+                self._refresh()
+            return touched
+
+
+_wal = WriteAheadLog()
+
+
+def append_edit(section, file_path, record_id, key, val):
+    """向预写日志追加一条字段修改 (已 fsync)。"""
+    _wal.append(section, file_path, record_id, key, val)
+
+
+def overlay_record(record_id, record):
+    """返回叠加了未合并修改的记录 (没有修改时就是 record 本身)。"""
+    return _wal.overlay(record_id, record)
+
+
+def wal_pending():
+    return _wal.pending()
+
+
+def compact_wal():
+    """把预写日志合并回分片，返回被重写的分片 [(section, 分片路径, 重写前的时间戳), ...]。"""
+    return _wal.compact()
@@ -1,18 +1,23 @@
-import os
+import multiprocessing
 import sys
+from collections import OrderedDict
 
 from PySide6.QtWidgets import (
     QApplication, QWidget, QLabel, QVBoxLayout, QPushButton,
     QComboBox, QTabWidget, QHBoxLayout, QLineEdit, QSpacerItem, QSizePolicy,
-    QTableWidget, QTableWidgetItem, QDialog, QMessageBox, QHeaderView, QProgressBar, QToolTip
+    QTableWidget, QTableWidgetItem, QTableView, QDialog, QMessageBox, QHeaderView, QProgressBar, QToolTip
 )
-from PySide6.QtCore import QByteArray, QBuffer, QSize, Qt, QTimer, QObject, Signal, QThread, QRect
-from PySide6.QtGui import QMovie, QIntValidator, QCursor
+from PySide6.QtCore import QByteArray, QBuffer, QSize, Qt, QTimer, QObject, Signal, QThread, QThreadPool, QRect, \
+    QAbstractTableModel, QModelIndex
+from PySide6.QtGui import QMovie, QIntValidator, QCursor, QBrush
 # 你的核心模块导入
+import core.book_async
 import core.book_baidu
 import core.book_index
+import core.book_io
 import core.book_jiajia
 import core.book_modify
+import core.book_service
 
 
 # ----------------------------------------------------
@@ -25,9 +30,6 @@ class BookDetailDialog(QDialog):
         self.mother_id = mother_id
         # 防止 parent 没有 db 属性报错
         self.db = parent.db if hasattr(parent, 'db') else None
-        self.page_size = 20  # 副本表默认每页显示条数
-        self.current_page = 1
-        self.total_copy_pages = 1
         self.all_copies = []  # 存储所有副本数据
         self.current_mother_keys = []  # 存储当前显示的图书原始键名列表，用于修改时查找
 
@@ -58,71 +60,39 @@ class BookDetailDialog(QDialog):
         self.mother_table.setEditTriggers(QTableWidget.DoubleClicked)
         main_layout.addWidget(self.mother_table)
 
-        # 2. 🌟 副本信息表格
+        # 2. 🌟 副本信息表格 (模型/视图，修改后由模型调用 save_copy_field 保存)
         main_layout.addWidget(QLabel("📖 副本列表 (双击修改)："))
-        self.copy_table = QTableWidget()
+        header_labels = [self.copy_key_translation[key] for key in self.current_copy_keys]
+        self.copy_model = CopyTableModel(self.current_copy_keys, header_labels, self.save_copy_field, self)
+        self.copy_table = QTableView()
+        self.copy_table.setModel(self.copy_model)
         self.copy_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.copy_table.setEditTriggers(QTableWidget.DoubleClicked)
+        self.copy_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.copy_table.setEditTriggers(QTableView.DoubleClicked)
+        # ⭐️ 隐藏第 0 列 (即 副本ID 列)
+        self.copy_table.setColumnHidden(0, True)
         main_layout.addWidget(self.copy_table)
 
-        # 3. 分页控件
-        self.setup_pagination_controls(main_layout)
+        # 3. 副本数量
+        self.copy_count_label = QLabel("共 0 个副本")
+        main_layout.addWidget(self.copy_count_label)
 
         # 4. 绑定事件
         self.mother_table.itemChanged.connect(self.on_mother_item_changed)
-        self.copy_table.itemChanged.connect(self.on_copy_item_changed)
-
-        # 5. 加载数据
-        self.load_and_display_data()
-
-    def setup_pagination_controls(self, layout):
-        """设置详情窗口的分页控件布局"""
-        self.pagination_layout = QHBoxLayout()
-
-        self.prev_page_button = QPushButton("◀ 上一副本页")
-        self.prev_page_button.clicked.connect(self.on_page_prev)
-        self.pagination_layout.addWidget(self.prev_page_button)
-
-        self.page_info_label = QLabel("副本页码: 1 / 1")
-        self.pagination_layout.addWidget(self.page_info_label)
-
-        self.next_page_button = QPushButton("下一副本页 ▶")
-        self.next_page_button.clicked.connect(self.on_page_next)
-        self.pagination_layout.addWidget(self.next_page_button)
-
-        self.pagination_layout.addItem(QSpacerItem(20, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
-
-        self.page_size_label = QLabel("每页副本:")
-        self.pagination_layout.addWidget(self.page_size_label)
-
-        self.page_size_input = QLineEdit(str(self.page_size))
-        self.page_size_input.setValidator(QIntValidator(1, 999, self))
-        self.page_size_input.setFixedWidth(50)
-        self.page_size_input.editingFinished.connect(self._on_page_size_changed)
-        self.pagination_layout.addWidget(self.page_size_input)
 
-        self.pagination_layout.addWidget(QLabel("条"))
+        # 5. 在后台读取数据，读完再填表 (读分片不占用界面线程)
+        self.detail_signals = DetailSignals(self)
+        self.detail_signals.loaded.connect(self.on_data_loaded)
+        self.copy_count_label.setText("正在加载...")
+        QThreadPool.globalInstance().start(DetailWorker(self.detail_signals, mother_id).run)
 
-        layout.addLayout(self.pagination_layout)
-
-    def load_and_display_data(self):
-        """加载图书和副本数据，并分别显示。"""
-        try:
-            # 1. 获取图书信息 (用于填充图书表格)
-            mother_info = core.book_baidu.get_book_record_by_id(self.mother_id)
-        except Exception as e:
-            QMessageBox.critical(self, "数据加载错误", f"无法加载图书信息: {e}")
+    def on_data_loaded(self, mother_info, raw_copies):
+        """后台读取完成 (DetailWorker)：标准化副本数据，并分别显示图书和副本。"""
+        if isinstance(mother_info, Exception):
+            QMessageBox.critical(self, "数据加载错误", f"无法加载图书信息: {mother_info}")
             mother_info = None
-
-        # 2. ⭐️ 关键修改：获取副本数据 (使用 get_all_copies_by_mother_id_optimized)
-        try:
-            raw_copies = core.book_baidu.get_all_copies_by_mother_id_optimized(self.mother_id)
-
-        except AttributeError:
-            print("警告: 缺少 core.book_baidu.get_all_copies_by_mother_id_optimized 方法。")
-            raw_copies = []
-        except Exception as e:
-            print(f"获取副本数据时发生错误: {e}")
+        if isinstance(raw_copies, Exception):
+            print(f"获取副本数据时发生错误: {raw_copies}")
             raw_copies = []
 
         # 3. 副本数据标准化
@@ -184,6 +154,8 @@ class BookDetailDialog(QDialog):
         EDITABLE_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
 
         # ⭐️ 3. 填充数据 (只填充第 0 行)
+        # 填表时屏蔽 itemChanged，否则每个单元格都会被当成用户修改而自动保存一次
+        table.blockSignals(True)
         for col, key in enumerate(self.current_mother_keys):
             value = str(mother_info.get(key, ''))
             val_item = QTableWidgetItem(value)
@@ -197,82 +169,15 @@ class BookDetailDialog(QDialog):
 
             # 设置到第 0 行
             table.setItem(0, col, val_item)
+        table.blockSignals(False)
 
     def display_copy_info(self):
         """
-        填充并设置副本信息表格 (self.copy_table)，使用自定义中文表头。
+        把副本数据交给副本表格的模型 (self.copy_model)，表头为自定义中文表头。
+        视图只为可见的行取数据，副本再多也不需要分页。
         """
-        table = self.copy_table
-
-        # 1. 更新分页状态
-        self.update_pagination_controls(len(self.all_copies))
-
-        # 2. 计算当前页数据
-        start_index = (self.current_page - 1) * self.page_size
-        end_index = start_index + self.page_size
-        page_copies = self.all_copies[start_index:end_index]
-
-        # 1. 设置列头和行数 (关键!)
-        header_labels = [self.copy_key_translation[key] for key in self.current_copy_keys]
-        table.setColumnCount(len(self.current_copy_keys))
-        table.setHorizontalHeaderLabels(header_labels)
-        table.setRowCount(len(page_copies))  # ⭐️ 确保行数正确设置
-
-        # ⭐️ 新增：隐藏第 0 列 (即 副本ID 列)
-        table.setColumnHidden(0, True)
-
-        # 标志定义
-        NON_EDITABLE_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled
-        EDITABLE_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
-
-        # 4. 填充数据
-        for row, copy_info in enumerate(page_copies):
-            for col, key in enumerate(self.current_copy_keys):
-                value = str(copy_info.get(key, ''))
-                item = QTableWidgetItem(value)
-
-                # 副本 ID ('copy_id') 不可修改
-                if key == 'copy_id':
-                    item.setFlags(NON_EDITABLE_FLAGS)
-                    item.setBackground(Qt.lightGray)
-                else:
-                    item.setFlags(EDITABLE_FLAGS)
-
-                table.setItem(row, col, item)
-        table.viewport().update()
-
-    def update_pagination_controls(self, total_results):
-        """更新副本分页控件"""
-        self.total_copy_pages = (total_results + self.page_size - 1) // self.page_size
-
-        if self.total_copy_pages == 0: self.total_copy_pages = 1
-        if self.current_page > self.total_copy_pages: self.current_page = self.total_copy_pages
-
-        self.page_info_label.setText(f"副本页码: {self.current_page} / {self.total_copy_pages}")
-        self.prev_page_button.setEnabled(self.current_page > 1)
-        self.next_page_button.setEnabled(self.current_page < self.total_copy_pages)
-
-    def on_page_prev(self):
-        if self.current_page > 1:
-            self.current_page -= 1
-            self.display_copy_info()
-
-    def on_page_next(self):
-        if self.current_page < self.total_copy_pages:
-            self.current_page += 1
-            self.display_copy_info()
-
-    def _on_page_size_changed(self):
-        try:
-            new_size = int(self.page_size_input.text().strip())
-            if 1 <= new_size <= 999:
-                self.page_size = new_size
-                self.current_page = 1
-                self.display_copy_info()
-            else:
-                self.page_size_input.setText(str(self.page_size))
-        except ValueError:
-            self.page_size_input.setText(str(self.page_size))
+        self.copy_model.set_copies(self.all_copies)
+        self.copy_count_label.setText(f"共 {len(self.all_copies)} 个副本")
 
     def on_mother_item_changed(self, item):
         """图书表格修改事件"""
@@ -302,60 +207,49 @@ class BookDetailDialog(QDialog):
                 except Exception as e:
                     QMessageBox.critical(self, "错误", f"保存图书数据时发生异常: {e}")
 
-    def on_copy_item_changed(self, item):
+    def save_copy_field(self, copy_id, db_key, val):
         """
-        副本表格修改事件。直接从表格的第 0 列获取隐藏的 copy_id，并使用数据库键名进行保存。
-        """
-        row = item.row()
-        col = item.column()
-        val = item.text()
-
-        # 1. ⭐️ 核心修正：直接从表格的第 0 列获取完整的副本 ID
-        copy_id_item = self.copy_table.item(row, 0)
-        if copy_id_item is None:
-            print("🛑 错误: 无法从表格第0列获取副本ID项。保存失败。")
-            return
+        副本表格修改后由 CopyTableModel 调用，使用数据库键名和完整的 copy_id 保存。
 
-        copy_id = copy_id_item.text()  # 提取完整的副本 ID
-
-        # 2. 从 self.current_copy_keys 获取 UI/DB 键名
-        if col < len(self.current_copy_keys):
-            db_key = self.current_copy_keys[col]  # 这里的键名已经是 DB 键名 (e.g., 'borrower_name')
-        else:
-            return
-
-        # 3. 避免表格加载数据时触发保存
-        # 注意：我们必须从 self.all_copies 获取数据来进行值校验和同步
-        start_index = (self.current_page - 1) * self.page_size
-        global_index = start_index + row
-        current_data = self.all_copies[global_index]
-
-        # 检查值是否改变
-        if str(current_data.get(db_key, '')) == val:
-            return
-
-        # 4. 如果尝试修改 ID 自身，则阻止
+        :return: 保存成功返回 True (模型随后更新本地数据)，否则返回 False (表格保持原值)
+        """
+        # 如果尝试修改 ID 自身，则阻止 (模型已将该列设为不可编辑，这里再防一次)
         if db_key == 'copy_id':
             QMessageBox.warning(self, "禁止操作", "副本ID无法直接修改。")
-            return
+            return False
 
-        # 5. 执行保存操作
         print(f"✅ 自动保存副本: ID={copy_id}, DB_Key={db_key}, NewValue={val}")
 
         try:
             # 实际调用：更新副本字段 (使用 DB 键名和完整的 copy_id)
             success = core.book_jiajia.update_copy_field(copy_id, db_key, val)
-
-            if success:
-                # ⭐️ 数据同步：更新本地列表中的副本数据
-                current_data[db_key] = val
-            else:
+            if not success:
                 QMessageBox.warning(self, "保存失败", f"副本 {copy_id} 字段 {db_key} 保存到数据库失败。")
-                # 失败时可以考虑恢复表格原始值
-                # item.setText(str(current_data.get(db_key, '')))
+            return success
 
         except Exception as e:
             QMessageBox.critical(self, "错误", f"保存副本数据时发生异常: {e}")
+            return False
+
+
+# ----------------------------------------------------
+# ⭐️ 详情读取工作线程类 (DetailWorker) ⭐️
+# ----------------------------------------------------
+class DetailSignals(QObject):
+    loaded = Signal(object, object)  # 图书信息, 副本列表 (读取失败时为异常对象)
+
+
+class DetailWorker:
+    """在线程池中读取详情窗口需要的图书信息和全部副本 (两者并发读取，见 core.book_async)，读完发出 loaded。"""
+
+    def __init__(self, signals, mother_id):
+        self.signals = signals
+        self.mother_id = mother_id
+
+    def run(self):
+        mother_info, raw_copies = core.book_async.run_coroutine(
+            core.book_async.get_book_detail_async(self.mother_id))
+        self.signals.loaded.emit(mother_info, raw_copies)
 
 
 # ----------------------------------------------------
@@ -368,14 +262,18 @@ class book_root(QWidget):
         # 核心变量
         # ⭐️ 关键修改：改为存储所有符合搜索/过滤条件的 Mother ID 列表
         self.all_matched_ids = []
-        self.page_size = 10
-        self.current_page = 1
-        self.total_pages = 1
-        # ⭐️ 新增：缓存相关变量
-        self.cache_page_window = 10  # 缓存窗口大小 (10 页)
-        # 存储缓存的数据：{page_number: [book_info_1, book_info_2, ...]}
-        self.page_cache = {}
-        self.cache_start_page = 1  # 当前缓存窗口的起始页码
+        # ⭐️ 查询在线程池中执行 (QueryWorker)，主线程只负责显示。
+        # 每发起一次新搜索代号加一，过期查询的结果直接丢弃
+        self.query_generation = 0
+        self.query_pool = QThreadPool(self)
+        self.query_pool.setMaxThreadCount(2)
+        self.query_signals = QuerySignals(self)
+        self.query_signals.matched.connect(self._on_query_matched)
+        self.query_signals.error.connect(self._on_query_error)
+        # 搜索结果表格的模型：按需在后台加载可见行的记录 (不再手动分页)
+        self.result_model = BookResultModel(self.query_pool, lambda: self.query_generation, self)
+        # 搜索任务顺带加载的第一块记录直接交给模型
+        self.query_signals.page_loaded.connect(self.result_model.on_block_loaded)
 
         self.setWindowTitle("图书管理系统")
         self.setGeometry(100, 100, 600, 400)
@@ -498,54 +396,48 @@ class book_root(QWidget):
         self.status_filter.addItem("下架")
         self.filter_layout.addWidget(self.status_filter)
 
-        self.populate_filters_from_index()
+        # 下拉框中的类别在初始化完成、内存索引加载后由 _on_init_complete 填充
         self.category_filter.currentIndexChanged.connect(self.on_filter_changed)
         self.status_filter.currentIndexChanged.connect(self.on_filter_changed)
 
         self.input_filter = QLineEdit()
-        self.input_filter.setPlaceholderText("请输入搜索内容（书名第一个字/作者）")
+        self.input_filter.setPlaceholderText("请输入搜索内容（书名/作者中的文字，或作者拼音）")
         self.filter_layout.addWidget(self.input_filter)
 
+        # 边输入边搜索：停止输入 300ms 后再查询，避免每个按键都触发一次
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(300)
+        self.search_timer.timeout.connect(self.on_search)
+        self.input_filter.textChanged.connect(self.search_timer.start)
+        self.input_filter.returnPressed.connect(self.on_search)
+
         self.search_button = QPushButton("搜索")
         self.search_button.clicked.connect(self.on_search)
         self.filter_layout.addWidget(self.search_button)
         self.search_book_layout.addLayout(self.filter_layout)
 
-        # 3.2 搜索结果表格
-        self.result_table = QTableWidget()
-        self.result_table.setColumnCount(6)  # ID, 书名, 作者, 出版社, 分类, 副本数
-        self.result_table.setHorizontalHeaderLabels(['ID', '书名', '作者', '出版社', '分类', '副本数'])
+        # 3.2 搜索结果表格 (模型/视图：只为可见的行读取记录，滚动到底时自动增加行)
+        self.result_table = QTableView()
+        self.result_table.setModel(self.result_model)
         # 设置列宽模式为 Stretch (固定比例，不随内容变)
         self.result_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        # 行高固定，视图不必逐行计算高度
+        self.result_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.result_table.setEditTriggers(QTableView.NoEditTriggers)
+        self.result_table.setSelectionBehavior(QTableView.SelectRows)
         # 连接双击事件
-        self.result_table.cellDoubleClicked.connect(self.on_result_double_clicked)
+        self.result_table.doubleClicked.connect(self.on_result_double_clicked)
         self.search_book_layout.addWidget(self.result_table)
 
-        # 3.3 分页控制
-        self.pagination_layout = QHBoxLayout()
-        self.prev_page_button = QPushButton("◀ 上一页")
-        self.prev_page_button.clicked.connect(self.on_prev_page)
-        self.pagination_layout.addWidget(self.prev_page_button)
+        # 3.3 结果统计
+        self.result_info_layout = QHBoxLayout()
+        self.result_count_label = QLabel("共 0 条结果")
+        self.result_info_layout.addWidget(self.result_count_label)
+        self.result_info_layout.addItem(QSpacerItem(20, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
+        self.result_info_layout.addWidget(QLabel("双击文件进入详情"))
 
-        self.page_info_label = QLabel("第 1 / 1 页")
-        self.pagination_layout.addWidget(self.page_info_label)
-
-        self.next_page_button = QPushButton("下一页 ▶")
-        self.next_page_button.clicked.connect(self.on_next_page)
-        self.pagination_layout.addWidget(self.next_page_button)
-
-        self.pagination_layout.addItem(QSpacerItem(20, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
-
-        self.page_size_label = QLabel("双击文件进入详情     每页显示:")
-        self.pagination_layout.addWidget(self.page_size_label)
-        self.page_size_input = QLineEdit(str(self.page_size))
-        self.page_size_input.setValidator(QIntValidator(1, 999, self))
-        self.page_size_input.setFixedWidth(50)
-        self.page_size_input.editingFinished.connect(self.on_page_size_changed)
-        self.pagination_layout.addWidget(self.page_size_input)
-        self.pagination_layout.addWidget(QLabel("条"))
-
-        self.search_book_layout.addLayout(self.pagination_layout)
+        self.search_book_layout.addLayout(self.result_info_layout)
         self.search_book_page.setLayout(self.search_book_layout)
 
         # 初始化 Tab
@@ -651,7 +543,7 @@ class book_root(QWidget):
 
     def _get_library_stats(self):
         """
-        从索引文件读取并计算图书馆统计数据。
+        从内存索引计算图书馆统计数据。
         """
         stats = {
             "total_mother_books": 0,
@@ -661,40 +553,8 @@ class book_root(QWidget):
         }
 
         try:
-            db_pach = core.book_modify.book_pach_index()
-            # 获取索引文件路径
-            index_pach_class = os.path.join(db_pach, "book-class-index.json")
-            index_pach_status = os.path.join(db_pach, "book-status-index.json")
-
-            # --- 1. 处理类别索引 (Mother Books) ---
-            class_index = core.book_baidu.read_json_file(index_pach_class)
-
-            unique_mother_ids = set()  # 用于计算总图书数
-
-            for category, mother_ids in class_index.items():
-                # 统计每个类别的图书数
-                mother_count = len(mother_ids)
-                stats["category_counts"][category] = mother_count
-
-                # 累加到总图书数
-                unique_mother_ids.update(mother_ids)
-
-            stats["total_mother_books"] = len(unique_mother_ids)
-
-            # --- 2. 处理状态索引 (Copies) ---
-            status_index = core.book_baidu.read_json_file(index_pach_status)
-
-            total_copies = 0
-            for status, copy_ids in status_index.items():
-                # 统计每个状态的副本数
-                copy_count = len(copy_ids)
-                stats["status_counts"][status] = copy_count
-
-                # 累加到总副本数
-                total_copies += copy_count
-
-            stats["total_copies"] = total_copies
-
+            # 直接读内存索引，不再解析索引文件
+            stats.update(core.book_service.get_index_service().stats())
             return stats
 
         except Exception as e:
@@ -910,7 +770,10 @@ class book_root(QWidget):
             # 4. 根据结果弹出提示框
             if success:
                 QMessageBox.information(self, "操作成功",
-                                        f"《{book_title}》{quantity}本 已添加！\n重启软件后可搜寻")
+                                        f"《{book_title}》{quantity}本 已添加！")
+                # 索引已在写入时同步，刷新统计和筛选项即可搜到新书
+                self._render_stats(self._get_library_stats())
+                self.populate_filters_from_index()
                 # 清空输入框
                 self.addinput_title.clear()
                 self.addinput_author.clear()
@@ -934,263 +797,355 @@ class book_root(QWidget):
 
     def populate_filters_from_index(self):
         try:
-            db_pach = core.book_modify.book_pach_index()
-            index_pach_class = os.path.join(db_pach, "book-class-index.json")
-            index_pach_status = os.path.join(db_pach, "book-status-index.json")
-
-            class_index = core.book_baidu.read_json_file(index_pach_class)
+            service = core.book_service.get_index_service()
             while self.category_filter.count() > 2: self.category_filter.removeItem(2)
-            for cat in sorted(class_index.keys()): self.category_filter.addItem(cat)
+            for cat in service.categories(): self.category_filter.addItem(cat)
 
-            status_index = core.book_baidu.read_json_file(index_pach_status)
             while self.status_filter.count() > 7: self.status_filter.removeItem(7)
             core_statuses = {"正常", "借出", "丢失", "损坏", "下架"}
-            for s in sorted(list(set(status_index.keys()) - core_statuses)): self.status_filter.addItem(s)
+            for s in sorted(set(service.statuses()) - core_statuses): self.status_filter.addItem(s)
         except Exception as e:
             QMessageBox.critical(self, "索引加载错误", f"加载索引文件时发生错误：{e}")
 
     def on_filter_changed(self):
         self.on_search()
 
-    def filter_data_with_index(self, category, status, initial_ids=None):
-        try:
-            db_pach = core.book_modify.book_pach_index()
-            index_pach_class = os.path.join(db_pach, "book-class-index.json")
-            index_pach_status = os.path.join(db_pach, "book-status-index.json")
-
-            if initial_ids is not None:
-                final_mother_ids = initial_ids.copy()
-                all_class_index = core.book_baidu.read_json_file(index_pach_class)
-            else:
-                all_class_index = core.book_baidu.read_json_file(index_pach_class)
-                # 假设所有 Mother ID 都在 class index 的值中
-                final_mother_ids = set(mid for ids in all_class_index.values() for mid in ids)
-
-            if not final_mother_ids: return set()  # ⭐️ 返回空集合
-
-            # 类别筛选
-            if category != "所有分类":
-                category_matches = set(all_class_index.get(category, []))
-                final_mother_ids = final_mother_ids.intersection(category_matches)
-                if not final_mother_ids: return set()
-
-            # 状态筛选 (根据副本状态过滤出包含此类副本的图书ID)
-            if status != "所有状态":
-                status_index = core.book_baidu.read_json_file(index_pach_status)
-                status_copy_matches = set(status_index.get(status, []))
-                if not status_copy_matches: return set()
-                # 从副本ID (e.g., '123-1') 中提取图书ID ('123')
-                status_mother_ids = set('-'.join(cid.split('-')[:-1]) for cid in status_copy_matches)
-                final_mother_ids = final_mother_ids.intersection(status_mother_ids)
-
-            # ⭐️ 关键修改：不再读取和返回详细数据，只返回 ID 集合
-            return final_mother_ids
-        except Exception as e:
-            QMessageBox.critical(self, "数据过滤错误", f"执行数据过滤或读取时发生错误：{e}")
-            return set()  # 返回空结果
-
     def on_search(self):
-        try:
-            db_pach = core.book_modify.book_pach_index()
-            index_pach_name = os.path.join(db_pach, "book-name-index.json")
-            index_pach_zuozhe = os.path.join(db_pach, "book-zuozhe-index.json")
-
-            search_term = self.input_filter.text().strip()
-            selected_category = self.category_filter.currentText()
-            selected_status = self.status_filter.currentText()
-
-            category_filter = selected_category if selected_category != "类别筛选" else "所有分类"
-            status_filter = selected_status if selected_status != "状态筛选" else "所有状态"
-
-            initial_ids = None
-            if search_term:
-                name_index = core.book_baidu.read_json_file(index_pach_name)
-                zuozhe_index = core.book_baidu.read_json_file(index_pach_zuozhe)
-                # 确保 initial_ids 是集合类型
-                initial_ids = set(name_index.get(search_term, [])).union(set(zuozhe_index.get(search_term, [])))
-
-                # 如果搜索词没有匹配，且没有其他筛选条件，直接清空结果
-                if not initial_ids and (category_filter == "所有分类" and status_filter == "所有状态"):
-                    self.all_matched_ids = []
-                    self.current_page = 1
-                    self.display_search_results()
-                    return
-
-            # ⭐️ 关键修改：现在 filter_data_with_index 返回的是 Mother ID 集合
-            matched_ids_set = self.filter_data_with_index(category_filter, status_filter, initial_ids)
-
-            # 将 ID 集合转换为列表并排序，以便分页时顺序稳定
-            self.all_matched_ids = sorted(list(matched_ids_set))
-            self.page_cache = {}
-            self.current_page = 1
-            self.display_search_results()
+        search_term = self.input_filter.text().strip()
+        selected_category = self.category_filter.currentText()
+        selected_status = self.status_filter.currentText()
 
-        except Exception as e:
-            QMessageBox.critical(self, "搜索索引错误", f"读取搜索索引文件时发生错误：{e}")
-            self.all_matched_ids = []
-            self.current_page = 1
-            self.display_search_results()
-
-    def update_pagination_controls(self):
-        """更新搜索结果的分页控件状态"""
-        total_results = len(self.all_matched_ids)
-        if self.page_size <= 0: self.page_size = 10  # 防止除零
-
-        # 计算总页数
-        self.total_pages = (total_results + self.page_size - 1) // self.page_size
-        if self.total_pages == 0: self.total_pages = 1  # 至少有一页
-
-        # 确保当前页不超出范围
-        if self.current_page > self.total_pages: self.current_page = self.total_pages
-        if self.current_page < 1: self.current_page = 1
+        category_filter = selected_category if selected_category != "类别筛选" else "所有分类"
+        status_filter = selected_status if selected_status != "状态筛选" else "所有状态"
 
-        self.page_info_label.setText(f"第 {self.current_page} / {self.total_pages} 页")
-        self.prev_page_button.setEnabled(self.current_page > 1)
-        self.next_page_button.setEnabled(self.current_page < self.total_pages)
-
-    def display_search_results(self):
-        # 1. 更新分页状态和计算 ID 范围
-        self.update_pagination_controls()
-
-        self.result_table.setRowCount(0)  # 清空表格
-
-        # 如果没有匹配结果
-        if not self.all_matched_ids:
+        # 在后台执行 搜索词 ∩ 类别 ∩ 状态 的组合筛选，并顺带加载第一块记录；
+        # 之前还没完成的查询 (包括模型的记录加载) 因代号过期被丢弃
+        self.query_generation += 1
+        self.all_matched_ids = []
+        self.result_model.set_ids([], self.query_generation)
+        self.result_count_label.setText("正在搜索...")
+        worker = QueryWorker(self.query_signals, self.query_generation, lambda: self.query_generation,
+                             BookResultModel.BLOCK_SIZE, [1],
+                             search=(search_term, category_filter, status_filter))
+        self.query_pool.start(worker.run)
+
+    def _on_query_matched(self, generation, matched_ids):
+        """后台搜索完成：模型换成新结果，记录随后按块到达。"""
+        if generation != self.query_generation:
             return
+        # 结果已按 ID 自然顺序排列，滚动时顺序稳定
+        self.all_matched_ids = matched_ids
+        self.result_model.set_ids(matched_ids, generation, first_block_loading=True)
+        self.result_table.scrollToTop()
+        self.result_count_label.setText(f"共 {len(matched_ids)} 条结果")
+
+    def _on_query_error(self, generation, message):
+        if generation != self.query_generation:
+            return
+        QMessageBox.critical(self, "搜索索引错误", f"执行数据过滤或读取时发生错误：{message}")
+        self.all_matched_ids = []
+        self.result_model.set_ids([], generation)
+        self.result_count_label.setText("共 0 条结果")
 
-        # ⭐️ 2. 检查是否需要加载新缓存窗口
-
-        # 当前请求的页码
-        page_to_load = self.current_page
-        # 当前缓存窗口的结束页码
-        cache_end_page = self.cache_start_page + self.cache_page_window - 1
-
-        is_in_cache_window = (self.cache_start_page <= page_to_load <= cache_end_page)
-
-        # 如果缓存是空的，或者当前页不在缓存窗口内
-        if not self.page_cache or not is_in_cache_window:
-            print(f"🔄 缓存失效或页码超出 ({page_to_load} / {cache_end_page})，正在加载新窗口...")
-
-            # 确定新窗口的起始页
-            # 如果是第一页，则从 1 开始；否则，从当前页开始
-            new_start_page = (page_to_load - 1) // self.cache_page_window * self.cache_page_window + 1
-
-            # 重新设置缓存起始页和清空缓存
-            self.cache_start_page = new_start_page
-            self.page_cache = {}
-
-            # 确定新窗口的结束页 (不能超过总页数)
-            new_end_page = min(new_start_page + self.cache_page_window - 1, self.total_pages)
+    def on_result_double_clicked(self, index):
+        # 从模型取这一行的 Mother ID
+        mother_id = self.result_model.book_id(index.row())
+        if mother_id:
+            BookDetailDialog(mother_id, self).exec()
 
-            # 批量加载整个新窗口的数据
-            self._load_cache_window(new_start_page, new_end_page)
+    def closeEvent(self, event):
+        # 让后台查询在下一步检查时结束，不再继续读分片
+        self.query_generation += 1
+        super().closeEvent(event)
 
-        # ⭐️ 3. 从缓存中获取当前页数据
+    # ----------------------------------------------------
 
-        # current_page_results 已经是包含 book_info 字典的列表
-        current_page_results = self.page_cache.get(self.current_page, [])
 
-        if not current_page_results:
-            print(f"⚠️ 警告：缓存中未找到第 {self.current_page} 页的数据。")
-            return
+# ⭐️ 查询工作线程类 (QueryWorker) ⭐️
+# ----------------------------------------------------
+class QuerySignals(QObject):
+    # 信号都带查询代号，主线程据此丢弃过期查询的结果
+    matched = Signal(int, list)  # 代号, 全部匹配的 Mother ID
+    page_loaded = Signal(int, int, list)  # 代号, 页码, 该页的图书记录
+    page_skipped = Signal(int, int)  # 代号, 页码 (已不需要，没有加载)
+    error = Signal(int, str)  # 代号, 错误信息
 
-        # 4. 填充表格
-        self.result_table.setRowCount(len(current_page_results))
 
-        NON_EDITABLE_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled
-        header_keys = ['book_id', 'name', 'author', 'publisher', 'category', 'quantity']
+class QueryWorker:
+    """
+    在线程池 (QThreadPool) 中执行的查询：可选地先在内存索引中搜索，再逐页加载记录
+    (这里的"页"是结果表格模型的一块，见 BookResultModel)。
 
-        for row, info in enumerate(current_page_results):
-            # 从 info 字典中明确获取 ID，并确保 info 中包含 book_id
-            book_id = info.get('book_id', 'N/A')
+    每加载完一页就发出 page_loaded，表格不用等所有页读完。
+    每一步之前检查自己的代号是否仍是最新的，筛选条件又变了就直接结束，不再读分片。
+    """
 
-            # 循环填充每一列
-            for col, key in enumerate(header_keys):
+    def __init__(self, signals, generation, current_generation, page_size, pages, search=None, matched_ids=None,
+                 wanted=None):
+        """
+        :param current_generation: 返回主线程最新查询代号的函数
+        :param pages: 需要加载的页码，按加载顺序排列
+        :param search: (搜索词, 类别, 状态)；为 None 时在 matched_ids 上加载页
+        :param wanted: 判断某一页是否仍然需要的函数 (例如已经滚出视野)，不需要的页发出 page_skipped
+        """
+        self.signals = signals
+        self.generation = generation
+        self.current_generation = current_generation
+        self.page_size = page_size
+        self.pages = pages
+        self.search = search
+        self.matched_ids = matched_ids or []
+        self.wanted = wanted
+
+    def _stale(self):
+        return self.generation != self.current_generation()
 
-                if key == 'book_id':
-                    # ⭐️ 明确处理 ID 所在的第一列
-                    value = book_id
-                elif key == 'quantity':
-                    # 副本数特殊处理：从 copies 列表中获取长度
-                    value = str(len(info.get('copies', [])))
-                else:
-                    value = str(info.get(key, ''))
+    def run(self):
+        try:
+            matched_ids = self.matched_ids
+            if self.search is not None:
+                if self._stale():
+                    return
+                matched_ids = core.book_service.get_index_service().search(*self.search)
+                self.signals.matched.emit(self.generation, matched_ids)
+            # 同一页内的记录按分片并发读取 (在 core.book_async 的常驻事件循环中执行)
+            core.book_async.run_coroutine(self._load_pages(matched_ids))
+        except Exception as e:
+            self.signals.error.emit(self.generation, str(e))
 
-                item = QTableWidgetItem(value)
-                item.setFlags(NON_EDITABLE_FLAGS)
-                self.result_table.setItem(row, col, item)
+    async def _load_pages(self, matched_ids):
+        for page_num in self.pages:
+            if self._stale():
+                return
+            if self.wanted is not None and not self.wanted(page_num):
+                self.signals.page_skipped.emit(self.generation, page_num)
+                continue
+            page_ids = matched_ids[(page_num - 1) * self.page_size:page_num * self.page_size]
+            if not page_ids:
+                continue
+
+            page_data = []
+            for mid, book_info in zip(page_ids, await core.book_async.get_book_records_by_ids_async(page_ids)):
+                if book_info:
+                    # ⭐️ 确保 book_info 字典中包含 'book_id' 键，表格第一列用它
+                    book_info['book_id'] = mid
+                    page_data.append(book_info)
+            self.signals.page_loaded.emit(self.generation, page_num, page_data)
 
-        self.result_table.viewport().update()
 
-    def _load_cache_window(self, start_page, end_page):
+# ----------------------------------------------------
+# ⭐️ 表格模型 (BookResultModel / CopyTableModel) ⭐️
+# ----------------------------------------------------
+class BookResultModel(QAbstractTableModel):
+    """
+    搜索结果表格的模型：每一行对应 all_matched_ids 中的一个 Mother ID，记录按块 (BLOCK_SIZE 行) 懒加载。
+
+    视图只为可见的行调用 data()：所在块还没加载时先显示 ID、其他列留空，并请求后台加载这一块，
+    到达后发出 dataChanged 刷新。行数通过 canFetchMore/fetchMore 随滚动逐批增加，
+    已加载的块按 LRU 最多保留 MAX_CACHED_BLOCKS 个，一百万条结果也只有可见附近的记录在内存里。
+    """
+    HEADERS = ['ID', '书名', '作者', '出版社', '分类', '副本数']
+    KEYS = ['book_id', 'name', 'author', 'publisher', 'category', 'quantity']
+    BLOCK_SIZE = 100  # 每次后台加载的行数
+    FETCH_BATCH = 500  # 滚动到底时每次增加的行数
+    MAX_CACHED_BLOCKS = 100
+    # 块与最近绘制的块相距超过这么多块时不再加载 (快速拖动时跳过已经滚走的块)
+    PREFETCH_RADIUS = 2
+
+    def __init__(self, query_pool, current_generation, parent=None):
+        """
+        :param query_pool: 执行后台加载的线程池
+        :param current_generation: 返回最新查询代号的函数，结果集变化后旧的加载任务随之作废
         """
-        加载整个缓存窗口（从 start_page 到 end_page）所需的所有 Mother ID，并进行批量查询。
+        super().__init__(parent)
+        self._pool = query_pool
+        self._current_generation = current_generation
+        self._generation = 0
+        self._ids = []
+        self._row_count = 0
+        self._blocks = OrderedDict()  # 块号 -> {Mother ID: 图书记录}
+        self._pending = set()  # 已请求、尚未到达的块
+        self._hot_block = 0  # 最近一次绘制的块 (后台线程只读这个整数)
+
+        self.block_signals = QuerySignals(self)
+        self.block_signals.page_loaded.connect(self.on_block_loaded)
+        self.block_signals.page_skipped.connect(self._on_block_skipped)
+        self.block_signals.error.connect(self._on_block_error)
+
+    def set_ids(self, matched_ids, generation, first_block_loading=False):
         """
-        print(f"⏳ 正在批量加载页码 [{start_page} - {end_page}] 的数据...")
+        换一组结果 (重置模型)。
 
-        # 计算需要加载的 ID 的起始和结束全局索引
-        start_global_index = (start_page - 1) * self.page_size
-        # 注意：这里我们加载到 end_page 的最后一条记录
-        end_global_index = min(end_page * self.page_size, len(self.all_matched_ids))
+        :param first_block_loading: 第 0 块已由搜索任务顺带加载，不再重复请求
+        """
+        self.beginResetModel()
+        self._generation = generation
+        self._ids = matched_ids
+        self._row_count = min(self.FETCH_BATCH, len(matched_ids))
+        self._blocks.clear()
+        self._pending = {0} if first_block_loading and matched_ids else set()
+        self._hot_block = 0
+        self.endResetModel()
+
+    def book_id(self, row):
+        return self._ids[row] if 0 <= row < self._row_count else None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return str(section + 1)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        row, col = index.row(), index.column()
+        book_id = self._ids[row]
+        if col == 0:
+            return book_id
+
+        block = row // self.BLOCK_SIZE
+        self._hot_block = block
+        records = self._blocks.get(block)
+        if records is None:
+            self._request_block(block)
+            return ""
+        self._blocks.move_to_end(block)
+
+        info = records.get(book_id)
+        if info is None:
+            return ""
+        key = self.KEYS[col]
+        if key == 'quantity':
+            # 副本数特殊处理：从 copies 列表中获取长度
+            return str(len(info.get('copies', [])))
+        return str(info.get(key, ''))
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._row_count < len(self._ids)
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(self.FETCH_BATCH, len(self._ids) - self._row_count)
+        if parent.isValid() or count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._row_count, self._row_count + count - 1)
+        self._row_count += count
+        self.endInsertRows()
 
-        # 截取需要加载的全部 Mother ID
-        all_window_ids = self.all_matched_ids[start_global_index:end_global_index]
+    def _wants_block(self, page_num):
+        # 在后台线程中调用
+        return abs(page_num - 1 - self._hot_block) <= self.PREFETCH_RADIUS
 
-        if not all_window_ids:
+    def _request_block(self, block):
+        if block in self._pending:
             return
+        self._pending.add(block)
+        worker = QueryWorker(self.block_signals, self._generation, self._current_generation, self.BLOCK_SIZE,
+                             [block + 1], matched_ids=self._ids, wanted=self._wants_block)
+        self._pool.start(worker.run)
+
+    def on_block_loaded(self, generation, page_num, page_data):
+        """一块记录到达 (页码从 1 开始，即块号 + 1)：放入缓存并刷新这些行。"""
+        if generation != self._generation:
+            return
+        block = page_num - 1
+        self._pending.discard(block)
+        self._blocks[block] = {info['book_id']: info for info in page_data}
+        while len(self._blocks) > self.MAX_CACHED_BLOCKS:
+            self._blocks.popitem(last=False)
 
-        all_book_records = {}
-        for mid in all_window_ids:
-            book_info = core.book_baidu.get_book_record_by_id(mid)
-            if book_info:
-                # ⭐️ 核心修正：确保 book_info 字典中包含 'book_id' 键
-                # 即使核心模块返回的字典中没有，我们也用 mid 填充它
-                book_info['book_id'] = mid
-                all_book_records[mid] = book_info
-
-        # 缓存数据：将加载到的所有数据按页码划分并存储
-        for page_num in range(start_page, end_page + 1):
-            page_start = (page_num - 1) * self.page_size
-            page_end = page_start + self.page_size
+        first_row = block * self.BLOCK_SIZE
+        last_row = min(first_row + self.BLOCK_SIZE, self._row_count) - 1
+        if first_row <= last_row:
+            self.dataChanged.emit(self.index(first_row, 1), self.index(last_row, len(self.HEADERS) - 1))
 
-            # 获取当前页的 ID 列表
-            page_ids = self.all_matched_ids[page_start:page_end]
+    def _on_block_skipped(self, generation, page_num):
+        if generation == self._generation:
+            # 滚回来时重新请求
+            self._pending.discard(page_num - 1)
 
-            # 从全局记录中提取当前页的数据
-            page_data = [all_book_records[mid] for mid in page_ids if mid in all_book_records]
+    def _on_block_error(self, generation, message):
+        if generation == self._generation:
+            print(f"⚠️ 警告: 加载搜索结果记录失败: {message}")
+            self._pending.clear()
 
-            if page_data:
-                self.page_cache[page_num] = page_data
 
-        print(f"✅ 缓存加载完成。当前窗口: [{self.cache_start_page} - {end_page}]")
+class CopyTableModel(QAbstractTableModel):
+    """
+    副本列表的模型：直接显示副本字典列表，不再为每个单元格创建 QTableWidgetItem。
 
-    def on_page_size_changed(self):
-        try:
-            self.page_size = int(self.page_size_input.text().strip())
-            self.current_page = 1
-            self.display_search_results()
-        except:
-            pass
-
-    def on_prev_page(self):
-        if self.current_page > 1:
-            self.current_page -= 1
-            self.display_search_results()
-
-    def on_next_page(self):
-        if self.current_page < self.total_pages:
-            self.current_page += 1
-            self.display_search_results()
-
-    def on_result_double_clicked(self, row, column):
-        # 直接获取第0列的ID
-        mid_item = self.result_table.item(row, 0)
-        if mid_item:
-            BookDetailDialog(mid_item.text(), self).exec()
+    副本 ID 列不可修改；其他列修改后调用 save_func(副本ID, 键名, 新值)，返回 True 才更新本地数据。
+    """
 
-    # ----------------------------------------------------
+    def __init__(self, keys, headers, save_func, parent=None):
+        super().__init__(parent)
+        self._keys = keys
+        self._headers = headers
+        self._save = save_func
+        self._copies = []
+
+    def set_copies(self, copies):
+        self.beginResetModel()
+        self._copies = copies
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._copies)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._keys)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self._headers[section]
+        return str(section + 1)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        key = self._keys[index.column()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return str(self._copies[index.row()].get(key, ''))
+        if role == Qt.BackgroundRole and key == 'copy_id':
+            return QBrush(Qt.lightGray)
+        return None
+
+    def flags(self, index):
+        flags = Qt.ItemIsSelectable | Qt.ItemIsEnabled
+        # 副本 ID ('copy_id') 不可修改
+        if index.isValid() and self._keys[index.column()] != 'copy_id':
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        copy_info = self._copies[index.row()]
+        key = self._keys[index.column()]
+        val = str(value)
+
+        # 值没有改变时不保存
+        if str(copy_info.get(key, '')) == val:
+            return False
+        if not self._save(copy_info['copy_id'], key, val):
+            return False
+
+        # ⭐️ 数据同步：保存成功后更新本地列表中的副本数据
+        copy_info[key] = val
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+        return True
 
 
+# ----------------------------------------------------
 # ⭐️ 初始化工作线程类 (InitWorker) ⭐️
 # ----------------------------------------------------
 class InitWorker(QObject):
@@ -1223,13 +1178,20 @@ class InitWorker(QObject):
             # 1. 查找文件夹是否存在 (阶段 1: 0% -> 10%)
             self.progress.emit(5, "正在检查系统文件夹...")
             core.book_jiajia.book_pach()
+            self.progress.emit(8, "正在检查数据文件...")
+            # 清理崩溃残留的临时文件，修复损坏的分片
+            core.book_io.recover_store()
             self.progress.emit(10, "系统文件夹检查完毕。")
 
             # 2. 生成索引 (阶段 2: 10% -> 100%)
             # ⭐️ 关键：将回调函数传入索引生成函数
             core.book_index.input_oput_index(progress_callback=self._update_file_progress)
 
-            # 3. 完成
+            # 3. 把索引加载进内存，之后的查询都不再读索引文件
+            self.progress.emit(100, "正在加载索引到内存...")
+            core.book_service.load_index_service()
+
+            # 4. 完成
             self.progress.emit(100, "初始化完成，正在加载界面...")
             self.finished.emit()
 
@@ -1238,6 +1200,8 @@ class InitWorker(QObject):
 
 
 if __name__ == "__main__":
+    # 并行建索引使用进程池，打包成 exe 后必须调用
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = book_root()
     window.show()
@@ -0,0 +1,456 @@
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+import core.book_baidu
+import core.book_index
+import core.book_io
+import core.book_jiajia
+import core.book_service
+
+# 无界面的本地查询服务：启动时加载一次索引，之后所有请求共用同一份内存索引和分片缓存，
+# 多个柜台的轻量客户端不必各自解析索引。在数据目录 (包含 db/ 和 index/ 的目录) 下运行：
+#
+#   python server.py                      # 监听 127.0.0.1:8765
+#   python server.py --bench              # 启动服务并用本地压测客户端测吞吐量
+#   python server.py --bench --url http://127.0.0.1:8765   # 压测已经在运行的服务
+#
+# 接口 (请求和响应均为 JSON)：
+#   GET   /api/search?q=&category=&status=&offset=0&limit=20   搜索，返回命中总数和这一页的记录
+#   GET   /api/books?ids=1-1-001,1-1-002                       批量读取母本
+#   GET   /api/books/<母本ID>                                  读取母本
+#   GET   /api/books/<母本ID>/copies                           列出副本
+#   POST  /api/books      {"name", "author", ..., "quantity"}  入库
+#   PATCH /api/books/<母本ID>   {"key": 字段, "value": 新值}    修改母本字段
+#   PATCH /api/copies/<副本ID>  {"key": 字段, "value": 新值}    修改副本字段 (借出、归还等)
+#   GET   /api/stats, /api/categories, /api/statuses
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 16
+# 保持连接的空闲超时 (秒)：工作线程服务一个连接直到它断开，空闲连接不能一直占着线程。
+# 另外有连接在排队等工作线程时，当前连接回复完这个请求就关闭 (见 BookRequestHandler._dispatch)
+KEEPALIVE_TIMEOUT = 2
+MAX_PAGE_SIZE = 500
+MAX_BODY_SIZE = 1024 * 1024
+
+# 允许通过接口修改的字段：{字段: 是否可以为 null}，值必须是字符串。
+# 其余字段 (副本 ID 列表、所属母本、入库时间) 由程序维护，不允许修改
+EDITABLE_MOTHER_KEYS = {"name": False, "author": False, "publisher": False, "isbn": False,
+                        "pages": False, "words": False, "category": False}
+EDITABLE_COPY_KEYS = {"status": False, "borrower_name": True, "borrow_date": True, "due_date": True,
+                      "notes": True}
+# 入库请求中的字段 -> add_db 的参数顺序
+NEW_BOOK_FIELDS = ("name", "author", "publisher", "isbn", "pages", "words", "category", "quantity")
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    用固定大小的线程池处理连接的 HTTPServer。
+
+    标准库的 ThreadingHTTPServer 每个连接新建一个线程，连接数不受控制；
+    这里连接交给线程池，同时服务的连接数最多为 workers，其余在队列中等待。
+    """
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="book-http")
+        self._waiting_lock = threading.Lock()
+        self.waiting = 0  # 已接受、还在排队等工作线程的连接数
+
+    def process_request(self, request, client_address):
+        with self._waiting_lock:
+            self.waiting += 1
+        self.executor.submit(self._process_request_in_pool, request, client_address)
+
+    def _process_request_in_pool(self, request, client_address):
+        with self._waiting_lock:
+            self.waiting -= 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _query_int(query, name, default, minimum, maximum):
+    try:
+        value = int(query.get(name, [default])[0])
+    except ValueError:
+        raise ApiError(400, f"参数 {name} 必须是整数")
+    return max(minimum, min(value, maximum))
+
+
+class BookRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1：默认保持连接，客户端可以在一个连接上连续发请求
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    server_version = "BookServer/1.0"
+    # 响应头和响应体分两次写出，不关闭 Nagle 算法时会和客户端的延迟确认叠加，每个请求多等约 40ms
+    disable_nagle_algorithm = True
+
+    # ---------------- 路由 ----------------
+
+    def do_GET(self):
+        self._dispatch({
+            ("api", "search"): self._search,
+            ("api", "books"): self._get_books,
+            ("api", "books", None): self._get_book,
+            ("api", "books", None, "copies"): self._get_copies,
+            ("api", "stats"): lambda _: core.book_service.get_index_service().stats(),
+            ("api", "categories"): lambda _: core.book_service.get_index_service().categories(),
+            ("api", "statuses"): lambda _: core.book_service.get_index_service().statuses(),
+        })
+
+    def do_POST(self):
+        self._dispatch({
+            ("api", "books"): self._add_book,
+        })
+
+    def do_PATCH(self):
+        self._dispatch({
+            ("api", "books", None): self._update_book,
+            ("api", "copies", None): self._update_copy,
+        })
+
+    def _dispatch(self, routes):
+        self._body_read = False
+        status, obj = self._route(routes)
+        # 处理函数没有读走的请求体 (未知接口、找不到图书等在读请求体之前出错) 要先读掉，
+        # 否则同一连接上的下一个请求会从这些剩余字节开始解析
+        if not self._body_read:
+            self._discard_body()
+        if self.server.waiting:
+            # 有连接在排队：回复后关闭，把工作线程让出来
+            self.close_connection = True
+        self._send_json(status, obj)
+
+    def _route(self, routes):
+        """按路由表处理请求，返回 (状态码, 响应对象)。"""
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        try:
+            for pattern, handler in routes.items():
+                if len(pattern) == len(parts) and all(p is None or p == part for p, part in zip(pattern, parts)):
+                    # 模式中 None 的位置是路径参数
+                    self.query = parse_qs(url.query)
+                    return 200, handler([part for p, part in zip(pattern, parts) if p is None])
+            raise ApiError(404, f"没有这个接口: {self.command} {url.path}")
+        except ApiError as e:
+            return e.status, {"error": e.message}
+        except Exception as e:
+            print(f"🚨 处理请求 {self.command} {self.path} 时发生错误: {e}")
+            return 500, {"error": str(e)}
+
+    # ---------------- 查询 ----------------
+
+    def _search(self, _):
+        query = self.query
+        ids = core.book_service.get_index_service().search(
+            query.get("q", [""])[0].strip(),
+            query.get("category", [core.book_service.ALL_CATEGORIES])[0],
+            query.get("status", [core.book_service.ALL_STATUSES])[0],
+        )
+        offset = _query_int(query, "offset", 0, 0, len(ids))
+        limit = _query_int(query, "limit", 20, 0, MAX_PAGE_SIZE)
+        page_ids = ids[offset:offset + limit]
+        records = core.book_baidu.get_book_records_by_ids(page_ids)
+        return {
+            "total": len(ids),
+            "offset": offset,
+            "books": [dict(record, id=book_id) for book_id, record in zip(page_ids, records) if record is not None],
+        }
+
+    def _get_books(self, _):
+        ids = [book_id for value in self.query.get("ids", []) for book_id in value.split(',') if book_id]
+        if len(ids) > MAX_PAGE_SIZE:
+            raise ApiError(400, f"一次最多读取 {MAX_PAGE_SIZE} 本")
+        records = core.book_baidu.get_book_records_by_ids(ids)
+        return {"books": [dict(record, id=book_id) if record is not None else None
+                          for book_id, record in zip(ids, records)]}
+
+    def _get_book(self, args):
+        record = core.book_baidu.get_book_record_by_id(args[0])
+        if record is None:
+            raise ApiError(404, f"找不到图书 {args[0]}")
+        return dict(record, id=args[0])
+
+    def _get_copies(self, args):
+        return {"copies": core.book_baidu.get_all_copies_by_mother_id_optimized(args[0])}
+
+    # ---------------- 修改 ----------------
+
+    def _body_length(self):
+        """请求体的字节数；分块传输或 Content-Length 无效时返回 -1。"""
+        if self.headers.get("Transfer-Encoding"):
+            return -1
+        try:
+            return int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            return -1
+
+    def _discard_body(self):
+        length = self._body_length()
+        if 0 <= length <= MAX_BODY_SIZE:
+            self.rfile.read(length)
+        else:
+            self.close_connection = True
+
+    def _read_body(self):
+        self._body_read = True
+        length = self._body_length()
+        if not 0 <= length <= MAX_BODY_SIZE:
+            # 请求体没有读走，连接上剩下的字节无法解析，回复后关闭连接
+            self.close_connection = True
+            if length > MAX_BODY_SIZE:
+                raise ApiError(413, "请求体过大")
+            raise ApiError(400, "Content-Length 无效")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise ApiError(400, "请求体不是有效的 JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "请求体必须是 JSON 对象")
+        return body
+
+    def _field_edit(self, editable_keys):
+        body = self._read_body()
+        key = body.get("key")
+        if not isinstance(key, str) or not key or "value" not in body:
+            raise ApiError(400, "请求体需要 key 和 value")
+        if key not in editable_keys:
+            raise ApiError(400, f"字段 {key} 不允许修改")
+        val = body["value"]
+        # 非字符串的值写进预写日志后，索引同步和之后每次启动的日志合并都会失败
+        if val is None:
+            if not editable_keys[key]:
+                raise ApiError(400, f"字段 {key} 不能为空")
+        elif not isinstance(val, str):
+            raise ApiError(400, f"字段 {key} 的值必须是字符串")
+        return key, val
+
+    def _update_book(self, args):
+        key, val = self._field_edit(EDITABLE_MOTHER_KEYS)
+        if not core.book_jiajia.update_mother_field(args[0], key, val):
+            raise ApiError(422, f"修改图书 {args[0]} 失败")
+        return {"ok": True}
+
+    def _update_copy(self, args):
+        key, val = self._field_edit(EDITABLE_COPY_KEYS)
+        if not core.book_jiajia.update_copy_field(args[0], key, val):
+            raise ApiError(422, f"修改副本 {args[0]} 失败")
+        return {"ok": True}
+
+    def _add_book(self, _):
+        body = self._read_body()
+        values = [body.get(field, "") for field in NEW_BOOK_FIELDS]
+        values[-1] = body.get("quantity", 1)
+        for field, value in zip(NEW_BOOK_FIELDS[:-1], values):
+            if not isinstance(value, str):
+                raise ApiError(400, f"字段 {field} 的值必须是字符串")
+        if not values[0].strip():
+            raise ApiError(400, "书名不能为空")
+        if isinstance(values[-1], bool) or not isinstance(values[-1], (int, str)):
+            raise ApiError(400, "入库数量必须是整数")
+        if not core.book_jiajia.add_db(*values):
+            raise ApiError(422, "入库失败")
+        return {"ok": True}
+
+    # ---------------- 响应 ----------------
+
+    def _send_json(self, status, obj):
+        payload = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        # 保持连接要求每个响应都带 Content-Length
+        self.send_header("Content-Length", str(len(payload)))
+        if self.close_connection:
+            # 告诉客户端这个连接不再复用，下一个请求要重新连接
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def load_store():
+    """与界面启动时的 InitWorker 相同：检查目录、修复分片、增量更新索引并加载到内存。"""
+    core.book_jiajia.book_pach()
+    core.book_io.recover_store()
+    core.book_index.input_oput_index()
+    core.book_service.load_index_service()
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS, verbose=False):
+    server = PooledHTTPServer((host, port), BookRequestHandler, workers)
+    server.verbose = verbose
+    return server
+
+
+# ----------------------------------------------------
+# 本地压测客户端
+# ----------------------------------------------------
+
+def _bench_client(host, port, deadline, requests, sample_ids, terms, categories, latencies, errors):
+    # 每个客户端一个保持连接的 HTTP 连接，按比例混合搜索、读母本和列副本
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    rng = random.Random()
+    done = 0
+    while done < requests and time.perf_counter() < deadline:
+        roll = rng.random()
+        if roll < 0.4:
+            params = [f"q={rng.choice(terms)}"] if terms and rng.random() < 0.5 else []
+            if categories and rng.random() < 0.5:
+                params.append(f"category={rng.choice(categories)}")
+            path = "/api/search?" + "&".join(params)
+        elif roll < 0.7:
+            path = f"/api/books/{rng.choice(sample_ids)}"
+        else:
+            path = f"/api/books/{rng.choice(sample_ids)}/copies"
+
+        start = time.perf_counter()
+        try:
+            conn.request("GET", _quote_path(path))
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+        latencies.append(time.perf_counter() - start)
+        done += 1
+    conn.close()
+
+
+def _quote_path(path):
+    return quote(path, safe="/?=&,")
+
+
+def _get_json(host, port, path):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        conn.request("GET", _quote_path(path))
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def run_bench(host, port, clients=8, requests=2000, duration=None):
+    """
+    对服务发起只读的混合负载 (不修改数据)，打印吞吐量和延迟分位数。
+
+    :param clients: 并发客户端 (连接) 数
+    :param requests: 每个客户端的请求数
+    :param duration: 最长运行秒数，None 表示不限
+    :return: {"requests", "errors", "seconds", "rps", "p50_ms", "p95_ms", "p99_ms"}
+    """
+    # 先取一批母本 ID、书名片段和分类作为压测素材
+    first_page = _get_json(host, port, f"/api/search?limit={MAX_PAGE_SIZE}")
+    sample_ids = [book["id"] for book in first_page.get("books", [])]
+    if not sample_ids:
+        print("错误: 服务中没有图书，无法压测。")
+        return None
+    terms = sorted({str(book.get("name") or "")[:2] for book in first_page["books"]} - {""})
+    categories = _get_json(host, port, "/api/categories")
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration if duration else float("inf")
+    threads = [threading.Thread(target=_bench_client,
+                                args=(host, port, deadline, requests, sample_ids, terms, categories, latencies, errors))
+               for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    result = {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": round(seconds, 3),
+        "rps": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(percentile(0.50), 2),
+        "p95_ms": round(percentile(0.95), 2),
+        "p99_ms": round(percentile(0.99), 2),
+    }
+    print(f"✅ 压测完成：{clients} 个连接，共 {result['requests']} 个请求 ({result['errors']} 个错误)，"
+          f"用时 {result['seconds']} 秒，{result['rps']} 请求/秒；"
+          f"延迟 p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="图书管理本地查询服务 (HTTP/JSON)。在数据目录 (包含 db/ 和 index/ 的目录) 下运行。")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"监听地址，默认 {DEFAULT_HOST}")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"监听端口，默认 {DEFAULT_PORT}")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="处理连接的线程数")
+    parser.add_argument("--verbose", action="store_true", help="打印每个请求的访问日志")
+    parser.add_argument("--bench", action="store_true", help="运行本地压测客户端")
+    parser.add_argument("--url", help="压测已经在运行的服务 (e.g. http://127.0.0.1:8765)，默认在本进程内启动一个")
+    parser.add_argument("--clients", type=int, default=8, help="压测的并发连接数")
+    parser.add_argument("--requests", type=int, default=2000, help="压测时每个连接的请求数")
+    parser.add_argument("--duration", type=float, help="压测最长运行秒数")
+    args = parser.parse_args(argv)
+
+    if args.bench and args.url:
+        target = urlsplit(args.url)
+        run_bench(target.hostname, target.port or 80, args.clients, args.requests, args.duration)
+        return 0
+
+    print("正在加载索引...")
+    load_store()
+    # 压测时在本进程内启动服务，端口由系统分配
+    server = make_server(args.host, 0 if args.bench else args.port, args.workers, args.verbose)
+    host, port = server.server_address[:2]
+
+    if args.bench:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            run_bench(host, port, args.clients, args.requests, args.duration)
+        finally:
+            server.shutdown()
+            server.server_close()
+        return 0
+
+    print(f"✅ 服务已启动: http://{host}:{port}/api/ (Ctrl+C 退出)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("正在退出...")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
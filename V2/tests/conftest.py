@@ -0,0 +1,77 @@
+import json
+import os
+import random
+import sys
+
+import pytest
+
+# 测试直接导入 V2 下的 core 包和 server.py (与 main.py 一样从 V2 目录运行)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.book_service  # noqa: E402
+
+CATEGORIES = ("小说", "科技", "历史", "传记")
+STATUSES = ("正常", "借出", "丢失", "损坏")
+RECORDS_PER_FILE = 999
+
+
+def make_store(root, mothers=1500, seed=1):
+    """
+    在 root 下生成一个确定的小型书库 (db/data、db/data-b、index)，分片格式与程序写出的相同。
+
+    每本母本 1~4 个副本，副本按每个文件 999 条连续存放，所以会有母本的副本跨两个副本文件。
+    :return: 母本 ID 列表
+    """
+    rng = random.Random(seed)
+    data, data_b = os.path.join(root, "db", "data"), os.path.join(root, "db", "data-b")
+    for directory in (data, data_b, os.path.join(root, "index")):
+        os.makedirs(directory, exist_ok=True)
+
+    shards, copies = {}, []
+    for i in range(mothers):
+        file_index, number = i // RECORDS_PER_FILE + 1, i % RECORDS_PER_FILE + 1
+        mother_id = f"1-{file_index}-{number:03d}"
+        copy_ids = [f"{mother_id}-{k}" for k in range(1, rng.randint(1, 4) + 1)]
+        shards.setdefault(file_index, {})[mother_id] = {
+            "name": rng.choice("时间简史三体红楼梦") + "之书" + str(i % 17),
+            "author": rng.choice("张王李赵刘陈杨黄") + rng.choice("伟芳娜敏静丽强磊军洋"),
+            "publisher": "出版社", "isbn": "978", "pages": "100", "words": "10",
+            "category": rng.choice(CATEGORIES), "date_added": "2024-01-01 00:00:00", "copies": copy_ids,
+        }
+        copies += [(copy_id, {"book_id": mother_id, "status": rng.choice(STATUSES), "borrower_name": None,
+                              "borrow_date": None, "due_date": None, "notes": None}) for copy_id in copy_ids]
+
+    for file_index, records in shards.items():
+        _dump(os.path.join(data, f"book-{file_index}.json"), records)
+    for start in range(0, len(copies), RECORDS_PER_FILE):
+        _dump(os.path.join(data_b, f"book-b-{start // RECORDS_PER_FILE + 1}.json"),
+              dict(copies[start:start + RECORDS_PER_FILE]))
+    return [mother_id for records in shards.values() for mother_id in records]
+
+
+def _dump(path, obj):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=4)
+
+
+def load_shards(directory):
+    """按文件名读出目录下全部分片：{文件名: {ID: 记录}}。"""
+    shards = {}
+    for filename in os.listdir(directory):
+        if filename.endswith(".json"):
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+                shards[filename] = json.load(f)
+    return shards
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """
+    在临时目录中生成书库并切换到该目录 (数据和索引路径都相对于当前目录，见 book_modify)。
+
+    其余模块级缓存都以文件路径和时间戳为键，换了目录自然失效；内存索引服务是单例，需要清掉。
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(core.book_service, "_service", None)
+    make_store(str(tmp_path))
+    return tmp_path
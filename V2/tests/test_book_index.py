@@ -0,0 +1,174 @@
+import json
+import os
+
+from conftest import load_shards
+
+import core.book_baidu as book_baidu
+import core.book_index as book_index
+import core.book_io as book_io
+import core.book_jiajia as book_jiajia
+from core.book_copyloc import locate_copies, read_located_copies
+from core.book_ngram import NgramIndex
+from core.book_service import IndexService
+
+SEARCH_TERMS = ("简史", "之书1", "张", "书", "王芳", "新作者", "增量")
+
+
+def _rewrite(path, edit):
+    """模拟外部工具改写分片：读出、修改、整体写回 (不经过程序的写入路径)。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    edit(records)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=4)
+
+
+def _index_snapshot():
+    """索引目录对外可见的全部内容：JSON 索引、n-gram 搜索结果、副本位置、内存索引服务的查询结果。"""
+    index_pach = book_index.book_pach_index()
+    mother_ids = [mother_id for records in load_shards("db/data").values() for mother_id in records]
+    ngram = NgramIndex.load(index_pach)
+    service = IndexService.load(index_pach)
+    return {
+        "indexes": book_index.read_index_files(index_pach),
+        "ngram": {term: ngram.search(term) for term in SEARCH_TERMS},
+        "copy_loc": {mother_id: locate_copies(mother_id) for mother_id in mother_ids},
+        "search": {term: service.search(term) for term in SEARCH_TERMS},
+        "stats": service.stats(),
+    }
+
+
+def _full_rebuild_snapshot():
+    # 删除清单后下一次维护全量重建
+    os.remove(os.path.join(book_index.book_pach_index(), book_index.MANIFEST_FILE))
+    book_index.input_oput_index()
+    return _index_snapshot()
+
+
+def _all_copies(mother_id):
+    copies = {}
+    for _, records in book_baidu._scan_copy_files(mother_id):
+        copies.update(records)
+    return copies
+
+
+def test_incremental_update_matches_full_rebuild(store):
+    book_index.input_oput_index()
+
+    # 外部改写：母本改名/删除、副本改状态/删除、整个尾部副本文件删除、只改时间戳
+    def edit_mothers(records):
+        records["1-1-005"].update(name="新书", author="新作者")
+        del records["1-1-100"]
+    _rewrite("db/data/book-1.json", edit_mothers)
+
+    def edit_copies(records):
+        records[next(iter(records))]["status"] = "下架"
+        records.popitem()
+    _rewrite("db/data-b/book-b-2.json", edit_copies)
+    tail = book_baidu.list_json_files("db/data-b")[-1]
+    os.remove(os.path.join("db/data-b", tail))
+    os.utime("db/data/book-2.json")
+
+    # 程序内的写入：新书 (写穿索引)、字段修改 (预写日志，维护索引时合并回分片)
+    assert book_jiajia.add_db("增量测试", "新作者", "出版社", "978", "1", "1", "科技", 3)
+    assert book_jiajia.update_mother_field("1-1-010", "name", "改名之后的简史")
+    assert book_jiajia.update_copy_field("1-1-011-1", "status", "下架")
+
+    book_index.input_oput_index()
+    incremental = _index_snapshot()
+    assert "1-1-005" in incremental["search"]["新作者"]
+    assert "1-1-010" in incremental["search"]["简史"]
+    assert incremental["search"]["增量"]
+
+    assert incremental == _full_rebuild_snapshot()
+
+
+def test_unchanged_store_is_not_rewritten(store):
+    book_index.input_oput_index()
+    paths = book_index.index_file_paths(book_index.book_pach_index())
+    before = {key: os.stat(path).st_mtime_ns for key, path in paths.items()}
+    book_index.input_oput_index()
+    assert {key: os.stat(path).st_mtime_ns for key, path in paths.items()} == before
+
+
+def test_copy_locations_for_mother_split_across_copy_files(store):
+    book_index.input_oput_index()
+
+    # 第一个副本文件的最后一条和第二个文件的第一条属于同一本母本
+    first, second = (load_shards("db/data-b")[f"book-b-{n}.json"] for n in (1, 2))
+    mother_id = first[next(reversed(first))]["book_id"]
+    assert second[next(iter(second))]["book_id"] == mother_id
+
+    locations = locate_copies(mother_id)
+    assert [os.path.basename(path) for path, *_ in locations] == ["book-b-1.json", "book-b-2.json"]
+    located = {}
+    for _, copies in read_located_copies(mother_id):
+        located.update(copies)
+    assert located == _all_copies(mother_id)
+    mother = book_baidu.get_book_record_by_id(mother_id)
+    assert [c["copy_id"] for c in book_baidu.get_all_copies_by_mother_id_optimized(mother_id)] == mother["copies"]
+
+    # 副本文件被外部改写后位置作废，查询退回扫描，仍然得到正确结果；维护索引后恢复
+    def edit_copies(records):
+        records[next(iter(records))]["notes"] = "外部修改" * 10
+    _rewrite("db/data-b/book-b-2.json", edit_copies)
+    assert locate_copies(mother_id) is None
+    assert [c["copy_id"] for c in book_baidu.get_all_copies_by_mother_id_optimized(mother_id)] == mother["copies"]
+    book_index.input_oput_index()
+    assert len(locate_copies(mother_id)) == 2
+
+    # 一次入库超过一个文件容量的副本，位置索引随写入同步
+    assert book_jiajia.add_db("大套书", "作者", "出版社", "978", "1", "1", "历史", 1500)
+    new_id = max(load_shards("db/data")[book_baidu.list_json_files("db/data")[-1]], key=book_baidu.parse_id)
+    located = {}
+    for _, copies in read_located_copies(new_id):
+        located.update(copies)
+    assert len(located) == 1500 and located == _all_copies(new_id)
+    assert len(locate_copies(new_id)) >= 2
+
+
+def test_corrupt_shards_are_salvaged(store):
+    # 给一个非尾部副本分片写上校验和，之后篡改它的内容 (JSON 仍然完好)
+    copy_path = "db/data-b/book-b-2.json"
+    with open(copy_path, 'r', encoding='utf-8') as f:
+        book_io.atomic_write_json(copy_path, json.load(f), checksum=True, indent=2)
+    book_index.input_oput_index()
+    before = book_index.read_index_files(book_index.book_pach_index())
+
+    # 非尾部母本分片被截断
+    mother_path = "db/data/book-1.json"
+    with open(mother_path, 'rb') as f:
+        raw = f.read()
+    with open(mother_path, 'wb') as f:
+        f.write(raw[:len(raw) * 2 // 3])
+
+    def tamper(records):
+        records[next(iter(records))]["status"] = "被篡改"
+    _rewrite(copy_path, tamper)
+    tampered_id = next(iter(load_shards("db/data-b")["book-b-2.json"]))
+
+    # 启动检查只看尾部分片，这两个分片在维护索引读到时才修复
+    assert book_io.recover_store() == []
+    book_index.input_oput_index()
+
+    for path in (mother_path, copy_path):
+        assert os.path.exists(path + book_io.CORRUPT_SUFFIX)
+        assert book_io.verify_file(path) == (True, "")
+    salvaged = load_shards("db/data")["book-1.json"]
+    assert 0 < len(salvaged) < book_baidu.MAX_RECORDS
+    with open(mother_path + book_io.CORRUPT_SUFFIX, 'rb') as f:
+        assert book_io.salvage_records(f.read()) == salvaged
+
+    after = book_index.read_index_files(book_index.book_pach_index())
+    count = lambda indexes: sum(len(ids) for ids in indexes["name"].values())
+    assert count(after) == count(before) - (book_baidu.MAX_RECORDS - len(salvaged))
+    assert tampered_id in after["status"]["被篡改"]
+    assert _index_snapshot() == _full_rebuild_snapshot()
+
+
+def test_salvage_records_keeps_complete_records():
+    records = {"1-1-001": {"name": "甲"}, "1-1-002": {"name": "乙"}, "1-1-003": {"name": "丙"}}
+    raw = json.dumps(records, ensure_ascii=False, indent=4).encode('utf-8')
+    assert book_io.salvage_records(raw) == records
+    cut = raw.index("乙".encode('utf-8')) + 3
+    assert book_io.salvage_records(raw[:cut]) == {"1-1-001": {"name": "甲"}}
@@ -0,0 +1,62 @@
+import multiprocessing
+import os
+
+from conftest import load_shards
+
+import core.book_baidu as book_baidu
+import core.book_index as book_index
+import core.book_jiajia as book_jiajia
+
+WORKERS = 4
+BOOKS_PER_WORKER = 10
+
+
+def _add_books(root, worker):
+    # 子进程入口：与另一个管理员的界面一样，在同一书库目录下逐本入库
+    os.chdir(root)
+    for i in range(BOOKS_PER_WORKER):
+        assert book_jiajia.add_db(f"并发{worker}-{i}", f"作者{worker}", "出版社", "978", "1", "1", "科技", 1 + i % 3)
+
+
+def test_concurrent_add_db_allocates_unique_ids(store):
+    book_index.input_oput_index()
+    existing = {mother_id for records in load_shards("db/data").values() for mother_id in records}
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_add_books, args=(str(store), worker)) for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+    assert [process.exitcode for process in processes] == [0] * WORKERS
+
+    mothers = {}
+    for records in load_shards("db/data").values():
+        assert not mothers.keys() & records.keys()
+        mothers.update(records)
+    copies = {}
+    for records in load_shards("db/data-b").values():
+        assert not copies.keys() & records.keys()
+        copies.update(records)
+
+    # 每本书一个新 ID，紧接在已有记录之后连续分配，没有重号或空洞
+    added = sorted((mother_id for mother_id in mothers if mother_id not in existing), key=book_baidu.parse_id)
+    assert len(added) == WORKERS * BOOKS_PER_WORKER
+    assert sorted(mothers[mother_id]["name"] for mother_id in added) == \
+        sorted(f"并发{worker}-{i}" for worker in range(WORKERS) for i in range(BOOKS_PER_WORKER))
+    all_ids = sorted(mothers, key=book_baidu.parse_id)
+    assert all_ids[-len(added):] == added
+    for previous, current in zip(all_ids, all_ids[1:]):
+        (_, file_a, num_a), (_, file_b, num_b) = book_baidu.parse_id(previous), book_baidu.parse_id(current)
+        assert (file_b, num_b) in ((file_a, num_a + 1), (file_a + 1, 1))
+    for mother_id in added:
+        assert mothers[mother_id]["copies"] == [f"{mother_id}-{k}" for k in range(1, len(mothers[mother_id]["copies"]) + 1)]
+        assert all(copies[copy_id]["book_id"] == mother_id for copy_id in mothers[mother_id]["copies"])
+
+    # 各进程写穿的索引与全量重建一致
+    book_index.input_oput_index()
+    incremental = book_index.read_index_files(book_index.book_pach_index())
+    assert sum(len(ids) for ids in incremental["name"].values()) == len(mothers)
+    os.remove(os.path.join(book_index.book_pach_index(), book_index.MANIFEST_FILE))
+    book_index.input_oput_index()
+    assert book_index.read_index_files(book_index.book_pach_index()) == incremental
@@ -0,0 +1,71 @@
+import json
+import os
+
+from conftest import load_shards
+
+import core.book_baidu as book_baidu
+import core.book_index as book_index
+import core.book_jiajia as book_jiajia
+import core.book_wal as book_wal
+
+
+def _mother_ids():
+    return [mother_id for records in load_shards("db/data").values() for mother_id in records]
+
+
+def test_field_edits_stay_in_wal_until_compaction(store):
+    book_index.input_oput_index()
+    mother_id = _mother_ids()[10]
+    mother_path = os.path.join("db", "data", f"book-{mother_id.split('-')[1]}.json")
+    with open(mother_path, 'rb') as f:
+        before = f.read()
+
+    assert book_jiajia.update_mother_field(mother_id, "name", "预写日志测试书")
+    copy_id = book_baidu.get_all_copies_by_mother_id_optimized(mother_id)[0]["copy_id"]
+    assert book_jiajia.update_copy_field(copy_id, "status", "下架")
+
+    # 分片没有改写，读取时叠加日志中的修改
+    with open(mother_path, 'rb') as f:
+        assert f.read() == before
+    assert book_wal.wal_pending() == 2
+    assert book_baidu.get_book_record_by_id(mother_id)["name"] == "预写日志测试书"
+    assert book_baidu.get_book_records_by_ids([mother_id])[0]["name"] == "预写日志测试书"
+    copies = {c["copy_id"]: c for c in book_baidu.get_all_copies_by_mother_id_optimized(mother_id)}
+    assert copies[copy_id]["status"] == "下架"
+
+    # 追加时崩溃留下的半行被忽略
+    with open(book_wal.book_pach_wal(), 'ab') as f:
+        f.write(b'{"section": "da')
+    assert book_wal.wal_pending() == 2
+
+    # 启动维护索引时合并回分片并清空日志，索引与全量重建一致
+    book_index.input_oput_index()
+    assert book_wal.wal_pending() == 0
+    assert os.path.getsize(book_wal.book_pach_wal()) == 0
+    with open(mother_path, 'r', encoding='utf-8') as f:
+        assert json.load(f)[mother_id]["name"] == "预写日志测试书"
+    indexes = book_index.read_index_files(book_index.book_pach_index())
+    assert mother_id in indexes["name"]["预"] and copy_id in indexes["status"]["下架"]
+    os.remove(os.path.join(book_index.book_pach_index(), book_index.MANIFEST_FILE))
+    book_index.input_oput_index()
+    assert book_index.read_index_files(book_index.book_pach_index()) == indexes
+
+
+def test_wal_compacts_at_threshold(store, monkeypatch):
+    book_index.input_oput_index()
+    monkeypatch.setattr(book_jiajia, "WAL_COMPACT_THRESHOLD", 5)
+    mother_ids = _mother_ids()[20:25]
+
+    for i, mother_id in enumerate(mother_ids[:4]):
+        assert book_jiajia.update_mother_field(mother_id, "publisher", f"出版社{i}")
+    assert book_wal.wal_pending() == 4
+    assert book_jiajia.update_mother_field(mother_ids[4], "publisher", "出版社4")
+    assert book_wal.wal_pending() == 0
+
+    shard = load_shards("db/data")[f"book-{mother_ids[0].split('-')[1]}.json"]
+    assert [shard[mother_id]["publisher"] for mother_id in mother_ids] == [f"出版社{i}" for i in range(5)]
+    # 合并后清单随之刷新，下次启动不需要重扫被改写的分片
+    manifest = book_index.load_manifest(book_index.book_pach_index())
+    assert manifest is not None
+    changed = book_index.update_index("db/data", "db/data-b", book_index._read_index_json("index"), manifest)
+    assert not changed
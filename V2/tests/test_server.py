@@ -0,0 +1,106 @@
+import http.client
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def book_server(store):
+    server.load_store()
+    httpd = server.make_server(port=0, workers=2)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address[:2]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _call(conn, method, path, body=None, headers=None):
+    conn.request(method, server._quote_path(path), body=body, headers=headers or {})
+    response = conn.getresponse()
+    return response.status, response.getheader("Connection"), json.loads(response.read())
+
+
+def _raw_exchange(address, request):
+    """发送原始请求字节，读到服务器关闭连接为止；服务器没有关闭时 recv 超时抛出 socket.timeout。"""
+    with socket.create_connection(address, timeout=5) as sock:
+        sock.sendall(request)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+
+def test_unread_body_is_drained_on_error(book_server):
+    conn = http.client.HTTPConnection(*book_server, timeout=5)
+    # 请求体看起来像一个请求：没有读掉的话，会被当成同一连接上的下一个请求解析
+    smuggled = json.dumps({"name": "GET /api/stats HTTP/1.1\r\n\r\n"})
+    assert _call(conn, "PATCH", "/api/nope/1", smuggled)[0] == 404
+    assert _call(conn, "POST", "/api/unknown", smuggled)[0] == 404
+    assert _call(conn, "GET", "/api/books/9-9-999", smuggled)[0] == 404
+    sock = conn.sock
+
+    status, connection, stats = _call(conn, "GET", "/api/stats")
+    assert status == 200 and connection is None and stats["total_mother_books"] == 1500
+    # 一直是同一个连接
+    assert conn.sock is sock
+    conn.close()
+
+
+def test_unreadable_body_closes_connection(book_server):
+    too_large = server.MAX_BODY_SIZE + 1
+    for request in (
+            # 请求体过大、长度无效、分块传输：剩余字节无法跳过，回复后关闭连接
+            f"PATCH /api/books/1-1-001 HTTP/1.1\r\nHost: x\r\nContent-Length: {too_large}\r\n\r\n".encode(),
+            b"POST /api/unknown HTTP/1.1\r\nHost: x\r\nContent-Length: abc\r\n\r\n",
+            b"POST /api/books HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n"):
+        reply = _raw_exchange(book_server, request)
+        head = reply.split(b"\r\n\r\n", 1)[0].decode()
+        assert head.split()[1] in ("400", "404", "413")
+        assert "Connection: close" in head
+        # 只有一个回复，请求体没有被当成下一个请求
+        assert reply.count(b"HTTP/1.1 ") == 1
+
+
+def test_idle_keepalive_connections_do_not_starve_new_clients(book_server):
+    # 两个空闲的保持连接各占一个工作线程，第三个客户端在保持连接超时之后仍能得到回复
+    idle = [http.client.HTTPConnection(*book_server, timeout=5) for _ in range(2)]
+    for conn in idle:
+        assert _call(conn, "GET", "/api/stats")[0] == 200
+
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection(*book_server, timeout=server.KEEPALIVE_TIMEOUT + 5)
+    assert _call(conn, "GET", "/api/stats")[0] == 200
+    assert time.perf_counter() - start < server.KEEPALIVE_TIMEOUT + 2
+
+    # 被超时关闭的空闲连接，客户端重新连接后照常可用
+    for c in idle + [conn]:
+        c.close()
+    conn = http.client.HTTPConnection(*book_server, timeout=5)
+    assert _call(conn, "GET", "/api/categories")[0] == 200
+    conn.close()
+
+
+def test_busy_connection_is_closed_when_others_are_queued(book_server):
+    # 两个工作线程都被空闲连接占住时，再来的连接排队；之后先回复的那个连接在回复后关闭，把线程让出来
+    first = http.client.HTTPConnection(*book_server, timeout=5)
+    second = http.client.HTTPConnection(*book_server, timeout=5)
+    assert _call(first, "GET", "/api/stats")[0] == 200
+    assert _call(second, "GET", "/api/stats")[0] == 200
+
+    queued = socket.create_connection(book_server, timeout=5)
+    time.sleep(0.2)
+    status, connection, _ = _call(first, "GET", "/api/stats")
+    assert status == 200 and connection == "close"
+
+    queued.sendall(b"GET /api/stats HTTP/1.1\r\nHost: x\r\n\r\n")
+    assert queued.recv(65536).startswith(b"HTTP/1.1 200")
+    for sock in (first, second, queued):
+        sock.close()
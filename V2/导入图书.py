@@ -0,0 +1,12 @@
+import os
+import sys
+
+# 批量导入图书目录的命令行入口，在数据目录 (包含 db/ 和 index/ 的目录) 下运行：
+#   python <程序目录>/导入图书.py 目录.csv [--format csv|jsonl] [--no-index]
+# 数据目录通常不是程序目录，python -m core.book_import 在那里找不到 core 包，所以由本文件把程序目录加入导入路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from core.book_import import main
+
+if __name__ == "__main__":
+    sys.exit(main())